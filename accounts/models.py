@@ -1,9 +1,11 @@
 from datetime import date
+import time
+from django.core.cache import cache
 from django.urls import reverse
 from django.utils import timezone
 from django.core.exceptions import ValidationError
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.db import IntegrityError, models, transaction
 from django.utils.text import slugify
 import uuid
 from phonenumber_field.modelfields import PhoneNumberField
@@ -30,10 +32,60 @@ class TimeStampedModel(models.Model):
         abstract = True
 
 
+class UniqueSlugMixin:
+    """Give a model a unique slug made of a base and, when it is taken, a number.
+
+    The model implements get_slug_base and sets self.slug = self.allocate_slug() when
+    it needs a new slug. The slugs already taken by the base are read with a single
+    query, and when another process saves the same slug first the unique constraint
+    fails and the save is retried with the next free one.
+    """
+
+    # How often a save is retried when the slug was taken in the meantime
+    SLUG_SAVE_ATTEMPTS = 5
+
+    def get_slug_base(self):
+        raise NotImplementedError
+
+    def allocate_slug(self):
+        """Return the base slug, or the base with the lowest free number appended."""
+        base_slug = self.get_slug_base()
+        taken = set(
+            type(self)
+            ._default_manager.filter(
+                Q(slug=base_slug) | Q(slug__startswith=f"{base_slug}-")
+            )
+            .exclude(pk=self.pk)
+            .values_list("slug", flat=True)
+        )
+        slug = base_slug
+        counter = 1
+        while slug in taken:
+            slug = f"{base_slug}-{counter}"
+            counter += 1
+        return slug
+
+    def save(self, *args, **kwargs):
+        for attempt in range(self.SLUG_SAVE_ATTEMPTS):
+            try:
+                with transaction.atomic():
+                    return super().save(*args, **kwargs)
+            except IntegrityError:
+                slug_taken = (
+                    type(self)
+                    ._default_manager.filter(slug=self.slug)
+                    .exclude(pk=self.pk)
+                    .exists()
+                )
+                if not slug_taken or attempt == self.SLUG_SAVE_ATTEMPTS - 1:
+                    raise
+                self.slug = self.allocate_slug()
+
+
 TIMEZONES_CHOICES = [(tz, tz) for tz in zoneinfo.available_timezones()]
 
 
-class CustomUser(TimeStampedModel, AbstractUser):
+class CustomUser(UniqueSlugMixin, TimeStampedModel, AbstractUser):
     username = models.CharField(unique=True, max_length=50)
     email = models.EmailField(unique=True)
     is_active = models.BooleanField(default=True)
@@ -49,29 +101,46 @@ class CustomUser(TimeStampedModel, AbstractUser):
         choices=TIMEZONES_CHOICES,
     )
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the first name as it is stored, save compares against it
+        if "first_name" in field_names:
+            instance._stored_first_name = values[field_names.index("first_name")]
+        return instance
+
+    def get_stored_first_name(self):
+        """Return the first name in the database, only read when it was not loaded."""
+        if hasattr(self, "_stored_first_name"):
+            return self._stored_first_name
+        return (
+            CustomUser.objects.filter(pk=self.pk)
+            .values_list("first_name", flat=True)
+            .first()
+        )
+
     def save(self, *args, **kwargs):
         # Check if the object is being created or updated
         if not self.id:  # Object is being created
             self.slug = self.generate_unique_slug()
         else:  # Object is being updated
-            old_first_name = CustomUser.objects.filter(pk=self.pk).first().first_name
+            old_first_name = self.get_stored_first_name()
             if old_first_name in [None, ""] and self.first_name not in [None, ""]:
                 self.slug = self.generate_unique_slug()
             if self.slug == "" or self.slug.startswith("invited-user"):
                 self.slug = self.generate_unique_slug()
 
         super().save(*args, **kwargs)
+        self._stored_first_name = self.first_name
 
-    def generate_unique_slug(self):
+    def get_slug_base(self):
         base_slug = slugify(self.first_name)
         if base_slug == "":
             base_slug = slugify("invited-user")
-        slug = base_slug
-        counter = 1
-        while CustomUser.objects.filter(slug=slug).exists():
-            slug = f"{base_slug}-{counter}"
-            counter += 1
-        return slug
+        return base_slug
+
+    def generate_unique_slug(self):
+        return self.allocate_slug()
 
     def __str__(self):
         return self.username
@@ -80,7 +149,12 @@ class CustomUser(TimeStampedModel, AbstractUser):
         return f"{self.first_name} {self.last_name}"
 
 
-class Organization(TimeStampedModel):
+class Organization(UniqueSlugMixin, TimeStampedModel):
+    # Which bookings can not overlap, see get_conflict_scope
+    CONFLICT_SCOPE_BOOKABLE_ASSET = "bookable_asset"
+    CONFLICT_SCOPE_ASSET = "asset"
+    CONFLICT_SCOPE_ORGANIZATION = "organization"
+
     name = models.CharField(max_length=255)
     asset_name = models.CharField(max_length=25, blank=True, null=True, default="Asset")
     members = models.ManyToManyField(
@@ -95,6 +169,29 @@ class Organization(TimeStampedModel):
         default=False, help_text="An Asset can only accept one booking for a timeslot"
     )
 
+    @classmethod
+    def get_conflict_scope(
+        cls, exclusive_booking_accross_organization, exclusive_booking_accross_asset
+    ):
+        """Return the widest scope in which two bookings can not overlap for the flags.
+
+        A bookable asset never takes two bookings at once. With exclusive booking
+        across asset a booking holds every bookable asset of its asset, with exclusive
+        booking across organization it holds every bookable asset of the organization.
+        """
+        if exclusive_booking_accross_organization:
+            return cls.CONFLICT_SCOPE_ORGANIZATION
+        if exclusive_booking_accross_asset:
+            return cls.CONFLICT_SCOPE_ASSET
+        return cls.CONFLICT_SCOPE_BOOKABLE_ASSET
+
+    @property
+    def conflict_scope(self):
+        return self.get_conflict_scope(
+            self.exclusive_booking_accross_organization,
+            self.exclusive_booking_accross_asset,
+        )
+
     def clean(self):
         if (
             self.exclusive_booking_accross_organization == True
@@ -115,15 +212,12 @@ class Organization(TimeStampedModel):
             self.asset_name = self.asset_name.capitalize()
 
         if not self.id:  # Generate slug only if object is being created
-            base_slug = slugify(self.name)
-            slug = base_slug
-            counter = 1
-            while Organization.objects.filter(slug=slug).exists():
-                slug = f"{base_slug}-{counter}"
-                counter += 1
-            self.slug = slug
+            self.slug = self.allocate_slug()
         super().save(*args, **kwargs)
 
+    def get_slug_base(self):
+        return slugify(self.name)
+
     def total_members_count(self):
         return self.membership_set.all().count()
 
@@ -170,6 +264,9 @@ class Membership(TimeStampedModel):
         ).exists()
 
 
+CONFIG_VERSION_KEY = "config:version"
+
+
 class Config(models.Model):
 
     slot_duration = models.PositiveIntegerField(
@@ -221,17 +318,51 @@ class Config(models.Model):
         if self.slot_duration is not None and self.slot_duration <= 0:
             raise ValidationError(_("Slot duration must be greater than 0"))
 
+    # The config loaded by this process and the version it was loaded for
+    _cached_instance = None
+
     def save(self, *args, **kwargs):
         self.clean()
         self.pk = 1
         super(Config, self).save(*args, **kwargs)
+        # Once committed, a worker that reloads before the commit would keep the old row
+        transaction.on_commit(Config.bump_version)
 
     def delete(self, *args, **kwargs):
         pass
 
+    @classmethod
+    def get_version(cls):
+        """Return the version of the config, it changes every time the config is saved."""
+        version = cache.get(CONFIG_VERSION_KEY)
+        if version is None:
+            # Start from the current time so a version that was evicted from the cache
+            # can never come back with a number that was already used
+            cache.add(CONFIG_VERSION_KEY, time.time_ns(), None)
+            version = cache.get(CONFIG_VERSION_KEY)
+        return version
+
+    @classmethod
+    def bump_version(cls):
+        """Make every gunicorn and celery worker reload the config on its next lookup."""
+        try:
+            cache.incr(CONFIG_VERSION_KEY)
+        except ValueError:
+            cache.set(CONFIG_VERSION_KEY, time.time_ns(), None)
+
     @classmethod
     def get_instance(cls):
-        obj, created = cls.objects.get_or_create(pk=1)
+        """Return the config, or None if it has not been created yet.
+
+        The config is kept in this process until its version in the shared cache
+        changes, so looking it up does not query the database.
+        """
+        version = cls.get_version()
+        cached = cls._cached_instance
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        obj = cls.objects.filter(pk=1).first()
+        cls._cached_instance = (version, obj)
         return obj
 
     def __str__(self):
@@ -247,7 +378,7 @@ class Config(models.Model):
         return self.end_time
 
 
-class Asset(TimeStampedModel):
+class Asset(UniqueSlugMixin, TimeStampedModel):
 
     organization = models.ForeignKey(
         Organization, on_delete=models.CASCADE, related_name="Assets"
@@ -305,15 +436,12 @@ class Asset(TimeStampedModel):
             self.bookable_asset_name = self.bookable_asset_name.capitalize()
 
         if not self.id:  # Generate slug only if object is being created
-            base_slug = slugify(self.name)
-            slug = base_slug
-            counter = 1
-            while Asset.objects.filter(slug=slug).exists():
-                slug = f"{base_slug}-{counter}"
-                counter += 1
-            self.slug = slug
+            self.slug = self.allocate_slug()
         super().save(*args, **kwargs)
 
+    def get_slug_base(self):
+        return slugify(self.name)
+
     def __str__(self):
         return f"{self.name} ({self.organization.name})"
 
@@ -321,7 +449,7 @@ class Asset(TimeStampedModel):
         return self.bookable_assets.count()
 
     def get_slot_duration(self):
-        config = Config.objects.first()
+        config = Config.get_instance()
         return self.slot_duration or (config.slot_duration if config else 0)
 
     def get_slot_duration_text(self):
@@ -329,7 +457,7 @@ class Asset(TimeStampedModel):
         return convert_minutes_in_human_readable_format(slot_duration)
 
 
-class BookableAsset(TimeStampedModel):
+class BookableAsset(UniqueSlugMixin, TimeStampedModel):
     asset = models.ForeignKey(
         Asset, on_delete=models.CASCADE, related_name="bookable_assets"
     )
@@ -348,19 +476,14 @@ class BookableAsset(TimeStampedModel):
             self.name = self.name[0].upper() + self.name[1:]
 
         if not self.id:  # Generate slug only if object is being created
-            base_slug = slugify(self.name)
-            if self.name == "Any":
-                base_slug = f"{slugify(self.asset.name)}-any"
-            print(base_slug)
-            slug = base_slug
-            counter = 1
-            while BookableAsset.objects.filter(slug=slug).exists():
-                slug = f"{base_slug}-{counter}"
-                counter += 1
-            self.slug = slug
-            print(slug)
+            self.slug = self.allocate_slug()
         super().save(*args, **kwargs)
 
+    def get_slug_base(self):
+        if self.name == "Any":
+            return f"{slugify(self.asset.name)}-any"
+        return slugify(self.name)
+
     class Meta:
         unique_together = ("asset", "name")
 
@@ -57,7 +57,7 @@ def send_membership_notification_email(sender, instance, created, **kwargs):
 
     # Determine the email template and context based on booking status
     template = "email_templates/membership_notification.html"
-    website_url = f"{Config.objects.get(pk=1).website_url}{reverse('accounts:login')}"
+    website_url = f"{Config.get_instance().website_url}{reverse('accounts:login')}"
     logger.info(website_url)
 
     user_context = {
@@ -128,7 +128,7 @@ def send_membership_deletion_notification_email(sender, instance, **kwargs):
 
     # Determine the email template and context
     template = "email_templates/membership_notification.html"
-    website_url = f"{Config.objects.get(pk=1).website_url}{reverse('accounts:login')}"
+    website_url = f"{Config.get_instance().website_url}{reverse('accounts:login')}"
     user_context = {
         "subject": subject,
         "message": message,
@@ -186,7 +186,7 @@ def send_invitation_notification_email(sender, instance, created, **kwargs):
 
         # Complete message for the email body
         message = "You received this message because you were added as a participant to a booking or as a member to an organization."
-        website_url = f"{Config.objects.get(pk=1).website_url}"
+        website_url = f"{Config.get_instance().website_url}"
         invitation_token = instance.username
 
         invitation_url = (
@@ -0,0 +1,61 @@
+import datetime
+
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from accounts.models import Config
+
+
+def create_config(**kwargs):
+    values = {
+        "website_url": "http://localhost:8000",
+        "slot_duration": 30,
+        "buffer_time": 15,
+        "start_time": datetime.time(8),
+        "end_time": datetime.time(17),
+    }
+    values.update(kwargs)
+    return Config.objects.create(**values)
+
+
+@pytest.mark.django_db
+def test_get_instance_is_kept_in_process():
+    create_config()
+    assert Config.get_instance().slot_duration == 30
+
+    with CaptureQueriesContext(connection) as queries:
+        for _ in range(10):
+            Config.get_instance()
+    assert len(queries) == 0
+
+
+@pytest.mark.django_db
+def test_get_instance_reloads_after_save_in_another_process(
+    django_capture_on_commit_callbacks,
+):
+    config = create_config()
+    assert Config.get_instance().slot_duration == 30
+
+    # Another worker saves the config, only the shared version tells this one
+    Config.objects.filter(pk=config.pk).update(slot_duration=45)
+    assert Config.get_instance().slot_duration == 30
+    Config.bump_version()
+    assert Config.get_instance().slot_duration == 45
+
+    config = Config.objects.get()
+    config.slot_duration = 60
+    with django_capture_on_commit_callbacks() as callbacks:
+        config.save()
+    # The version only changes once the save is committed
+    version = Config.get_version()
+    assert Config.get_instance().slot_duration == 45
+    for callback in callbacks:
+        callback()
+    assert Config.get_version() != version
+    assert Config.get_instance().slot_duration == 60
+
+
+@pytest.mark.django_db
+def test_get_instance_without_config():
+    assert Config.get_instance() is None
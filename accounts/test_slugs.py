@@ -0,0 +1,73 @@
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from accounts.models import CustomUser, Organization
+
+
+def select_queries(queries, table):
+    return [
+        query
+        for query in queries
+        if query["sql"].startswith("SELECT") and f'FROM "{table}"' in query["sql"]
+    ]
+
+
+@pytest.mark.django_db
+def test_the_next_free_slug_is_found_with_one_query():
+    for _ in range(10):
+        Organization.objects.create(name="Room")
+    # A longer name with the same start does not take a number
+    Organization.objects.create(name="Room service")
+
+    organization = Organization(name="Room")
+    with CaptureQueriesContext(connection) as queries:
+        organization.save()
+
+    assert organization.slug == "room-10"
+    assert len(select_queries(queries, "accounts_organization")) == 1
+    assert Organization.objects.get(slug="room-service")
+
+
+@pytest.mark.django_db
+def test_a_slug_taken_in_the_meantime_is_retried(monkeypatch):
+    Organization.objects.create(name="Hall")
+    allocate_slug = Organization.allocate_slug
+    stale_slugs = ["hall"]
+
+    def allocate_stale_slug(self):
+        # Another process saved "hall" after this one looked for a free slug
+        return stale_slugs.pop() if stale_slugs else allocate_slug(self)
+
+    monkeypatch.setattr(Organization, "allocate_slug", allocate_stale_slug)
+    organization = Organization.objects.create(name="Hall")
+
+    assert organization.slug == "hall-1"
+
+
+@pytest.mark.django_db
+def test_user_updates_do_not_read_the_user_again():
+    CustomUser.objects.create(
+        username="alex", email="alex@example.com", first_name="Alex"
+    )
+    user = CustomUser.objects.get(username="alex")
+
+    user.bio = "Bio"
+    with CaptureQueriesContext(connection) as queries:
+        user.save()
+    assert not select_queries(queries, "accounts_customuser")
+    assert user.slug == "alex"
+
+
+@pytest.mark.django_db
+def test_invited_users_get_a_slug_once_they_have_a_name():
+    CustomUser.objects.create(username="invited", email="invited@example.com")
+    user = CustomUser.objects.get(username="invited")
+    assert user.slug == "invited-user"
+
+    user.first_name = "Jo"
+    user.save()
+    assert user.slug == "jo"
+    user.first_name = "Sam"
+    user.save()
+    assert CustomUser.objects.get(pk=user.pk).slug == "jo"
@@ -32,6 +32,18 @@ def combine_date_and_time(date, time) -> datetime:
     return datetime.combine(date, time)
 
 
+def make_aware_in_site_time_zone(date, time) -> datetime:
+    """Combine a date and a time of the site, which are in TIME_ZONE, into an aware datetime.
+
+    :param date: The date.
+    :param time: The time.
+    :return: A timezone aware datetime object.
+    """
+    return timezone.make_aware(
+        datetime.combine(date, time), timezone.get_default_timezone()
+    )
+
+
 def convert_12_hour_time_to_24_hour_time(time_to_convert) -> str:
     """Convert a 12-hour time to a 24-hour time.
 
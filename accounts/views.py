@@ -26,7 +26,7 @@ from accounts.utils.permissions import check_organization_permission
 from accounts.utils.seeding import seed_bookable_hours, seed_any_bookable_asset
 from bookings.forms import NoBookingsForm
 from bookings.models import Bookings, NoBookings
-from bookings.utils.booking_utils import cancel_bookings, reject_bookings
+from bookings.utils.booking_transitions import reject_bookings
 from django.db.models import Q
 
 
@@ -1,6 +1,15 @@
 from django.contrib import admin
 
-from bookings.models import Bookings
+from bookings.forms import BookingSeriesForm
+from bookings.models import Bookings, BookingSeries, NotificationOutbox
+
+
+@admin.register(BookingSeries)
+class BookingSeriesAdmin(admin.ModelAdmin):
+    # The occurrences are checked for conflicts before the series is saved
+    form = BookingSeriesForm
+
 
 # Register your models here.
 admin.site.register(Bookings)
+admin.site.register(NotificationOutbox)
@@ -0,0 +1,83 @@
+import datetime
+
+import pytest
+
+from accounts.models import (
+    Asset,
+    BookableAsset,
+    Config,
+    CustomUser,
+    Membership,
+    Organization,
+)
+from accounts.utils.seeding import seed_bookable_hours
+
+
+def next_working_day():
+    """Return the first Monday to Friday after today, see seed_bookable_hours."""
+    date = datetime.date.today() + datetime.timedelta(days=1)
+    while date.weekday() >= 5:
+        date += datetime.timedelta(days=1)
+    return date
+
+
+def next_monday():
+    date = datetime.date.today() + datetime.timedelta(days=1)
+    while date.weekday() != 0:
+        date += datetime.timedelta(days=1)
+    return date
+
+
+def create_desk(organization, default_booking_status="accepted"):
+    """Create a room bookable Monday to Friday from 8:00 to 17:00 with a single desk."""
+    asset = Asset.objects.create(
+        organization=organization,
+        name="Room",
+        slot_duration=30,
+        buffer_time=0,
+        default_booking_status=default_booking_status,
+    )
+    seed_bookable_hours(asset)
+    return BookableAsset.objects.create(asset=asset, name="Desk")
+
+
+def add_admin(organization, username="admin"):
+    """Create a user that is an admin of the organization."""
+    admin = CustomUser.objects.create(
+        username=username, email=f"{username}@example.com", first_name="Admin"
+    )
+    Membership.objects.create(
+        user=admin,
+        organization=organization,
+        role=Membership.ADMIN,
+        status="accepted",
+    )
+    return admin
+
+
+@pytest.fixture
+def config():
+    return Config.objects.create(
+        website_url="http://localhost:8000",
+        slot_duration=30,
+        buffer_time=0,
+        start_time=datetime.time(8),
+        end_time=datetime.time(17),
+    )
+
+
+@pytest.fixture
+def organization(config):
+    return Organization.objects.create(name="Organization")
+
+
+@pytest.fixture
+def desk(organization):
+    return create_desk(organization)
+
+
+@pytest.fixture
+def user():
+    return CustomUser.objects.create(
+        username="user", email="user@example.com", first_name="User"
+    )
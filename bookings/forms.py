@@ -1,6 +1,9 @@
 from django import forms
+from django.core.exceptions import ValidationError
 from accounts.models import BookableAsset
-from bookings.models import Bookings, NoBookings
+from bookings.models import Bookings, BookingSeries, NoBookings
+from bookings.services import SeriesConflict, get_series_conflicts
+from bookings.utils.slot_claims import INACTIVE_BOOKING_STATUSES
 
 
 class NoBookingsForm(forms.ModelForm):
@@ -98,3 +101,38 @@ class BookingFormOrganization(forms.ModelForm):
 
 class AddParticipantForm(forms.Form):
     email = forms.EmailField(label="Participant Email")
+
+
+class BookingSeriesForm(forms.ModelForm):
+    """Checks every occurrence of the series like create_booking_series, used by the admin."""
+
+    class Meta:
+        model = BookingSeries
+        fields = [
+            "user",
+            "bookable_asset",
+            "first_date",
+            "start_time",
+            "end_time",
+            "rrule",
+            "status",
+            "notes",
+        ]
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if self.errors or cleaned_data["status"] in INACTIVE_BOOKING_STATUSES:
+            return cleaned_data
+        series = BookingSeries(
+            id=self.instance.pk,
+            **{field: cleaned_data[field] for field in self.Meta.fields},
+        )
+        try:
+            series.clean()
+        except ValidationError:
+            # The model validation reports it after this
+            return cleaned_data
+        conflicts = get_series_conflicts(series)
+        if conflicts:
+            raise forms.ValidationError(str(SeriesConflict(conflicts)))
+        return cleaned_data
@@ -0,0 +1,126 @@
+# Generated by Django 4.2.13 on 2026-10-18 10:23
+
+import datetime
+import math
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# The slot arithmetic of bookings.utils.slot_engine as it was when this migration was
+# written, copied so later changes to the app can not change what it does
+def time_to_minutes(time_value):
+    minutes = time_value.hour * 60 + time_value.minute
+    if time_value.second or time_value.microsecond:
+        minutes += (time_value.second + time_value.microsecond / 1000000) / 60
+    return minutes
+
+
+def minutes_to_time(minutes):
+    return datetime.time(*divmod(int(minutes), 60))
+
+
+def covered_slot_starts(start, end, anchor, duration):
+    """Return the starts of the slots on the grid of anchor that overlap start to end."""
+    first_slot = math.floor((start - anchor) / duration)
+    last_slot = math.ceil((end - anchor) / duration)
+    return [
+        anchor + slot * duration
+        for slot in range(first_slot, last_slot)
+        if anchor + slot * duration >= 0
+    ]
+
+
+def claim_slots_of_upcoming_bookings(apps, schema_editor):
+    """Give the active bookings from today on their claims, see bookings.utils.slot_claims."""
+    Bookings = apps.get_model("bookings", "Bookings")
+    SlotClaim = apps.get_model("bookings", "SlotClaim")
+    AssetBookableHours = apps.get_model("accounts", "AssetBookableHours")
+    Config = apps.get_model("accounts", "Config")
+
+    config = Config.objects.filter(pk=1).first()
+    config_slot_duration = config.slot_duration if config else 30
+    day_starts = {
+        (hours.asset_id, hours.day_of_week): time_to_minutes(hours.start_time)
+        for hours in AssetBookableHours.objects.all()
+    }
+
+    claims = []
+    bookings = (
+        Bookings.objects.filter(date__gte=datetime.date.today())
+        .exclude(status__in=["rejected", "canceled"])
+        .exclude(bookable_asset__name="Any")
+        .select_related("bookable_asset__asset")
+    )
+    for booking in bookings:
+        asset = booking.bookable_asset.asset
+        slot_duration = asset.slot_duration or config_slot_duration
+        # Weekdays are numbered from Sunday, see DAYS_OF_WEEK
+        day_start = day_starts.get((asset.id, (booking.date.weekday() + 1) % 7), 0)
+        for start in covered_slot_starts(
+            time_to_minutes(booking.start_time),
+            time_to_minutes(booking.end_time),
+            day_start % slot_duration,
+            slot_duration,
+        ):
+            claims.append(
+                SlotClaim(
+                    bookable_asset_id=booking.bookable_asset_id,
+                    date=booking.date,
+                    start_time=minutes_to_time(start),
+                    booking_id=booking.id,
+                )
+            )
+    # Overlapping bookings that were made before the claims existed keep the first claim
+    SlotClaim.objects.bulk_create(claims, batch_size=1000, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0003_config_website_url_alter_config_buffer_time_and_more"),
+        ("bookings", "0004_remove_bookings_notification_sent_and_more"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SlotClaim",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("date", models.DateField()),
+                ("start_time", models.TimeField()),
+                (
+                    "bookable_asset",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="slot_claims",
+                        to="accounts.bookableasset",
+                    ),
+                ),
+                (
+                    "booking",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="slot_claims",
+                        to="bookings.bookings",
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("bookable_asset", "date", "start_time")},
+            },
+        ),
+        migrations.RunPython(
+            claim_slots_of_upcoming_bookings, migrations.RunPython.noop
+        ),
+    ]
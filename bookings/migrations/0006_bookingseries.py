@@ -0,0 +1,71 @@
+# Generated by Django 4.2.13 on 2026-10-18 10:27
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("accounts", "0003_config_website_url_alter_config_buffer_time_and_more"),
+        ("bookings", "0005_slotclaim"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="BookingSeries",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("create_datetime", models.DateTimeField(auto_now_add=True)),
+                ("update_datetime", models.DateTimeField(auto_now=True)),
+                ("start_time", models.TimeField()),
+                ("end_time", models.TimeField()),
+                ("rrule", models.CharField(max_length=255)),
+                ("first_date", models.DateField()),
+                ("last_date", models.DateField(blank=True, editable=False, null=True)),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("pending", "Pending"),
+                            ("rejected", "Rejected"),
+                            ("accepted", "Accepted"),
+                            ("canceled", "Canceled"),
+                        ],
+                        default="pending",
+                        max_length=10,
+                    ),
+                ),
+                ("notes", models.TextField(blank=True, null=True)),
+                (
+                    "bookable_asset",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="booking_series",
+                        to="accounts.bookableasset",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name_plural": "Booking series",
+                "ordering": ["first_date", "start_time"],
+            },
+        ),
+    ]
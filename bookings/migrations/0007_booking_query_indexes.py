@@ -0,0 +1,33 @@
+# Generated by Django 4.2.13 on 2026-10-18 10:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bookings", "0006_bookingseries"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="bookings",
+            index=models.Index(
+                fields=["bookable_asset", "date", "start_time"],
+                name="bookings_asset_date_time_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="bookings",
+            index=models.Index(
+                fields=["date", "status", "start_time"], name="bookings_date_status_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="nobookings",
+            index=models.Index(
+                fields=["asset", "start_date", "end_date"],
+                name="nobookings_asset_dates_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,119 @@
+# Generated by Django 4.2.13 on 2026-10-18 10:41
+
+import datetime
+
+from django.db import migrations, models
+from django.utils import timezone
+
+# Accepted bookings of a bookable asset can not overlap, only PostgreSQL can enforce it
+EXCLUSION_CONSTRAINT = "bookings_accepted_no_overlap"
+BACKFILL_BATCH_SIZE = 1000
+
+
+def make_aware(date, time):
+    # A copy of make_aware_in_site_time_zone, so later changes to it leave this alone
+    return timezone.make_aware(
+        datetime.datetime.combine(date, time), timezone.get_default_timezone()
+    )
+
+
+def backfill_booking_ranges(apps, schema_editor):
+    """Write start_at and end_at of the existing bookings, see Bookings.set_range."""
+    Bookings = apps.get_model("bookings", "Bookings")
+    batch = []
+    for booking in (
+        Bookings.objects.only("date", "start_time", "end_time")
+        .order_by("id")
+        .iterator(chunk_size=BACKFILL_BATCH_SIZE)
+    ):
+        end_date = booking.date
+        if booking.end_time < booking.start_time:
+            end_date += datetime.timedelta(days=1)
+        booking.start_at = make_aware(booking.date, booking.start_time)
+        booking.end_at = make_aware(end_date, booking.end_time)
+        batch.append(booking)
+        if len(batch) == BACKFILL_BATCH_SIZE:
+            Bookings.objects.bulk_update(batch, ["start_at", "end_at"])
+            batch = []
+    if batch:
+        Bookings.objects.bulk_update(batch, ["start_at", "end_at"])
+
+
+def add_exclusion_constraint(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    # The constraint can not be added while accepted bookings overlap, they are listed
+    # so an admin can reject or move them before the migration is run again
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT first.id, second.id FROM bookings_bookings first "
+            "JOIN bookings_bookings second "
+            "ON first.bookable_asset_id = second.bookable_asset_id "
+            "AND first.id < second.id "
+            "AND first.start_at < second.end_at AND second.start_at < first.end_at "
+            "WHERE first.status = 'accepted' AND second.status = 'accepted' "
+            "ORDER BY first.id, second.id"
+        )
+        overlapping = cursor.fetchall()
+    if overlapping:
+        raise RuntimeError(
+            "These accepted bookings overlap, reject or move one of each pair: "
+            + ", ".join(f"{first} and {second}" for first, second in overlapping)
+        )
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS btree_gist")
+    schema_editor.execute(
+        f"ALTER TABLE bookings_bookings ADD CONSTRAINT {EXCLUSION_CONSTRAINT} "
+        "EXCLUDE USING gist (bookable_asset_id WITH =, tstzrange(start_at, end_at) WITH &&) "
+        "WHERE (status = 'accepted')"
+    )
+
+
+def remove_exclusion_constraint(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute(
+        f"ALTER TABLE bookings_bookings DROP CONSTRAINT IF EXISTS {EXCLUSION_CONSTRAINT}"
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bookings", "0007_booking_query_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="bookings",
+            name="end_at",
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="bookings",
+            name="start_at",
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="bookings",
+            index=models.Index(
+                condition=models.Q(("status", "pending")),
+                fields=["start_at", "create_datetime"],
+                name="bookings_pending_start_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="bookings",
+            index=models.Index(
+                fields=["bookable_asset", "start_at", "end_at"],
+                name="bookings_asset_range_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="bookings",
+            index=models.Index(
+                fields=["status", "start_at"], name="bookings_status_start_idx"
+            ),
+        ),
+        migrations.RunPython(backfill_booking_ranges, migrations.RunPython.noop),
+        migrations.RunPython(add_exclusion_constraint, remove_exclusion_constraint),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 4.2.13 on 2026-10-18 10:46
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bookings", "0008_bookings_start_at_end_at"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="NotificationOutbox",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("create_datetime", models.DateTimeField(auto_now_add=True)),
+                ("update_datetime", models.DateTimeField(auto_now=True)),
+                (
+                    "kind",
+                    models.CharField(
+                        choices=[
+                            ("booking_created", "Booking created"),
+                            ("booking_updated", "Booking updated"),
+                            ("participants_added", "Participants added"),
+                            ("participants_removed", "Participants removed"),
+                        ],
+                        max_length=32,
+                    ),
+                ),
+                ("participant_ids", models.JSONField(blank=True, default=list)),
+                ("delivered_messages", models.JSONField(blank=True, default=list)),
+                ("attempts", models.PositiveSmallIntegerField(default=0)),
+                ("claimed_datetime", models.DateTimeField(blank=True, null=True)),
+                ("processed_datetime", models.DateTimeField(blank=True, null=True)),
+                ("last_error", models.TextField(blank=True)),
+                (
+                    "booking",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="outbox",
+                        to="bookings.bookings",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["id"],
+                "indexes": [
+                    models.Index(
+                        condition=models.Q(("processed_datetime", None)),
+                        fields=["create_datetime"],
+                        name="outbox_unprocessed_idx",
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,92 @@
+# Generated by Django 4.2.13 on 2026-10-18 10:56
+
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+from django.utils import timezone
+
+# The subjects the reminders were recognised by before the ledger
+REMINDER_SUBJECTS = {
+    "today": "Booking Reminder Today",
+    "in_30_min": "Booking starting in 30 minutes",
+}
+
+
+def backfill_reminder_ledger(apps, schema_editor):
+    """Record the reminders already sent for bookings that have not started yet,
+    so they are not sent again after the upgrade."""
+    BookingNotification = apps.get_model("bookings", "BookingNotification")
+    ReminderLedger = apps.get_model("bookings", "ReminderLedger")
+    now = timezone.now()
+    for reminder_kind, subject in REMINDER_SUBJECTS.items():
+        booking_ids = (
+            BookingNotification.objects.filter(
+                subject=subject, booking__end_at__gte=now
+            )
+            .values_list("booking_id", flat=True)
+            .distinct()
+        )
+        ReminderLedger.objects.bulk_create(
+            [
+                ReminderLedger(booking_id=booking_id, reminder_kind=reminder_kind)
+                for booking_id in booking_ids
+            ],
+            batch_size=1000,
+            ignore_conflicts=True,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bookings", "0009_notificationoutbox"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ReminderLedger",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "reminder_kind",
+                    models.CharField(
+                        choices=[
+                            ("today", "Booking today"),
+                            ("in_30_min", "Booking in 30 minutes"),
+                            ("still_pending", "Booking still pending"),
+                        ],
+                        max_length=32,
+                    ),
+                ),
+                (
+                    "claim_token",
+                    models.UUIDField(default=uuid.uuid4, editable=False),
+                ),
+                ("sent_datetime", models.DateTimeField(auto_now_add=True)),
+                (
+                    "booking",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="reminders",
+                        to="bookings.bookings",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="reminderledger",
+            constraint=models.UniqueConstraint(
+                fields=("booking", "reminder_kind"),
+                name="reminder_ledger_booking_kind_unique",
+            ),
+        ),
+        migrations.RunPython(backfill_reminder_ledger, migrations.RunPython.noop),
+    ]
@@ -1,4 +1,6 @@
+import datetime
 import uuid
+from dateutil.rrule import rrule, rrulestr
 from django.db import models
 from django.core.exceptions import ValidationError
 from django.utils.translation import gettext_lazy as _
@@ -11,12 +13,33 @@ from accounts.models import (
     Organization,
     TimeStampedModel,
 )
-from accounts.utils.date_time import DAYS_OF_WEEK
+from accounts.utils.date_time import DAYS_OF_WEEK, make_aware_in_site_time_zone
 from bookings.utils.booking_utils import BOOKING_STATUS_CHOICES
 
 # Create your models here.
 
 
+def get_booking_range(date, start_time, end_time):
+    """Return the aware start and end datetimes of a booking on date from start_time to end_time.
+
+    A booking that ends before it starts crosses midnight and ends on the next day.
+    """
+    end_date = date + datetime.timedelta(days=1) if end_time < start_time else date
+    return (
+        make_aware_in_site_time_zone(date, start_time),
+        make_aware_in_site_time_zone(end_date, end_time),
+    )
+
+
+class BookingsQuerySet(models.QuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        # bulk_create does not call save, the range has to be filled in here
+        objs = list(objs)
+        for booking in objs:
+            booking.set_range()
+        return super().bulk_create(objs, *args, **kwargs)
+
+
 class Bookings(TimeStampedModel):
     user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
     date = models.DateField()
@@ -31,8 +54,42 @@ class Bookings(TimeStampedModel):
         CustomUser, related_name="booking_participants", blank=True
     )
     notes = models.TextField(blank=True, null=True)
+    # The same time as date, start_time and end_time as a range, written on every save
+    # while both are kept. Overlaps are queried on the range, it also holds bookings
+    # that cross midnight.
+    start_at = models.DateTimeField(null=True, blank=True, editable=False)
+    end_at = models.DateTimeField(null=True, blank=True, editable=False)
+
+    objects = BookingsQuerySet.as_manager()
+
+    # The status and start_at the booking was loaded or last saved with, None when
+    # unknown, see schedule_booking_reminders_on_save
+    _saved_schedule = None
+    # The bookable asset the booking was loaded or last saved with, see
+    # invalidate_booking_availability
+    _saved_bookable_asset_id = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        booking = super().from_db(db, field_names, values)
+        if "status" in booking.__dict__ and "start_at" in booking.__dict__:
+            booking._saved_schedule = (booking.status, booking.start_at)
+        booking._saved_bookable_asset_id = booking.__dict__.get("bookable_asset_id")
+        return booking
+
+    def set_range(self):
+        self.start_at, self.end_at = get_booking_range(
+            self.date, self.start_time, self.end_time
+        )
 
     def save(self, *args, **kwargs):
+        self.set_range()
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and {"date", "start_time", "end_time"} & set(
+            update_fields
+        ):
+            kwargs["update_fields"] = set(update_fields) | {"start_at", "end_at"}
+
         if not self.id:  # Only set default status on first save
             # Fetch the related asset's default appointment status
             default_status = self.bookable_asset.asset.default_booking_status
@@ -50,8 +107,9 @@ class Bookings(TimeStampedModel):
     def get_end_time(self):
         return self.end_time
 
-    def clean(self):  # Ensure start date is before end date
-        if self.start_time > self.end_time:
+    def clean(self):
+        # An end time before the start time is on the next day, the booking crosses midnight
+        if self.start_time == self.end_time:
             raise ValidationError(_("Start time must be before end time"))
 
     def remove_participant(self, user):
@@ -62,6 +120,132 @@ class Bookings(TimeStampedModel):
 
     class Meta:
         ordering = ["date", "start_time"]
+        indexes = [
+            # The busy intervals of a bookable asset, an asset or a whole organization
+            # are looked up by bookable asset, date and time, see
+            # get_conflicting_bookable_assets
+            models.Index(
+                fields=["bookable_asset", "date", "start_time"],
+                name="bookings_asset_date_time_idx",
+            ),
+            # The reminders of today and the dashboard counts
+            models.Index(
+                fields=["date", "status", "start_time"],
+                name="bookings_date_status_idx",
+            ),
+            # The reminder for bookings still pending, only a few bookings are pending
+            models.Index(
+                fields=["start_at", "create_datetime"],
+                condition=models.Q(status="pending"),
+                name="bookings_pending_start_idx",
+            ),
+            # Overlap queries on the range, on PostgreSQL accepted bookings of a
+            # bookable asset are also kept from overlapping by an exclusion constraint,
+            # see migration 0008
+            models.Index(
+                fields=["bookable_asset", "start_at", "end_at"],
+                name="bookings_asset_range_idx",
+            ),
+            models.Index(
+                fields=["status", "start_at"],
+                name="bookings_status_start_idx",
+            ),
+        ]
+
+
+class BookingSeries(TimeStampedModel):
+    """A booking that repeats following an RRULE (RFC 5545), like FREQ=WEEKLY;COUNT=10.
+
+    The occurrences are not stored as bookings, they are expanded from the rule only for
+    the dates that are looked at, see get_occurrences. A series without COUNT or UNTIL
+    repeats forever and has no last_date.
+    """
+
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
+    bookable_asset = models.ForeignKey(
+        BookableAsset, on_delete=models.CASCADE, related_name="booking_series"
+    )
+    start_time = models.TimeField()
+    end_time = models.TimeField()
+    rrule = models.CharField(max_length=255)
+    first_date = models.DateField()
+    last_date = models.DateField(null=True, blank=True, editable=False)
+    status = models.CharField(
+        max_length=10, choices=BOOKING_STATUS_CHOICES, default="pending"
+    )
+    notes = models.TextField(blank=True, null=True)
+
+    def __str__(self):
+        return f"{self.bookable_asset} {self.rrule} from {self.first_date}"
+
+    def get_rrule(self):
+        rule = rrulestr(
+            self.rrule,
+            dtstart=datetime.datetime.combine(self.first_date, datetime.time()),
+        )
+        if not isinstance(rule, rrule):
+            raise ValueError("Only a single RRULE is supported")
+        return rule
+
+    def is_endless(self):
+        rule = self.rrule.upper()
+        return "COUNT=" not in rule and "UNTIL=" not in rule
+
+    def get_dates(self, start_date, end_date):
+        """Return the dates of the occurrences between start_date and end_date (inclusive)."""
+        start_date = max(start_date, self.first_date)
+        if self.last_date is not None:
+            end_date = min(end_date, self.last_date)
+        if start_date > end_date:
+            return []
+        return [
+            occurrence.date()
+            for occurrence in self.get_rrule().between(
+                datetime.datetime.combine(start_date, datetime.time()),
+                datetime.datetime.combine(end_date, datetime.time()),
+                inc=True,
+            )
+        ]
+
+    def get_occurrences(self, start_date, end_date):
+        """Return the occurrences between start_date and end_date as unsaved bookings."""
+        return [
+            Bookings(
+                user_id=self.user_id,
+                date=date,
+                start_time=self.start_time,
+                end_time=self.end_time,
+                bookable_asset_id=self.bookable_asset_id,
+                status=self.status,
+                notes=self.notes,
+            )
+            for date in self.get_dates(start_date, end_date)
+        ]
+
+    def clean(self):
+        if self.start_time >= self.end_time:
+            raise ValidationError(_("Start time must be before end time"))
+        try:
+            rule = self.get_rrule()
+        except ValueError:
+            raise ValidationError(_("The recurrence rule is not valid"))
+        if (
+            rule.after(
+                datetime.datetime.combine(self.first_date, datetime.time()), inc=True
+            )
+            is None
+        ):
+            raise ValidationError(_("The recurrence rule has no occurrences"))
+
+    def save(self, *args, **kwargs):
+        self.last_date = None
+        if not self.is_endless():
+            self.last_date = self.get_rrule()[-1].date()
+        super().save(*args, **kwargs)
+
+    class Meta:
+        ordering = ["first_date", "start_time"]
+        verbose_name_plural = "Booking series"
 
 
 class NoBookings(TimeStampedModel):
@@ -101,6 +285,43 @@ class NoBookings(TimeStampedModel):
         self.clean()
         super().save(*args, **kwargs)
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["asset", "start_date", "end_date"],
+                name="nobookings_asset_dates_idx",
+            ),
+        ]
+
+
+class SlotClaim(models.Model):
+    """A slot of a bookable asset held by an active booking.
+
+    There can only be one claim per slot, so two bookings racing for the same slot
+    are told apart by the unique constraint instead of by looking at the bookings.
+    The claim is taken before its booking is saved and is kept in line with the
+    booking by bookings.utils.slot_claims.
+    """
+
+    bookable_asset = models.ForeignKey(
+        BookableAsset, on_delete=models.CASCADE, related_name="slot_claims"
+    )
+    date = models.DateField()
+    start_time = models.TimeField()
+    booking = models.ForeignKey(
+        Bookings,
+        on_delete=models.CASCADE,
+        related_name="slot_claims",
+        null=True,
+        blank=True,
+    )
+
+    def __str__(self):
+        return f"{self.bookable_asset} {self.date} {self.start_time}"
+
+    class Meta:
+        unique_together = ["bookable_asset", "date", "start_time"]
+
 
 class BookingNotification(TimeStampedModel):
     booking = models.ForeignKey(Bookings, on_delete=models.CASCADE)
@@ -116,3 +337,86 @@ class BookingNotification(TimeStampedModel):
 
     class Meta:
         ordering = ["-id"]
+
+
+class ReminderLedger(models.Model):
+    """A reminder that was sent for a booking, at most one of each kind.
+
+    A reminder task inserts the row before it sends the reminder and skips the
+    booking when the row is already there, so two runs that overlap send it once.
+    The rows a run inserted carry its claim token, see bookings.utils.reminder_ledger.
+    """
+
+    TODAY = "today"
+    IN_30_MIN = "in_30_min"
+    STILL_PENDING = "still_pending"
+    KIND_CHOICES = [
+        (TODAY, "Booking today"),
+        (IN_30_MIN, "Booking in 30 minutes"),
+        (STILL_PENDING, "Booking still pending"),
+    ]
+
+    booking = models.ForeignKey(
+        Bookings, on_delete=models.CASCADE, related_name="reminders"
+    )
+    reminder_kind = models.CharField(max_length=32, choices=KIND_CHOICES)
+    claim_token = models.UUIDField(default=uuid.uuid4, editable=False)
+    sent_datetime = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.get_reminder_kind_display()} {self.booking_id}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["booking", "reminder_kind"],
+                name="reminder_ledger_booking_kind_unique",
+            ),
+        ]
+
+
+class NotificationOutbox(TimeStampedModel):
+    """A notification about a booking that still has to be rendered and sent.
+
+    The row is inserted in the transaction that saves the booking, so it only exists
+    when the booking does, and a worker renders and sends it after the commit, see
+    bookings.utils.notification_outbox. Rows that are not processed, because the
+    worker failed or was never told about them, are picked up again by
+    bookings.tasks.dispatch_notification_outbox.
+    """
+
+    BOOKING_CREATED = "booking_created"
+    BOOKING_UPDATED = "booking_updated"
+    PARTICIPANTS_ADDED = "participants_added"
+    PARTICIPANTS_REMOVED = "participants_removed"
+    KIND_CHOICES = [
+        (BOOKING_CREATED, "Booking created"),
+        (BOOKING_UPDATED, "Booking updated"),
+        (PARTICIPANTS_ADDED, "Participants added"),
+        (PARTICIPANTS_REMOVED, "Participants removed"),
+    ]
+
+    booking = models.ForeignKey(
+        Bookings, on_delete=models.CASCADE, related_name="outbox"
+    )
+    kind = models.CharField(max_length=32, choices=KIND_CHOICES)
+    participant_ids = models.JSONField(default=list, blank=True)
+    # The keys of the messages an earlier attempt sent, see OutboxMessages
+    delivered_messages = models.JSONField(default=list, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    claimed_datetime = models.DateTimeField(null=True, blank=True)
+    processed_datetime = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+
+    def __str__(self):
+        return f"{self.get_kind_display()} {self.booking_id}"
+
+    class Meta:
+        ordering = ["id"]
+        indexes = [
+            models.Index(
+                fields=["create_datetime"],
+                condition=models.Q(processed_datetime=None),
+                name="outbox_unprocessed_idx",
+            ),
+        ]
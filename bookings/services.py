@@ -1,72 +1,454 @@
 import datetime
 
+from django.db import IntegrityError, transaction
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
 
-from accounts.models import Asset, BookableAsset
+from accounts.models import Asset, BookableAsset, Membership, Organization
+from bookings.models import Bookings, BookingSeries
+from bookings.utils.asset_schedule import get_asset_schedule
 from bookings.utils.db_helpers import (
-    calculate_bookable_asset_slots,
-    check_no_bookings_day,
-    exclude_booked_slots,
+    count_booked_bookable_assets_per_slot,
     get_bookings_for_date_and_time,
-    get_weekday_num_from_date,
-    get_working_hours_for_asset_and_day,
+    get_bookings_for_date_range,
+    get_no_bookings_dates_for_range,
+    get_series_occurrences_for_date_and_time,
+    get_series_occurrences_for_date_range,
+    split_booking_by_date,
 )
+from bookings.utils.slot_claims import (
+    SlotAlreadyClaimed,
+    claim_slots,
+    get_claimed_slots,
+    is_overlap_error,
+    lock_conflict_scope,
+)
+from bookings.utils.slot_engine import time_to_minutes
+
+# How far ahead the next available slots are searched for assets without a max_days_ahead
+NEXT_AVAILABLE_MAX_DAYS = 365
+# How far ahead a booking series that repeats forever is checked for conflicts
+SERIES_CHECK_MAX_DAYS = 365
+
+
+class SeriesConflict(Exception):
+    """Raised when occurrences of a booking series can not be booked."""
+
+    def __init__(self, dates):
+        self.dates = dates
+        super().__init__(
+            "The series can not be booked on " + ", ".join(str(date) for date in dates)
+        )
 
 
 def get_available_slots_for_bookable_asset(bookable_asset_id, date):
-    bookable_asset = get_object_or_404(BookableAsset, id=bookable_asset_id)
-    # Check if the provided date is a day off for the staff member
-    days_off_exist = check_no_bookings_day(asset_id=bookable_asset.asset.id, date=date)
-    print(f"days_off_exist: {days_off_exist} ")
-    if days_off_exist:
-        return []
+    return [
+        slot for slot, _ in get_available_slots_with_capacity(bookable_asset_id, date)
+    ]
+
+
+def get_available_slots_with_capacity(bookable_asset_id, date):
+    """Get the available slots for the given bookable asset on a date with their free capacity.
 
-    # Check if the staff member works on the provided date
-    day_of_week = get_weekday_num_from_date(
-        date
-    )  # Python's weekday starts from Monday (0) to Sunday (6)
-    print(f"day of week: {day_of_week}")
-    working_hours_dict = get_working_hours_for_asset_and_day(
-        bookable_asset.asset.id, day_of_week
+    :return: A list of (slot, free_capacity) tuples, see get_capacity_range.
+    """
+    bookable_asset = get_object_or_404(
+        BookableAsset.objects.select_related("asset"), id=bookable_asset_id
     )
-    print(f"working hours dict: {working_hours_dict}")
-    if not working_hours_dict:
-        return []
+    return get_capacity_range(bookable_asset, date, date)[date]
+
+
+def get_availability_range(bookable_asset, start_date, end_date):
+    """Get the available slots for the given bookable asset for every date in a range.
+
+    :param bookable_asset: The bookable asset to get the availability for.
+    :param start_date: The first date of the range.
+    :param end_date: The last date of the range (inclusive).
+    :return: A dictionary mapping every date in the range to a sorted list of available slots.
+    """
+    return {
+        date: [slot for slot, _ in slots]
+        for date, slots in get_capacity_range(
+            bookable_asset, start_date, end_date
+        ).items()
+    }
+
+
+def get_capacity_range(bookable_asset, start_date, end_date):
+    """Get the available slots and their free capacity for every date in a range.
+
+    :param bookable_asset: The bookable asset to get the availability for.
+    :param start_date: The first date of the range.
+    :param end_date: The last date of the range (inclusive).
+    :return: A dictionary mapping every date in the range to a sorted list of
+        (slot, free_capacity) tuples, see get_capacity_range_for_bookable_assets.
+    """
+    return get_capacity_range_for_bookable_assets(
+        bookable_asset.asset, [bookable_asset], start_date, end_date
+    )[bookable_asset.id]
+
+
+def get_capacity_range_for_bookable_assets(
+    asset, bookable_assets, start_date, end_date
+):
+    """Get the available slots and their free capacity of several bookable assets of one asset.
+
+    The no bookings days, bookable hours, config, bookings and booking series for the
+    whole range are loaded once for all the bookable assets, so the number of queries does not grow
+    with the number of days or bookable assets. For the "Any" bookable asset the
+    bookings of all its siblings are part of the same query and a slot is available
+    while at least one sibling is free.
+
+    When the organization does not allow overlapping bookings across an asset or the
+    whole organization, every booking in that scope holds all the bookable assets, the
+    bookings of the scope are then fetched with the same single query.
+
+    :param asset: The asset the bookable assets belong to.
+    :param bookable_assets: The bookable assets of the asset to get the availability for.
+    :param start_date: The first date of the range.
+    :param end_date: The last date of the range (inclusive).
+    :return: A dictionary mapping the id of every bookable asset to a dictionary mapping
+        every date in the range to a sorted list of (slot, free_capacity) tuples.
+        free_capacity is the number of free siblings for the "Any" bookable asset and
+        None for a single bookable asset.
+    """
+    slots_by_date, slot_duration = get_slots_for_date_range(asset, start_date, end_date)
+    schedule = get_asset_schedule(asset.id)
+    is_exclusive = schedule.conflict_scope != Organization.CONFLICT_SCOPE_BOOKABLE_ASSET
+
+    booked_ids = {
+        bookable_asset.id
+        for bookable_asset in bookable_assets
+        if bookable_asset.name != "Any"
+    }
+    pool_ids = []
+    if any(bookable_asset.name == "Any" for bookable_asset in bookable_assets):
+        pool_ids = list(
+            BookableAsset.objects.filter(asset=asset)
+            .exclude(name="Any")
+            .values_list("id", flat=True)
+        )
+        booked_ids.update(pool_ids)
+    booked_bookable_assets = schedule.get_conflicting_bookable_assets(booked_ids)
+
+    bookings = list(
+        get_bookings_for_date_range(start_date, end_date, booked_bookable_assets).only(
+            "date", "start_time", "end_time", "bookable_asset_id"
+        )
+    )
+    bookings += get_series_occurrences_for_date_range(
+        start_date, end_date, booked_bookable_assets
+    )
+    bookings_by_date = {}
+    for booking in bookings:
+        # A booking that crosses midnight is busy time on both dates
+        for date, _, _ in split_booking_by_date(booking):
+            bookings_by_date.setdefault(date, {}).setdefault(
+                booking.bookable_asset_id, []
+            ).append(booking)
+
+    capacity = {}
+    for bookable_asset in bookable_assets:
+        is_pool = bookable_asset.name == "Any"
+        total_capacity = len(pool_ids) if is_pool else 1
+        capacity[bookable_asset.id] = {}
+        for date, slots in slots_by_date.items():
+            date_bookings = bookings_by_date.get(date, {})
+            if is_pool or is_exclusive:
+                bookings = [
+                    booking
+                    for sibling_bookings in date_bookings.values()
+                    for booking in sibling_bookings
+                ]
+            else:
+                bookings = date_bookings.get(bookable_asset.id, [])
+            booked_counts = count_booked_bookable_assets_per_slot(
+                bookings, slots, slot_duration, date
+            )
+            if is_exclusive:
+                # One booking anywhere in the scope holds all the bookable assets
+                booked_counts = [
+                    total_capacity if booked else 0 for booked in booked_counts
+                ]
+            capacity[bookable_asset.id][date] = [
+                (slot, total_capacity - booked if is_pool else None)
+                for slot, booked in zip(slots, booked_counts)
+                if total_capacity - booked > 0
+            ]
+
+    return capacity
+
+
+def get_slots_for_date_range(asset, start_date, end_date):
+    """Get all the slots of an asset for every date in a range, before bookings are excluded.
+
+    The no bookings days for the whole range are loaded up front and the bookable hours
+    and config come from the memoised AssetSchedule, so the number of queries does not
+    grow with the number of days.
+
+    :param asset: The asset to get the slots for.
+    :param start_date: The first date of the range.
+    :param end_date: The last date of the range (inclusive).
+    :return: A tuple of a dictionary mapping every date in the range to a list of slots,
+        which is empty on days that can not be booked, and the slot duration as a timedelta.
+    """
+    schedule = get_asset_schedule(asset.id)
+    no_bookings_dates = get_no_bookings_dates_for_range(asset.id, start_date, end_date)
 
-    slot_duration = datetime.timedelta(minutes=bookable_asset.asset.get_slot_duration())
-    print(f"slot_duration: {slot_duration}")
-    slots = calculate_bookable_asset_slots(date, bookable_asset)
-    print(f"slots: {slots}")
-
-    if bookable_asset.name == "Any":
-        all_available_bookings = []
-        all_bookable_assets = BookableAsset.objects.filter(
-            asset=bookable_asset.asset
-        ).exclude(name="Any")
-        for bookable_asset in all_bookable_assets:
-            bookings = get_bookings_for_date_and_time(
-                date,
-                working_hours_dict["start_time"],
-                working_hours_dict["end_time"],
-                bookable_asset,
+    slots_by_date = {}
+    date = start_date
+    while date <= end_date:
+        slots_by_date[date] = (
+            [] if date in no_bookings_dates else schedule.get_slots(date)
+        )
+        date += datetime.timedelta(days=1)
+
+    return slots_by_date, datetime.timedelta(minutes=schedule.slot_duration)
+
+
+def get_bookable_assets_for_user(user, assets):
+    """Get the bookable assets of the given assets that the user can book.
+
+    Members can only book "Any" on assets where an admin assigns the bookable asset,
+    otherwise every bookable asset except "Any" is returned, "Any" would only repeat
+    the slots of its siblings.
+    """
+    admin_organization_ids = set(
+        Membership.objects.filter(user=user, role=Membership.ADMIN).values_list(
+            "organization_id", flat=True
+        )
+    )
+    bookable_assets = []
+    for bookable_asset in BookableAsset.objects.filter(asset__in=assets).select_related(
+        "asset"
+    ):
+        asset = bookable_asset.asset
+        if asset.admin_assigns_booking and asset.organization_id not in (
+            admin_organization_ids
+        ):
+            is_bookable = bookable_asset.name == "Any"
+        else:
+            is_bookable = bookable_asset.name != "Any"
+        if is_bookable:
+            bookable_assets.append(bookable_asset)
+    return bookable_assets
+
+
+def find_next_available_slots(bookable_assets, count=5, after=None):
+    """Find the first free slots of any of the given bookable assets.
+
+    Days are scanned lazily starting at the day of after, first one day, then a window
+    twice as long as the previous one, and the search stops after the first window
+    that holds enough free slots. Only the days up to the first free slots are computed.
+    The max_days_ahead, no bookings days and bookable hours of every asset are respected.
+
+    :param bookable_assets: The bookable assets to search, they may belong to different assets.
+    :param count: The number of slots to return.
+    :param after: Only slots starting after this naive local datetime are returned,
+        defaults to now.
+    :return: A list of at most count (slot, bookable_asset, free_capacity) tuples ordered by slot.
+    """
+    if after is None:
+        after = timezone.localtime().replace(tzinfo=None)
+    today = after.date()
+
+    bookable_assets_by_asset = {}
+    for bookable_asset in bookable_assets:
+        bookable_assets_by_asset.setdefault(bookable_asset.asset, []).append(
+            bookable_asset
+        )
+
+    last_dates = {}
+    for asset in bookable_assets_by_asset:
+        max_days_ahead = get_asset_schedule(asset.id).max_days_ahead
+        days_ahead = NEXT_AVAILABLE_MAX_DAYS
+        if max_days_ahead is not None and max_days_ahead > 0:
+            days_ahead = min(max_days_ahead, days_ahead)
+        last_dates[asset] = today + datetime.timedelta(days=days_ahead)
+
+    found = []
+    start_date = today
+    window_days = 1
+    while len(found) < count and bookable_assets_by_asset:
+        end_date = start_date + datetime.timedelta(days=window_days - 1)
+        for asset, asset_bookable_assets in list(bookable_assets_by_asset.items()):
+            if start_date > last_dates[asset]:
+                # The rest of the search is too far ahead for this asset
+                del bookable_assets_by_asset[asset]
+                continue
+            capacity = get_capacity_range_for_bookable_assets(
+                asset,
+                asset_bookable_assets,
+                start_date,
+                min(end_date, last_dates[asset]),
             )
-            all_available_bookings.extend(
-                exclude_booked_slots(bookings, slots, slot_duration)
+            for bookable_asset in asset_bookable_assets:
+                for slots in capacity[bookable_asset.id].values():
+                    found.extend(
+                        (slot, bookable_asset, free_capacity)
+                        for slot, free_capacity in slots
+                        if slot > after
+                    )
+        start_date = end_date + datetime.timedelta(days=1)
+        window_days *= 2
+
+    found.sort(key=lambda slot: (slot[0], slot[1].name))
+    return found[:count]
+
+
+def book_slot(user, bookable_asset, date, start_time, end_time, notes=None):
+    """Create a booking, unless another booking got one of its slots first.
+
+    The slots are claimed in the same transaction the booking is created in, so of
+    any number of concurrent requests for a slot exactly one gets it. Claims only hold
+    the bookable asset itself on the grid of its current schedule, so the scope is
+    locked and the overlapping bookings of the bookable asset, or of the asset or the
+    organization when they do not allow overlapping bookings, are looked up in that
+    transaction as well, see lock_conflict_scope.
+
+    :raises SlotAlreadyClaimed: When one of the slots is held by another booking.
+    :return: The new booking.
+    """
+    # Read the schedule before the transaction starts, SQLite can not turn a
+    # transaction that has read into one that writes while another connection is writing
+    slots = get_claimed_slots(bookable_asset, date, start_time, end_time)
+    schedule = get_asset_schedule(bookable_asset.asset_id)
+    conflicting_bookable_assets = schedule.get_conflicting_bookable_assets(
+        bookable_asset
+    )
+    with transaction.atomic():
+        # The claims are written first, SQLite only lets one transaction write at a time
+        claim_slots(bookable_asset, slots)
+        # Requests for "Any" only conflict with bookings of its siblings
+        if (
+            bookable_asset.name != "Any"
+            or schedule.conflict_scope != Organization.CONFLICT_SCOPE_BOOKABLE_ASSET
+        ):
+            lock_conflict_scope(schedule, bookable_asset)
+            if get_bookings_for_date_and_time(
+                date, start_time, end_time, conflicting_bookable_assets
+            ).exists():
+                raise SlotAlreadyClaimed(
+                    f"{bookable_asset} is already booked on {date}"
+                )
+        # Series are read after the lock as well, create_booking_series takes it too
+        if get_series_occurrences_for_date_and_time(
+            date, start_time, end_time, conflicting_bookable_assets
+        ):
+            raise SlotAlreadyClaimed(
+                f"{bookable_asset} is already booked on {date} by a booking series"
             )
+        # On PostgreSQL the exclusion constraint catches what slipped through anyway
+        try:
+            return Bookings.objects.create(
+                user=user,
+                date=date,
+                start_time=start_time,
+                end_time=end_time,
+                bookable_asset=bookable_asset,
+                notes=notes,
+            )
+        except IntegrityError as error:
+            if not is_overlap_error(error):
+                raise
+            raise SlotAlreadyClaimed(f"{bookable_asset} is already booked on {date}")
+
 
-        # Remove duplicates
-        all_available_bookings = list(set(all_available_bookings))
+def get_series_conflicts(series):
+    """Find the occurrences of a booking series that can not be booked, in one pass.
 
-        # Sort the list
-        all_available_bookings.sort()
+    Every occurrence is expanded once, up to SERIES_CHECK_MAX_DAYS ahead for a series
+    that repeats forever, and checked against the bookable hours, the no bookings days,
+    the bookings and the other series of the bookable asset, which are all loaded with
+    one query each for the whole series.
 
-        return all_available_bookings
+    :param series: The booking series to check, it does not have to be saved. When it
+        is, its own occurrences are not counted as conflicts.
+    :return: A sorted list of the dates that can not be booked.
+    """
+    last_date = series.first_date + datetime.timedelta(days=SERIES_CHECK_MAX_DAYS)
+    if not series.is_endless():
+        last_date = min(series.get_rrule()[-1].date(), last_date)
+    dates = set(series.get_dates(series.first_date, last_date))
+    if not dates:
+        return []
+
+    series_start = time_to_minutes(series.start_time)
+    series_end = time_to_minutes(series.end_time)
 
-    bookings = get_bookings_for_date_and_time(
-        date,
-        working_hours_dict["start_time"],
-        working_hours_dict["end_time"],
-        bookable_asset,
+    def overlapping_dates(booking):
+        # A booking that crosses midnight can overlap the occurrence of the next day
+        return {
+            date
+            for date, start, end in split_booking_by_date(booking)
+            if date in dates and start < series_end and series_start < end
+        }
+
+    schedule = get_asset_schedule(series.bookable_asset.asset_id)
+    conflicting_bookable_assets = schedule.get_conflicting_bookable_assets(
+        series.bookable_asset
+    )
+    conflicts = set()
+    for date in dates:
+        working_hours = schedule.get_working_hours(date)
+        if working_hours is None or not (
+            working_hours[0] <= series.start_time
+            and series.end_time <= working_hours[1]
+        ):
+            conflicts.add(date)
+    conflicts |= dates & get_no_bookings_dates_for_range(
+        series.bookable_asset.asset_id, series.first_date, last_date
     )
-    print(f"bookings {bookings}")
-    return exclude_booked_slots(bookings, slots, slot_duration)
+    for booking in get_bookings_for_date_range(
+        series.first_date, last_date, conflicting_bookable_assets
+    ).only("date", "start_time", "end_time"):
+        conflicts |= overlapping_dates(booking)
+    for occurrence in get_series_occurrences_for_date_range(
+        series.first_date,
+        last_date,
+        conflicting_bookable_assets,
+        exclude_series_id=series.pk,
+    ):
+        conflicts |= overlapping_dates(occurrence)
+    return sorted(conflicts)
+
+
+def create_booking_series(
+    user, bookable_asset, first_date, start_time, end_time, rrule, notes=None
+):
+    """Create a booking series after checking all of its occurrences.
+
+    Only the series is saved, no bookings are created for its occurrences. The series
+    is saved first and checked after the conflict scope is locked, in one transaction,
+    so a booking made at the same moment either sees the series or is seen by the
+    check, see book_slot.
+
+    :raises ValidationError: When the times or the rule are not valid.
+    :raises SeriesConflict: When occurrences can not be booked.
+    :return: The new booking series.
+    """
+    series = BookingSeries(
+        user=user,
+        bookable_asset=bookable_asset,
+        first_date=first_date,
+        start_time=start_time,
+        end_time=end_time,
+        rrule=rrule,
+        status=bookable_asset.asset.default_booking_status,
+        notes=notes,
+    )
+    series.clean()
+    schedule = get_asset_schedule(bookable_asset.asset_id)
+    with transaction.atomic():
+        series.save()
+        lock_conflict_scope(schedule, bookable_asset)
+        conflicts = get_series_conflicts(series)
+        if conflicts:
+            raise SeriesConflict(conflicts)
+    return series
+
+
+def cancel_booking_series(series):
+    """Cancel every occurrence of a booking series, only the series itself is updated."""
+    series.status = "canceled"
+    series.save()
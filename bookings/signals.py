@@ -1,25 +1,44 @@
-from datetime import datetime
-
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
-from django.template.loader import render_to_string
-from django.utils.html import strip_tags
 from django.db.models.signals import m2m_changed
 
-from bookings.utils.generate_calendar_links import (
-    generate_ics_file,
+from bookings.utils.asset_schedule import (
+    bump_bookings_version,
+    bump_schedule_version,
+)
+from bookings.utils.reminder_ledger import forget_reminders
+from bookings.utils.slot_claims import sync_slot_claims
+from bookings.tasks import (
+    process_notification_outbox,
+    schedule_booking_reminders,
+    unschedule_booking_reminders,
 )
-from bookings.utils.email_helpers import (
-    generate_booking_notifications,
-    generate_email_subject,
-    get_admin_emails,
-    get_recipient_list,
-    prepare_calendar_event_details,
-    prepare_email_context,
-    update_context_with_calendar_details,
+from accounts.models import (
+    Asset,
+    AssetBookableHours,
+    BookableAsset,
+    Organization,
 )
-from .models import Bookings
-from config.tasks import send_email_with_attachment
+from .models import Bookings, BookingSeries, NoBookings, NotificationOutbox
+
+
+def enqueue_notification(booking, kind, participant_ids=()):
+    """Insert an outbox row for the booking and send it once the transaction commits.
+
+    Nothing is rendered or sent in the request, the row is written in the same
+    transaction as the booking and a worker sends it after the commit. When the commit
+    is rolled back the row is gone as well, so no email is sent about a booking that
+    does not exist.
+
+    :param booking: The booking the notification is about.
+    :param kind: One of the NotificationOutbox kinds.
+    :param participant_ids: The ids of the participants that were added or removed.
+    """
+    entry = NotificationOutbox.objects.create(
+        booking=booking, kind=kind, participant_ids=sorted(participant_ids)
+    )
+    transaction.on_commit(lambda: process_notification_outbox.delay(entry.id))
 
 
 @receiver(m2m_changed, sender=Bookings.participants.through)
@@ -39,62 +58,14 @@ def notify_participants(sender, instance, action, reverse, model, pk_set, **kwar
     Returns:
         None
     """
-    booking = instance
-    template = "email_templates/participant_notification.html"
-
-    if action in ["post_add", "post_remove"]:
-        participants = model.objects.filter(pk__in=pk_set)
-        subject = (
-            "You've been added to a booking"
-            if action == "post_add"
-            else "You've been removed from a booking"
-        )
-        message_body = "added to" if action == "post_add" else "removed from"
-
-        for participant in participants:
-            participant_name = (
-                participant.get_full_name()
-                if participant.is_active
-                else participant.email
-            )
-            message = (
-                f"Hello {participant_name},\n\nYou have been {message_body} a booking."
-            )
-            context = {
-                "subject": subject,
-                "message": message,
-                "booking": booking,
-            }
-            if booking.status == "accepted" and action == "post_add":
-                event_details = prepare_calendar_event_details(
-                    booking,
-                    context["message"],
-                )
-                context = update_context_with_calendar_details(context, event_details)
-                ics_file_content = generate_ics_file(event_details)
-                with open("booking_event.ics", "w") as ics_file:
-                    ics_file.write(ics_file_content)
-
-            if action == "post_remove":
-                context["removed"] = True
-            html_message = render_to_string(template, context)
-            plain_message = strip_tags(html_message)
-
-            # Send email to the participant
-            send_email_with_attachment.delay(
-                subject,
-                plain_message,
-                html_message,
-                [participant.email],
-                (
-                    ics_file_content
-                    if booking.status == "accepted" and action == "post_add"
-                    else None
-                ),
-            )
-            generate_booking_notifications(
-                booking, [participant.email], subject, plain_message
-            )
+    if action not in ["post_add", "post_remove"] or not pk_set:
+        return
+    kind = (
+        NotificationOutbox.PARTICIPANTS_ADDED
+        if action == "post_add"
+        else NotificationOutbox.PARTICIPANTS_REMOVED
+    )
+    enqueue_notification(instance, kind, pk_set)
 
 
 @receiver(post_save, sender=Bookings)
@@ -111,67 +82,88 @@ def send_booking_notification_email(sender, instance, created, **kwargs):
     Returns:
         None
     """
-    booking = instance
+    enqueue_notification(
+        instance,
+        (
+            NotificationOutbox.BOOKING_CREATED
+            if created
+            else NotificationOutbox.BOOKING_UPDATED
+        ),
+    )
 
-    subject = generate_email_subject(booking)
-    if not created:
-        subject = f"Booking Updated for {booking.bookable_asset.asset.name} - {booking.bookable_asset.name} {subject}"
 
-    template = "email_templates/booking_notification.html"
-    ics_file_content = None
+@receiver([post_save, post_delete], sender=Bookings)
+@receiver([post_save, post_delete], sender=BookingSeries)
+def invalidate_booking_availability(sender, instance, **kwargs):
+    """Invalidate the cached availability of the asset the booking was made for.
 
-    # non admin recipients
-    non_admin_context = prepare_email_context(booking, subject)
-    if booking.status == "accepted":
-        event_details = prepare_calendar_event_details(
-            booking, non_admin_context["message"]
-        )
-        non_admin_context = update_context_with_calendar_details(
-            non_admin_context, event_details
-        )
-        ics_file_content = generate_ics_file(event_details)
-        with open("booking_event.ics", "w") as ics_file:
-            ics_file.write(ics_file_content)
-
-    non_admin_html_message = render_to_string(template, non_admin_context)
-    non_admin_plain_message = strip_tags(non_admin_html_message)
-    recipient_list = get_recipient_list(booking)
-    # Send email to non-admin recipients
-    send_email_with_attachment.delay(
-        subject,
-        non_admin_plain_message,
-        non_admin_html_message,
-        recipient_list,
-        ics_file_content if booking.status == "accepted" else None,
-    )
-    generate_booking_notifications(
-        booking, recipient_list, subject, non_admin_plain_message
-    )
-    # admin recipients
-    admin_context = prepare_email_context(booking, subject, is_admin=True)
-    if booking.status == "accepted":
-        event_details = prepare_calendar_event_details(
-            booking, admin_context["message"]
-        )
-        admin_context = update_context_with_calendar_details(
-            admin_context, event_details
+    The versions are bumped once the transaction commits, a reader that ran in between
+    would cache the availability of the old rows under the new version. A booking moved
+    to another bookable asset invalidates the asset it was moved from as well.
+    """
+    asset_ids = {instance.bookable_asset.asset_id}
+    saved_bookable_asset_id = getattr(instance, "_saved_bookable_asset_id", None)
+    if saved_bookable_asset_id not in (None, instance.bookable_asset_id):
+        asset_ids.update(
+            BookableAsset.objects.filter(id=saved_bookable_asset_id).values_list(
+                "asset_id", flat=True
+            )
         )
-        ics_file_content = generate_ics_file(event_details)
-        with open("booking_event.ics", "w") as ics_file:
-            ics_file.write(ics_file_content)
-
-    admin_html_message = render_to_string(template, admin_context)
-    admin_plain_message = strip_tags(admin_html_message)
-
-    admin_recipient_list = get_admin_emails(booking)
-    # Send email to admin recipients
-    send_email_with_attachment.delay(
-        admin_context["subject"],
-        admin_plain_message,
-        admin_html_message,
-        admin_recipient_list,
-        ics_file_content if booking.status == "accepted" else None,
-    )
-    generate_booking_notifications(
-        booking, admin_recipient_list, subject, admin_plain_message
-    )
+    if isinstance(instance, Bookings):
+        instance._saved_bookable_asset_id = instance.bookable_asset_id
+    for asset_id in asset_ids:
+        transaction.on_commit(lambda asset_id=asset_id: bump_bookings_version(asset_id))
+
+
+@receiver([post_save, post_delete], sender=NoBookings)
+@receiver([post_save, post_delete], sender=AssetBookableHours)
+@receiver([post_save, post_delete], sender=BookableAsset)
+def invalidate_asset_schedule_availability(sender, instance, **kwargs):
+    """Invalidate the cached availability when the days, hours or pool of an asset change."""
+    asset_id = instance.asset_id
+    transaction.on_commit(lambda: bump_schedule_version(asset_id))
+
+
+@receiver([post_save, post_delete], sender=Asset)
+def invalidate_asset_availability(sender, instance, **kwargs):
+    """Invalidate the schedule and cached availability when the settings of an asset change."""
+    asset_id = instance.id
+    transaction.on_commit(lambda: bump_schedule_version(asset_id))
+
+
+@receiver(post_save, sender=Organization)
+def invalidate_organization_availability(sender, instance, **kwargs):
+    """The exclusive booking flags are part of the schedule of every asset of the organization."""
+    for asset_id in Asset.objects.filter(organization=instance).values_list(
+        "id", flat=True
+    ):
+        transaction.on_commit(lambda asset_id=asset_id: bump_schedule_version(asset_id))
+
+
+@receiver(post_save, sender=Bookings)
+def sync_booking_slot_claims(sender, instance, created, **kwargs):
+    """Take, move or give back the slots of a booking when it is saved."""
+    sync_slot_claims(instance, created=created)
+
+
+@receiver(post_save, sender=Bookings)
+def schedule_booking_reminders_on_save(sender, instance, **kwargs):
+    """Schedule the reminders of the booking for the minute they are due, once it is committed.
+
+    Saves that change neither the status nor the start leave the reminders alone. A
+    booking that was moved gets its reminders again for the new start, the ledger
+    rows of the reminders sent for the old start are cleared.
+    """
+    saved_schedule = instance._saved_schedule
+    instance._saved_schedule = (instance.status, instance.start_at)
+    if saved_schedule == instance._saved_schedule:
+        return
+    if saved_schedule is not None and saved_schedule[1] != instance.start_at:
+        forget_reminders(instance.id)
+    transaction.on_commit(lambda: schedule_booking_reminders([instance]))
+
+
+@receiver(post_delete, sender=Bookings)
+def unschedule_booking_reminders_on_delete(sender, instance, **kwargs):
+    booking_id = instance.id
+    transaction.on_commit(lambda: unschedule_booking_reminders(booking_id))
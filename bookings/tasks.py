@@ -1,215 +1,426 @@
-from datetime import date, timedelta, datetime
-from celery import shared_task
+from collections import defaultdict
+from datetime import date, time, timedelta, datetime
+from celery import current_app, group, shared_task
+from django.core.cache import cache
 from bookings.utils.email_helpers import (
-    generate_booking_notifications,
-    get_admin_emails,
+    create_booking_notifications,
+    generate_email_subject,
+    get_admin_emails_by_organization,
     get_recipient_list,
-    prepare_calendar_event_details,
-    prepare_email_context,
-    update_context_with_calendar_details,
 )
-from config.tasks import send_email_with_attachment
-from django.template.loader import render_to_string
-from django.utils.html import strip_tags
+from config.mail import EmailBatch
+from config.tasks import send_email_batch
 from loguru import logger
-import pytz
 
-from bookings.utils.generate_calendar_links import generate_ics_file
-from accounts.utils.date_time import get_current_time
+from bookings.utils.email_rendering import (
+    BOOKING_STATUS_SUMMARY_TEMPLATE,
+    get_booking_email_context,
+    render_booking_notification,
+    render_email,
+)
+from bookings.utils.ics import get_booking_ics, get_bookings_ics
+from bookings.utils.availability_cache import (
+    get_availability_cache_stats,
+    reset_availability_cache_stats,
+)
+from accounts.utils.date_time import get_current_time, make_aware_in_site_time_zone
+
+from bookings.utils.notification_outbox import (
+    get_pending_outbox_entry_ids,
+    process_outbox_entry,
+)
+from bookings.utils.reminder_ledger import claim_reminders, release_reminders
+from bookings.utils.slot_claims import prune_past_slot_claims
+from bookings.utils.reminder_schedule import (
+    ADMIN_REMINDER_KINDS,
+    PENDING_REMINDER_DELAY,
+    REMINDER_EARLY_TOLERANCE,
+    REMINDER_LEAD_TIME,
+    REMINDER_SCHEDULE_HORIZON,
+    REMINDER_SUBJECTS,
+    get_booking_reminder_dues,
+    get_reminder_due,
+)
 
 from .models import Bookings
 from django.contrib.auth.models import User
-from .models import BookingNotification
+from .models import ReminderLedger
+from django.db.models import Q
 from django.utils import timezone
 
 logger.add("bookings_celery_beat.log", rotation="500 MB")
 logger.add("bookings_celery_beat.log", rotation="1 week")
 
+# Outbox rows younger than this are left to the dispatch after their commit
+OUTBOX_DISPATCH_DELAY = timedelta(minutes=1)
+# Bookings per subtask of the daily reminder
+REMINDER_CHUNK_SIZE = 50
+# The reminder tasks of a booking waiting for their eta, see schedule_booking_reminders
+SCHEDULED_REMINDERS_KEY = "booking_reminder_tasks:{booking_id}"
+
 
 @shared_task
 def send_reminder_email_booking_still_pending():
-    "send an email if a booking was created more than 24 hours ago and is still pending and is still in the Future"
-    bookings = Bookings.objects.filter(
-        status="pending",
-        create_datetime__lte=datetime.now(pytz.timezone("Africa/Johannesburg")),
-        date__gte=date.today(),
+    "remind the admins of the bookings that are pending for more than 24 hours and are still in the future"
+    now = timezone.now()
+    booking_ids = list(
+        Bookings.objects.filter(
+            status="pending",
+            start_at__gte=now,
+            create_datetime__lte=now - PENDING_REMINDER_DELAY,
+        ).values_list("id", flat=True)
     )
-    for booking in bookings:
-        if booking.create_datetime < datetime.now(
-            pytz.timezone("Africa/Johannesburg")
-        ) - timedelta(days=1):
-            subject = "Booking still pending after 24 hours"
-            admin_emails = get_admin_emails(booking)
-            admin_context = prepare_email_context(booking, subject, is_admin=True)
-            template = "email_templates/booking_notification.html"
-
-            admin_html_message = render_to_string(template, admin_context)
-            admin_plain_message = strip_tags(admin_html_message)
-
-            # Send email to admins
-            send_email_with_attachment.delay(
-                admin_context["subject"],
-                admin_plain_message,
-                admin_html_message,
-                admin_emails,
-                None,
-            )
-            generate_booking_notifications(
-                booking, admin_emails, subject, admin_plain_message
-            )
+    if booking_ids:
+        send_booking_reminders(
+            booking_ids,
+            REMINDER_SUBJECTS[ReminderLedger.STILL_PENDING],
+            ReminderLedger.STILL_PENDING,
+        )
 
-            # Log the booking details
-            logger.info(f"Reminder email sent for booking pending {booking.id}")
 
+def get_reminder_bookings(booking_ids):
+    """Load bookings with everything their reminders read, in two queries.
 
-@shared_task
-def send_reminder_email_booking_today():
-    "send an email if a booking is today"
-    bookings = Bookings.objects.filter(status="accepted", date=date.today())
-    for booking in bookings:
-        subject = "Booking Reminder Today"
-        template = "email_templates/booking_notification.html"
-        ics_file_content = None
-
-        # non admin recipients
-        non_admin_context = prepare_email_context(booking, subject)
-        if booking.status == "accepted":
-            event_details = prepare_calendar_event_details(
-                booking, non_admin_context["message"]
-            )
-            non_admin_context = update_context_with_calendar_details(
-                non_admin_context, event_details
-            )
-            ics_file_content = generate_ics_file(event_details)
-            with open("booking_event.ics", "w") as ics_file:
-                ics_file.write(ics_file_content)
-
-        non_admin_html_message = render_to_string(template, non_admin_context)
-        non_admin_plain_message = strip_tags(non_admin_html_message)
-
-        recipient_list = get_recipient_list(booking)
-        # Send email to non-admin recipients
-        send_email_with_attachment.delay(
-            subject,
-            non_admin_plain_message,
-            non_admin_html_message,
-            recipient_list,
-            ics_file_content if booking.status == "accepted" else None,
+    :param booking_ids: The ids of the bookings.
+    :return: A list of bookings with their user, bookable asset, asset, organization
+        and participants, in the order they start.
+    """
+    return list(
+        Bookings.objects.filter(id__in=booking_ids)
+        .select_related("user", "bookable_asset__asset__organization")
+        .prefetch_related("participants")
+        .order_by("start_at")
+    )
+
+
+def add_booking_reminder(
+    emails, notifications, booking, subject, admin_emails, admins_only=False
+):
+    """Render the reminder of a booking for its user and participants and for the admins.
+
+    :param emails: The EmailBatch the messages are added to.
+    :param notifications: The list the BookingNotifications to store are added to,
+        see create_booking_notifications.
+    :param booking: The booking, as loaded by get_reminder_bookings.
+    :param subject: The subject of the reminder.
+    :param admin_emails: The emails of the admins of the organization of the booking.
+    :param admins_only: Whether only the admins are reminded.
+    """
+    shared_context = get_booking_email_context(booking, subject)
+    ics_file_content = (
+        get_booking_ics(booking) if booking.status == "accepted" else None
+    )
+    for is_admin in [True] if admins_only else [False, True]:
+        email_subject, html_message, plain_message = render_booking_notification(
+            shared_context, is_admin=is_admin
         )
-        generate_booking_notifications(
-            booking, recipient_list, subject, non_admin_plain_message
+        recipient_list = admin_emails if is_admin else get_recipient_list(booking)
+        # The message is known by the index of its notification, see EmailBatch.failed_keys
+        emails.add(
+            email_subject,
+            plain_message,
+            html_message,
+            recipient_list,
+            ics_file_content,
+            key=len(notifications),
         )
+        notifications.append((booking, recipient_list, subject, plain_message))
 
-        # admin recipients
-        admin_context = prepare_email_context(booking, subject, is_admin=True)
-        if booking.status == "accepted":
-            event_details = prepare_calendar_event_details(
-                booking, admin_context["message"]
-            )
-            admin_context = update_context_with_calendar_details(
-                admin_context, event_details
+
+@shared_task
+def send_booking_reminders(booking_ids, subject, reminder_kind=None):
+    """send the reminders of a chunk of bookings, the bookings and their recipients are read up front
+
+    The emails are sent by this task, only the delivered ones are stored as notifications
+    and the ledger claims of the bookings with a message that failed are given back, so
+    the next run tries them again.
+    """
+    if reminder_kind is not None:
+        # Skip the bookings that were reminded already, by this run or one that overlaps
+        booking_ids = claim_reminders(booking_ids, reminder_kind)
+        if not booking_ids:
+            return
+    bookings = get_reminder_bookings(booking_ids)
+    admin_emails = get_admin_emails_by_organization(
+        {booking.bookable_asset.asset.organization_id for booking in bookings}
+    )
+    notifications = []
+    with EmailBatch(send=send_email_batch) as emails:
+        for booking in bookings:
+            add_booking_reminder(
+                emails,
+                notifications,
+                booking,
+                subject,
+                admin_emails[booking.bookable_asset.asset.organization_id],
+                admins_only=reminder_kind in ADMIN_REMINDER_KINDS,
             )
-            ics_file_content = generate_ics_file(event_details)
-            with open("booking_event.ics", "w") as ics_file:
-                ics_file.write(ics_file_content)
-
-        admin_html_message = render_to_string(template, admin_context)
-        admin_plain_message = strip_tags(admin_html_message)
-
-        admin_recipient_list = get_admin_emails(booking)
-        # Send email to admin recipients
-        send_email_with_attachment.delay(
-            admin_context["subject"],
-            admin_plain_message,
-            admin_html_message,
-            admin_recipient_list,
-            ics_file_content if booking.status == "accepted" else None,
+    create_booking_notifications(
+        notification
+        for index, notification in enumerate(notifications)
+        if index not in emails.failed_keys
+    )
+    failed_booking_ids = {notifications[index][0].id for index in emails.failed_keys}
+    if failed_booking_ids and reminder_kind is not None:
+        release_reminders(failed_booking_ids, reminder_kind)
+    logger.info(
+        f"Sent {subject!r} for {len(bookings) - len(failed_booking_ids)} bookings, "
+        f"{len(failed_booking_ids)} failed"
+    )
+
+
+@shared_task
+def send_reminder_email_booking_today():
+    "send an email for every booking today, fanned out over the workers in chunks"
+    today = make_aware_in_site_time_zone(date.today(), time())
+    booking_ids = list(
+        Bookings.objects.filter(
+            status="accepted",
+            start_at__gte=today,
+            start_at__lt=today + timedelta(days=1),
         )
-        generate_booking_notifications(
-            booking, admin_recipient_list, subject, admin_plain_message
+        .order_by("start_at")
+        .values_list("id", flat=True)
+    )
+    if not booking_ids:
+        return
+    group(
+        send_booking_reminders.s(
+            booking_ids[start : start + REMINDER_CHUNK_SIZE],
+            REMINDER_SUBJECTS[ReminderLedger.TODAY],
+            ReminderLedger.TODAY,
         )
-        logger.info(f"Reminder email sent for booking today {booking.id}")
+        for start in range(0, len(booking_ids), REMINDER_CHUNK_SIZE)
+    ).apply_async()
+    logger.info(f"Queued today's reminders for {len(booking_ids)} bookings")
 
 
 @shared_task
 def send_reminder_email_booking_in_30_min():
-    "send an email if a booking is in 30 minutes"
-    now = datetime.now(pytz.timezone("Africa/Johannesburg"))
-    logger.info(now.time())
-    current_time = now.time()
-    thirty_min_time = (now + timedelta(minutes=30)).time()
-    logger.info(now + timedelta(minutes=30))
-    subject = "Booking starting in 30 minutes"
-    template = "email_templates/booking_notification.html"
-    bookings = Bookings.objects.filter(
-        status="accepted",
-        date=date.today(),
-        start_time__gte=current_time,
-        start_time__lte=thirty_min_time,
-    ).exclude(
-        id__in=BookingNotification.objects.filter(subject=subject).values_list(
-            "booking", flat=True
+    "send an email if a booking is in 30 minutes and its scheduled reminder was not sent"
+    now = timezone.now()
+    booking_ids = list(
+        Bookings.objects.filter(
+            status="accepted",
+            start_at__range=(now, now + REMINDER_LEAD_TIME),
+        ).values_list("id", flat=True)
+    )
+    if booking_ids:
+        send_booking_reminders(
+            booking_ids,
+            REMINDER_SUBJECTS[ReminderLedger.IN_30_MIN],
+            ReminderLedger.IN_30_MIN,
         )
+
+
+@shared_task
+def send_scheduled_booking_reminder(booking_id, reminder_kind, due):
+    "send a reminder of a booking at the minute it is due, see schedule_booking_reminders"
+    booking = (
+        Bookings.objects.filter(id=booking_id)
+        .values("status", "start_at", "create_datetime")
+        .first()
+    )
+    due = datetime.fromisoformat(due)
+    # The booking was changed, deleted or started, its current reminders were
+    # scheduled when it was saved
+    if booking is None or get_reminder_due(reminder_kind, **booking) != due:
+        return
+    if timezone.now() < due - REMINDER_EARLY_TOLERANCE:
+        return
+    send_booking_reminders(
+        [booking_id], REMINDER_SUBJECTS[reminder_kind], reminder_kind
     )
+
+
+@shared_task
+def reconcile_booking_reminders():
+    "send the reminders that were missed and schedule the ones that come within the horizon"
+    send_reminder_email_booking_in_30_min()
+    send_reminder_email_booking_still_pending()
+
+    now = timezone.now()
+    horizon_end = now + REMINDER_SCHEDULE_HORIZON
+    bookings = Bookings.objects.filter(
+        Q(status="accepted", start_at__gt=now)
+        & Q(start_at__lte=horizon_end + REMINDER_LEAD_TIME)
+        | Q(status="pending", start_at__gt=now)
+        & Q(
+            create_datetime__gt=now - PENDING_REMINDER_DELAY,
+            create_datetime__lte=horizon_end - PENDING_REMINDER_DELAY,
+        )
+    ).only("id", "status", "start_at", "create_datetime")
+    schedule_booking_reminders(bookings)
+
+
+def get_scheduled_reminders_key(booking_id):
+    return SCHEDULED_REMINDERS_KEY.format(booking_id=booking_id)
+
+
+def revoke_reminder_tasks(task_ids):
+    "revoke reminder tasks that are waiting for their eta"
+    # Eager tasks ran when they were scheduled, there is nothing to revoke
+    if not task_ids or current_app.conf.task_always_eager:
+        return
+    current_app.control.revoke(task_ids)
+
+
+def schedule_booking_reminders(bookings):
+    """Schedule the reminders of bookings as ETA tasks and revoke the ones that no longer apply.
+
+    Only the reminders due within REMINDER_SCHEDULE_HORIZON are scheduled, the
+    reconciliation sweep schedules the others later. The scheduled tasks of a booking
+    are kept in the cache by reminder kind with the time they are due. A reminder whose due time did not change keeps its task, a
+    reminder the booking no longer gets, because it was moved, canceled or accepted,
+    is revoked. A task that is not revoked, because the cache was cleared, sees that
+    its due time is stale and does nothing.
+
+    :param bookings: The saved bookings with their status, start_at and create_datetime.
+    """
+    now = timezone.now()
     for booking in bookings:
-        logger.info(booking)
-        ics_file_content = None
-
-        # non admin recipients
-        non_admin_context = prepare_email_context(booking, subject)
-        if booking.status == "accepted":
-            event_details = prepare_calendar_event_details(
-                booking, non_admin_context["message"]
-            )
-            non_admin_context = update_context_with_calendar_details(
-                non_admin_context, event_details
-            )
-            ics_file_content = generate_ics_file(event_details)
-            with open("booking_event.ics", "w") as ics_file:
-                ics_file.write(ics_file_content)
-
-        non_admin_html_message = render_to_string(template, non_admin_context)
-        non_admin_plain_message = strip_tags(non_admin_html_message)
-        non_admin_recipients = get_recipient_list(booking)
-        # Send email to non-admin recipients
-        send_email_with_attachment.delay(
-            subject,
-            non_admin_plain_message,
-            non_admin_html_message,
-            non_admin_recipients,
-            ics_file_content if booking.status == "accepted" else None,
+        key = get_scheduled_reminders_key(booking.id)
+        scheduled = cache.get(key, {})
+        dues = {
+            reminder_kind: due.isoformat()
+            for reminder_kind, due in get_booking_reminder_dues(booking, now).items()
+            if due <= now + REMINDER_SCHEDULE_HORIZON
+        }
+        revoke_reminder_tasks(
+            [
+                task_id
+                for reminder_kind, (due, task_id) in scheduled.items()
+                if dues.get(reminder_kind) != due
+            ]
         )
-        generate_booking_notifications(
-            booking, non_admin_recipients, subject, non_admin_plain_message
+
+        reminders = {}
+        for reminder_kind, due in dues.items():
+            if reminder_kind in scheduled and scheduled[reminder_kind][0] == due:
+                reminders[reminder_kind] = scheduled[reminder_kind]
+                continue
+            result = send_scheduled_booking_reminder.apply_async(
+                (booking.id, reminder_kind, due),
+                eta=max(datetime.fromisoformat(due), now),
+            )
+            reminders[reminder_kind] = (due, result.id)
+        if reminders:
+            cache.set(key, reminders, None)
+        elif scheduled:
+            cache.delete(key)
+
+
+def unschedule_booking_reminders(booking_id):
+    """Revoke the reminders of a booking that was deleted."""
+    key = get_scheduled_reminders_key(booking_id)
+    scheduled = cache.get(key, {})
+    revoke_reminder_tasks([task_id for _, task_id in scheduled.values()])
+    cache.delete(key)
+
+
+@shared_task
+def send_booking_status_notifications(booking_ids, status):
+    "send one email per recipient listing all of their bookings that moved to the status"
+    bookings = list(
+        Bookings.objects.filter(id__in=booking_ids, status=status)
+        .select_related("user", "bookable_asset__asset__organization")
+        .prefetch_related("participants")
+        .order_by("date", "start_time")
+    )
+    if not bookings:
+        return
+
+    organization_ids = {
+        booking.bookable_asset.asset.organization_id for booking in bookings
+    }
+    admin_emails = get_admin_emails_by_organization(organization_ids)
+
+    bookings_by_recipient = defaultdict(list)
+    recipients_by_booking = {}
+    for booking in bookings:
+        recipients = {booking.user.email}
+        recipients.update(
+            participant.email for participant in booking.participants.all()
         )
+        recipients.update(admin_emails[booking.bookable_asset.asset.organization_id])
+        for email in recipients:
+            bookings_by_recipient[email].append(booking)
+        recipients_by_booking[booking.id] = recipients
 
-        # admin recipients
-        admin_context = prepare_email_context(booking, subject, is_admin=True)
-        if booking.status == "accepted":
-            event_details = prepare_calendar_event_details(
-                booking, admin_context["message"]
+    status_label = status.title()
+    with EmailBatch() as emails:
+        for email, recipient_bookings in bookings_by_recipient.items():
+            if len(recipient_bookings) == 1:
+                subject = generate_email_subject(recipient_bookings[0])
+            else:
+                subject = f"{len(recipient_bookings)} Bookings {status_label}"
+            context = {
+                "subject": subject,
+                "message": f"The following bookings are now {status}:",
+                "bookings": recipient_bookings,
+            }
+            html_message, plain_message = render_email(
+                BOOKING_STATUS_SUMMARY_TEMPLATE, context
             )
-            admin_context = update_context_with_calendar_details(
-                admin_context, event_details
+            # Accepted bookings come with one invite holding all of them
+            ics_file_content = (
+                get_bookings_ics(recipient_bookings) if status == "accepted" else None
             )
-            ics_file_content = generate_ics_file(event_details)
-            with open("booking_event.ics", "w") as ics_file:
-                ics_file.write(ics_file_content)
-
-        admin_html_message = render_to_string(template, admin_context)
-        admin_plain_message = strip_tags(admin_html_message)
-        # Get the admin emails for the booking
-        admin_emails = get_admin_emails(booking)
-
-        # Send email to admin recipients
-        send_email_with_attachment.delay(
-            admin_context["subject"],
-            admin_plain_message,
-            admin_html_message,
-            admin_emails,
-            ics_file_content if booking.status == "accepted" else None,
-        )
-        generate_booking_notifications(
-            booking, admin_emails, subject, admin_plain_message
+            emails.add(
+                subject,
+                plain_message,
+                html_message,
+                [email],
+                ics_file_content,
+            )
+
+    create_booking_notifications(
+        (
+            booking,
+            recipients_by_booking[booking.id],
+            generate_email_subject(booking),
+            f"{booking.bookable_asset} on {booking.date} from {booking.start_time} "
+            f"to {booking.end_time} is now {status}.",
         )
-        logger.info(f"Reminder email sent for booking starting in 30 {booking.id}")
+        for booking in bookings
+    )
+    logger.info(
+        f"Sent {len(bookings_by_recipient)} notifications for {len(bookings)} {status} bookings"
+    )
+
+
+@shared_task
+def process_notification_outbox(entry_id):
+    "render and send the notification of an outbox row, dispatched once its booking is committed"
+    try:
+        process_outbox_entry(entry_id)
+    except Exception:
+        logger.exception(f"Sending notification {entry_id} failed, it will be retried")
+
+
+@shared_task
+def dispatch_notification_outbox():
+    "send the outbox rows that were not sent after their commit or that failed"
+    older_than = timezone.now() - OUTBOX_DISPATCH_DELAY
+    entry_ids = get_pending_outbox_entry_ids(older_than)
+    for entry_id in entry_ids:
+        process_notification_outbox(entry_id)
+    if entry_ids:
+        logger.info(f"Dispatched {len(entry_ids)} pending notifications")
+
+
+@shared_task
+def log_availability_cache_stats():
+    "log the hits and misses of the availability cache since the last run and start counting again"
+    stats = get_availability_cache_stats()
+    reset_availability_cache_stats()
+    logger.info(f"Availability cache: {stats}")
+    return stats
+
+
+@shared_task
+def prune_slot_claims():
+    "delete the slot claims of the days that are over"
+    deleted = prune_past_slot_claims()
+    logger.info(f"Pruned {deleted} slot claims of past days")
+    return deleted
@@ -0,0 +1,217 @@
+import datetime
+
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from accounts.models import Asset, AssetBookableHours, BookableAsset, Config
+from accounts.utils.seeding import seed_bookable_hours
+from bookings.conftest import next_monday
+from bookings.models import Bookings
+from bookings.tasks import log_availability_cache_stats
+from bookings.services import (
+    get_availability_range,
+    get_available_slots_for_bookable_asset,
+    get_capacity_range,
+)
+from bookings.utils import asset_schedule
+from bookings.utils.asset_schedule import bump_schedule_version, get_asset_schedule
+from bookings.utils.availability_cache import (
+    get_availability_cache_stats,
+    get_cached_available_slots,
+)
+
+
+def create_asset(organization, name):
+    asset = Asset.objects.create(
+        organization=organization,
+        name=name,
+        slot_duration=30,
+        buffer_time=0,
+        default_booking_status="accepted",
+    )
+    seed_bookable_hours(asset)
+    BookableAsset.objects.create(asset=asset, name="Any")
+    for number in range(2):
+        BookableAsset.objects.create(asset=asset, name=f"{name} desk {number}")
+    return asset
+
+
+@pytest.fixture
+def asset(organization):
+    return create_asset(organization, "Room")
+
+
+def book(user, bookable_asset, date, hour):
+    return Bookings.objects.create(
+        user=user,
+        bookable_asset=bookable_asset,
+        date=date,
+        start_time=datetime.time(hour),
+        end_time=datetime.time(hour, 30),
+    )
+
+
+def slot(date, hour, minute=0):
+    return datetime.datetime.combine(date, datetime.time(hour, minute))
+
+
+@pytest.mark.django_db
+def test_the_availability_range_matches_the_days_in_a_constant_number_of_queries(
+    asset, user
+):
+    desk = BookableAsset.objects.get(name="Room desk 0")
+    monday = next_monday()
+    book(user, desk, monday + datetime.timedelta(days=1), 9)
+
+    with CaptureQueriesContext(connection) as one_week:
+        week = get_availability_range(desk, monday, monday + datetime.timedelta(6))
+    with CaptureQueriesContext(connection) as four_weeks:
+        get_availability_range(desk, monday, monday + datetime.timedelta(27))
+
+    assert len(one_week) == len(four_weeks)
+    assert list(week) == [monday + datetime.timedelta(days) for days in range(7)]
+    for date, slots in week.items():
+        assert slots == get_available_slots_for_bookable_asset(desk.id, date)
+    # Saturday and Sunday have no bookable hours
+    assert week[monday + datetime.timedelta(5)] == []
+    assert slot(monday, 9) in week[monday]
+    assert (
+        slot(monday + datetime.timedelta(1), 9)
+        not in week[monday + datetime.timedelta(1)]
+    )
+
+
+@pytest.mark.django_db
+def test_any_pools_the_free_capacity_of_its_siblings(asset, user):
+    any_desk = BookableAsset.objects.get(name="Any")
+    desk_0, desk_1 = BookableAsset.objects.filter(name__startswith="Room desk")
+    monday = next_monday()
+    book(user, desk_0, monday, 9)
+    book(user, desk_0, monday, 10)
+    book(user, desk_1, monday, 10)
+
+    capacity = dict(get_capacity_range(any_desk, monday, monday)[monday])
+
+    assert capacity[slot(monday, 8)] == 2
+    assert capacity[slot(monday, 9)] == 1
+    assert slot(monday, 10) not in capacity
+    # A single bookable asset has no capacity to share
+    assert {
+        free_capacity
+        for _, free_capacity in get_capacity_range(desk_0, monday, monday)[monday]
+    } == {None}
+
+
+@pytest.mark.django_db
+def test_the_cached_slots_are_dropped_when_a_version_changes(
+    asset, user, django_capture_on_commit_callbacks
+):
+    desk = BookableAsset.objects.get(name="Room desk 0")
+    monday = next_monday()
+
+    def cached_slots():
+        return [slot for slot, _ in get_cached_available_slots(desk, monday)]
+
+    assert slot(monday, 9) in cached_slots()
+    assert slot(monday, 9) in cached_slots()
+    assert get_availability_cache_stats()["hits"] == 1
+
+    with django_capture_on_commit_callbacks() as callbacks:
+        book(user, desk, monday, 9)
+    # Until the booking is committed the cached slots stay
+    assert slot(monday, 9) in cached_slots()
+    for callback in callbacks:
+        callback()
+    assert slot(monday, 9) not in cached_slots()
+
+    AssetBookableHours.objects.filter(asset=asset, day_of_week=1).update(
+        start_time=datetime.time(10)
+    )
+    bump_schedule_version(asset.id)
+    assert cached_slots()[0] == slot(monday, 10)
+
+    Config.objects.update(slot_duration=60)
+    with django_capture_on_commit_callbacks(execute=True):
+        Config.get_instance().save()
+    assert get_availability_cache_stats() == {
+        "hits": 2,
+        "misses": 3,
+        "hit_ratio": 0.4,
+    }
+    cached_slots()
+    assert get_availability_cache_stats()["misses"] == 4
+
+    # The stats are logged and counted again from zero
+    assert log_availability_cache_stats()["hits"] == 2
+    assert get_availability_cache_stats()["hits"] == 0
+
+
+@pytest.mark.django_db
+def test_the_cache_key_uses_the_asset_of_the_bookable_asset(
+    asset, user, django_capture_on_commit_callbacks
+):
+    create_asset(asset.organization, "Hall")
+    hall_desk = BookableAsset.objects.get(name="Hall desk 0")
+    monday = next_monday()
+    get_cached_available_slots(hall_desk, monday)
+
+    # A change to another asset keeps the entry, a change to the hall drops it
+    bump_schedule_version(asset.id)
+    get_cached_available_slots(hall_desk, monday)
+    assert get_availability_cache_stats()["hits"] == 1
+    with django_capture_on_commit_callbacks(execute=True):
+        book(user, hall_desk, monday, 9)
+    assert (slot(monday, 9), None) not in get_cached_available_slots(hall_desk, monday)
+
+
+@pytest.mark.django_db
+def test_the_asset_schedule_is_memoised_until_its_version_changes(
+    asset, django_assert_num_queries
+):
+    schedule = get_asset_schedule(asset.id)
+    with django_assert_num_queries(0):
+        assert get_asset_schedule(asset.id) is schedule
+
+    AssetBookableHours.objects.filter(asset=asset, day_of_week=1).update(
+        end_time=datetime.time(12)
+    )
+    assert get_asset_schedule(asset.id) is schedule
+    bump_schedule_version(asset.id)
+    with django_assert_num_queries(1):
+        rebuilt = get_asset_schedule(asset.id)
+    assert rebuilt is not schedule
+    assert rebuilt.get_working_hours(next_monday()) == (
+        datetime.time(8),
+        datetime.time(12),
+    )
+
+
+@pytest.mark.django_db
+def test_the_asset_schedule_expires_without_a_version_change(asset, monkeypatch):
+    schedule = get_asset_schedule(asset.id)
+    assert get_asset_schedule(asset.id) is schedule
+
+    monkeypatch.setattr(asset_schedule, "ASSET_SCHEDULE_TTL", 0)
+    assert get_asset_schedule(asset.id) is not schedule
+
+
+@pytest.mark.django_db
+def test_moving_a_booking_invalidates_both_assets(
+    asset, user, django_capture_on_commit_callbacks
+):
+    create_asset(asset.organization, "Hall")
+    room_desk = BookableAsset.objects.get(name="Room desk 0")
+    hall_desk = BookableAsset.objects.get(name="Hall desk 0")
+    monday = next_monday()
+    with django_capture_on_commit_callbacks(execute=True):
+        booking = book(user, room_desk, monday, 9)
+    assert slot(monday, 9) not in dict(get_cached_available_slots(room_desk, monday))
+
+    booking = Bookings.objects.get(id=booking.id)
+    with django_capture_on_commit_callbacks(execute=True):
+        booking.bookable_asset = hall_desk
+        booking.save()
+
+    assert slot(monday, 9) in dict(get_cached_available_slots(room_desk, monday))
+    assert slot(monday, 9) not in dict(get_cached_available_slots(hall_desk, monday))
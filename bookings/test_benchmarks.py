@@ -0,0 +1,309 @@
+"""Benchmarks of the availability, booking, reminder and email rendering hot paths.
+
+Every scenario records its fastest wall time and its number of queries and is compared
+against benchmark_baseline.json, see conftest.py. Only the number of queries is checked
+unless ``--benchmark-timings`` is given, the timings are only comparable on the machine
+the baseline was recorded on. After an intended change run
+``pytest bookings/test_benchmarks.py --benchmark-save`` to record a new baseline.
+"""
+
+import datetime
+import random
+
+import pytest
+import pytz
+from django import forms
+from django.core import mail
+from django.template.loader import render_to_string
+from django.test import Client
+from django.utils.html import strip_tags
+
+from accounts.models import (
+    Asset,
+    BookableAsset,
+    CustomUser,
+    Membership,
+    Organization,
+)
+from accounts.utils.seeding import seed_bookable_hours
+from bookings.models import Bookings
+from bookings.services import get_available_slots_for_bookable_asset
+from bookings.tasks import (
+    send_reminder_email_booking_in_30_min,
+    send_reminder_email_booking_still_pending,
+    send_reminder_email_booking_today,
+)
+from bookings.utils.email_helpers import (
+    generate_email_subject,
+    prepare_calendar_event_details,
+    prepare_email_context,
+    update_context_with_calendar_details,
+)
+from bookings.utils.email_rendering import (
+    get_booking_email_context,
+    render_booking_notification,
+)
+from bookings.utils.validation_utils import validate_booking
+
+ORGANIZATIONS = 2
+ASSETS_PER_ORGANIZATION = 5
+BOOKABLE_ASSETS_PER_ASSET = 4
+MEMBERS_PER_ORGANIZATION = 10
+BOOKINGS_PER_BOOKABLE_ASSET = 40
+BOOKINGS_TODAY = 10
+DAYS = 14
+
+pytestmark = [pytest.mark.django_db, pytest.mark.slow, pytest.mark.benchmark]
+
+
+def next_working_day(date):
+    """Return the first Monday to Friday on or after the given date, see seed_bookable_hours."""
+    while date.weekday() >= 5:
+        date += datetime.timedelta(days=1)
+    return date
+
+
+@pytest.fixture
+def synthetic_data(config):
+    """Create organizations with many assets and bookings, the bookings are bulk created."""
+    rnd = random.Random(2024)
+    today = datetime.date.today()
+    busy_date = next_working_day(today + datetime.timedelta(days=1))
+    now = datetime.datetime.now(pytz.timezone("Africa/Johannesburg"))
+
+    data = {"organizations": [], "bookable_assets": [], "busy_date": busy_date}
+    bookings = []
+    for organization_number in range(ORGANIZATIONS):
+        organization = Organization.objects.create(
+            name=f"Organization {organization_number}"
+        )
+        members = []
+        for member_number in range(MEMBERS_PER_ORGANIZATION):
+            user = CustomUser.objects.create(
+                username=f"user-{organization_number}-{member_number}",
+                email=f"user-{organization_number}-{member_number}@example.com",
+                first_name="User",
+            )
+            Membership.objects.create(
+                user=user,
+                organization=organization,
+                role=Membership.ADMIN if member_number == 0 else Membership.MEMBER,
+                status="accepted",
+            )
+            members.append(user)
+        data["organizations"].append((organization, members))
+
+        for asset_number in range(ASSETS_PER_ORGANIZATION):
+            asset = Asset.objects.create(
+                organization=organization,
+                name=f"Room {organization_number}-{asset_number}",
+                slot_duration=30,
+                buffer_time=0,
+            )
+            seed_bookable_hours(asset)
+            BookableAsset.objects.create(asset=asset, name="Any")
+            for bookable_asset_number in range(BOOKABLE_ASSETS_PER_ASSET):
+                bookable_asset = BookableAsset.objects.create(
+                    asset=asset, name=f"Desk {bookable_asset_number}"
+                )
+                data["bookable_assets"].append(bookable_asset)
+                for _ in range(BOOKINGS_PER_BOOKABLE_ASSET):
+                    start = rnd.randrange(8 * 60, 16 * 60, 30)
+                    bookings.append(
+                        Bookings(
+                            user=rnd.choice(members),
+                            date=today + datetime.timedelta(days=rnd.randrange(DAYS)),
+                            start_time=datetime.time(*divmod(start, 60)),
+                            end_time=datetime.time(*divmod(start + 30, 60)),
+                            bookable_asset=bookable_asset,
+                            status="pending" if rnd.random() < 0.05 else "accepted",
+                        )
+                    )
+
+    # Bookings for the reminder tasks, accepted today and starting within 30 minutes
+    soon = now + datetime.timedelta(minutes=10)
+    for bookable_asset in data["bookable_assets"][:BOOKINGS_TODAY]:
+        bookings.append(
+            Bookings(
+                user=bookable_asset.asset.organization.membership_set.first().user,
+                date=today,
+                start_time=soon.time().replace(second=0, microsecond=0),
+                end_time=(soon + datetime.timedelta(minutes=30))
+                .time()
+                .replace(second=0, microsecond=0),
+                bookable_asset=bookable_asset,
+                status="accepted",
+            )
+        )
+    Bookings.objects.bulk_create(bookings)
+    # Pending bookings are only reminded about once they are older than a day
+    Bookings.objects.filter(status="pending").update(
+        create_datetime=now - datetime.timedelta(days=2)
+    )
+    data["reminders_today"] = soon.date() == today
+    return data
+
+
+def test_benchmark_available_slots(benchmark, synthetic_data):
+    bookable_asset = synthetic_data["bookable_assets"][0]
+    date = synthetic_data["busy_date"]
+    benchmark(
+        "available_slots",
+        lambda: get_available_slots_for_bookable_asset(bookable_asset.id, date),
+    )
+
+    any_bookable_asset = BookableAsset.objects.get(
+        asset=bookable_asset.asset, name="Any"
+    )
+    benchmark(
+        "available_slots_any",
+        lambda: get_available_slots_for_bookable_asset(any_bookable_asset.id, date),
+    )
+
+
+def test_benchmark_time_slots_view(benchmark, synthetic_data):
+    bookable_asset = synthetic_data["bookable_assets"][0]
+    client = Client()
+    client.force_login(synthetic_data["organizations"][0][1][0])
+    params = {
+        "selected_date": synthetic_data["busy_date"].strftime("%d-%m-%Y"),
+        "asset": bookable_asset.asset_id,
+        "bookable_asset": bookable_asset.id,
+    }
+    benchmark(
+        "time_slots_view",
+        lambda: client.get("/tad_book/bookings/time_slots/", params),
+    )
+
+
+def test_benchmark_validate_booking(benchmark, synthetic_data):
+    bookable_asset = synthetic_data["bookable_assets"][0]
+    booking = Bookings(
+        user=synthetic_data["organizations"][0][1][1],
+        date=synthetic_data["busy_date"],
+        start_time=datetime.time(10),
+        end_time=datetime.time(10, 30),
+        bookable_asset=bookable_asset,
+        status="accepted",
+    )
+    benchmark("validate_booking", lambda: validate_booking(booking, forms.Form({})))
+
+
+def test_benchmark_organization_scope(benchmark, synthetic_data):
+    """Every booking of the organization is busy time, it must still be one query."""
+    bookable_asset = synthetic_data["bookable_assets"][0]
+    organization, members = synthetic_data["organizations"][0]
+    # The caches are cleared before every run, the signals are not needed
+    Organization.objects.filter(id=organization.id).update(
+        exclusive_booking_accross_organization=True,
+        exclusive_booking_accross_asset=True,
+    )
+    date = synthetic_data["busy_date"]
+    benchmark(
+        "available_slots_organization_scope",
+        lambda: get_available_slots_for_bookable_asset(bookable_asset.id, date),
+    )
+
+    booking = Bookings(
+        user=members[1],
+        date=date,
+        start_time=datetime.time(10),
+        end_time=datetime.time(10, 30),
+        bookable_asset=bookable_asset,
+        status="accepted",
+    )
+    benchmark(
+        "validate_booking_organization_scope",
+        lambda: validate_booking(booking, forms.Form({})),
+    )
+
+
+def test_benchmark_request_booking(benchmark, synthetic_data):
+    bookable_asset = synthetic_data["bookable_assets"][0]
+    client = Client()
+    client.force_login(synthetic_data["organizations"][0][1][1])
+    data = {
+        "bookable_asset": bookable_asset.id,
+        "selected_date": synthetic_data["busy_date"].strftime("%d-%m-%Y"),
+        "notes": "Benchmark",
+    }
+    benchmark(
+        "request_booking",
+        lambda: client.post("/tad_book/bookings/request_booking/16:30/", data),
+    )
+
+
+def test_benchmark_calendar_views(benchmark, synthetic_data):
+    organization, members = synthetic_data["organizations"][0]
+    admin = members[0]
+    client = Client()
+    client.force_login(admin)
+
+    benchmark(
+        "organization_calendar_view",
+        lambda: client.get(
+            f"/tad_book/bookings/organization/{organization.slug}/manage_bookings/calendar/"
+        ),
+    )
+    benchmark(
+        "admin_calendar_view",
+        lambda: client.get(
+            f"/tad_book/bookings/admin/{admin.slug}/manage_bookings/calendar/"
+        ),
+    )
+    benchmark(
+        "user_calendar_view",
+        lambda: client.get(
+            f"/tad_book/bookings/user/{admin.slug}/manage_bookings/calendar/"
+        ),
+    )
+
+
+def test_benchmark_reminder_tasks(benchmark, synthetic_data):
+    benchmark(
+        "reminder_booking_still_pending",
+        send_reminder_email_booking_still_pending,
+        rounds=1,
+    )
+    benchmark("reminder_booking_today", send_reminder_email_booking_today, rounds=1)
+    if not synthetic_data["reminders_today"]:
+        pytest.skip("The bookings starting within 30 minutes would be tomorrow")
+    mail.outbox = []
+    benchmark(
+        "reminder_booking_in_30_min", send_reminder_email_booking_in_30_min, rounds=1
+    )
+    assert mail.outbox
+
+
+def test_benchmark_booking_notification_rendering(benchmark, synthetic_data):
+    """Render the user and admin notifications of a booking by stripping the tags of
+    the HTML, as they were, and with the plain text templates of the service."""
+    booking = (
+        Bookings.objects.select_related("user", "bookable_asset__asset__organization")
+        .filter(status="accepted")
+        .first()
+    )
+    subject = generate_email_subject(booking)
+
+    def render_with_strip_tags():
+        for is_admin in [False, True]:
+            context = prepare_email_context(booking, subject, is_admin=is_admin)
+            event_details = prepare_calendar_event_details(booking, context["message"])
+            context = update_context_with_calendar_details(context, event_details)
+            html_message = render_to_string(
+                "email_templates/booking_notification.html", context
+            )
+            strip_tags(html_message)
+
+    def render_with_templates():
+        shared_context = get_booking_email_context(booking, subject)
+        for is_admin in [False, True]:
+            render_booking_notification(shared_context, is_admin=is_admin)
+
+    strip_tags_result = benchmark(
+        "booking_notification_strip_tags", render_with_strip_tags, rounds=20
+    )
+    templates_result = benchmark(
+        "booking_notification_rendering", render_with_templates, rounds=20
+    )
+    assert templates_result["seconds"] < strip_tags_result["seconds"]
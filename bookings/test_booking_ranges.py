@@ -0,0 +1,151 @@
+import datetime
+import importlib
+from zoneinfo import ZoneInfo
+
+import pytest
+from django import forms
+from django.apps import apps
+from django.db import IntegrityError
+
+from accounts.models import Asset, AssetBookableHours, BookableAsset
+from bookings.models import Bookings
+from bookings.services import book_slot, get_available_slots_for_bookable_asset
+from bookings.utils.db_helpers import get_bookings_for_date_and_time
+from bookings.utils.slot_claims import SlotAlreadyClaimed
+from bookings.utils.validation_utils import save_booking
+
+SITE_TIME_ZONE = ZoneInfo("Africa/Johannesburg")
+
+
+@pytest.fixture
+def desk(organization):
+    """A desk that can be booked around the clock, every day."""
+    asset = Asset.objects.create(
+        organization=organization,
+        name="Room",
+        slot_duration=30,
+        buffer_time=0,
+        default_booking_status="accepted",
+    )
+    for day_of_week in range(7):
+        AssetBookableHours.objects.create(
+            asset=asset,
+            day_of_week=day_of_week,
+            start_time=datetime.time(0),
+            end_time=datetime.time(23, 30),
+        )
+    return BookableAsset.objects.create(asset=asset, name="Desk")
+
+
+def book(user, desk, date, start_time, end_time):
+    return Bookings.objects.create(
+        user=user,
+        bookable_asset=desk,
+        date=date,
+        start_time=start_time,
+        end_time=end_time,
+    )
+
+
+@pytest.mark.django_db
+def test_the_range_is_written_with_the_booking(desk, user):
+    date = datetime.date.today() + datetime.timedelta(days=1)
+    booking = book(user, desk, date, datetime.time(9), datetime.time(10))
+    assert booking.start_at == datetime.datetime(
+        date.year, date.month, date.day, 9, tzinfo=SITE_TIME_ZONE
+    )
+    assert booking.end_at - booking.start_at == datetime.timedelta(hours=1)
+
+    booking.start_time = datetime.time(22)
+    booking.end_time = datetime.time(1)
+    booking.save(update_fields=["start_time", "end_time"])
+    booking.refresh_from_db()
+    assert booking.end_at - booking.start_at == datetime.timedelta(hours=3)
+    assert booking.end_at.astimezone(SITE_TIME_ZONE).date() == date + (
+        datetime.timedelta(days=1)
+    )
+
+    Bookings.objects.bulk_create(
+        [
+            Bookings(
+                user=user,
+                bookable_asset=desk,
+                date=date,
+                start_time=datetime.time(12),
+                end_time=datetime.time(13),
+            )
+        ]
+    )
+    assert not Bookings.objects.filter(start_at=None).exists()
+
+
+@pytest.mark.django_db
+def test_a_booking_crossing_midnight_holds_the_next_day(desk, user):
+    date = datetime.date.today() + datetime.timedelta(days=1)
+    next_date = date + datetime.timedelta(days=1)
+    book(user, desk, date, datetime.time(22), datetime.time(1))
+
+    slots = get_available_slots_for_bookable_asset(desk.id, date)
+    assert datetime.datetime.combine(date, datetime.time(21, 30)) in slots
+    assert datetime.datetime.combine(date, datetime.time(22)) not in slots
+    assert datetime.datetime.combine(date, datetime.time(23)) not in slots
+
+    slots = get_available_slots_for_bookable_asset(desk.id, next_date)
+    assert datetime.datetime.combine(next_date, datetime.time(0)) not in slots
+    assert datetime.datetime.combine(next_date, datetime.time(0, 30)) not in slots
+    assert datetime.datetime.combine(next_date, datetime.time(1)) in slots
+
+    assert get_bookings_for_date_and_time(
+        next_date, datetime.time(0, 30), datetime.time(1, 30), desk
+    ).exists()
+    assert not get_bookings_for_date_and_time(
+        next_date, datetime.time(1), datetime.time(2), desk
+    ).exists()
+
+
+@pytest.mark.django_db
+def test_the_migration_backfills_the_range(desk, user, monkeypatch):
+    date = datetime.date.today() + datetime.timedelta(days=1)
+    book(user, desk, date, datetime.time(9), datetime.time(10))
+    book(user, desk, date, datetime.time(23), datetime.time(0, 30))
+    expected = list(Bookings.objects.values_list("start_at", "end_at"))
+    Bookings.objects.update(start_at=None, end_at=None)
+
+    migration = importlib.import_module(
+        "bookings.migrations.0008_bookings_start_at_end_at"
+    )
+    # Every booking in a batch of its own
+    monkeypatch.setattr(migration, "BACKFILL_BATCH_SIZE", 1)
+    migration.backfill_booking_ranges(apps, None)
+
+    assert list(Bookings.objects.values_list("start_at", "end_at")) == expected
+
+
+@pytest.mark.django_db
+def test_an_overlap_refused_by_the_database_is_not_a_server_error(
+    desk, user, monkeypatch
+):
+    date = datetime.date.today() + datetime.timedelta(days=1)
+
+    def refuse(*args, **kwargs):
+        # What PostgreSQL raises for the exclusion constraint of migration 0008
+        raise IntegrityError(
+            "conflicting key value violates exclusion constraint "
+            '"bookings_accepted_no_overlap"'
+        )
+
+    monkeypatch.setattr(Bookings, "save", refuse)
+    with pytest.raises(SlotAlreadyClaimed):
+        book_slot(user, desk, date, datetime.time(9), datetime.time(10))
+    assert not Bookings.objects.exists()
+
+    form = forms.Form({})
+    booking = Bookings(
+        user=user,
+        bookable_asset=desk,
+        date=date,
+        start_time=datetime.time(9),
+        end_time=datetime.time(10),
+    )
+    assert not save_booking(booking, form)
+    assert form.non_field_errors()
@@ -0,0 +1,217 @@
+import datetime
+
+import pytest
+from django import forms
+from django.core import mail
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from bookings.conftest import next_monday
+from bookings.forms import BookingSeriesForm
+from bookings.models import Bookings, BookingSeries, NoBookings
+from bookings.services import (
+    SeriesConflict,
+    book_slot,
+    cancel_booking_series,
+    create_booking_series,
+    get_available_slots_for_bookable_asset,
+    get_series_conflicts,
+)
+from bookings.utils.slot_claims import SlotAlreadyClaimed
+from bookings.utils.validation_utils import validate_booking
+
+
+def test_occurrences_are_only_expanded_for_the_window():
+    series = BookingSeries(
+        first_date=datetime.date(2024, 7, 1),
+        start_time=datetime.time(9),
+        end_time=datetime.time(10),
+        rrule="FREQ=WEEKLY;BYDAY=MO,WE",
+    )
+
+    assert series.is_endless()
+    assert series.get_dates(datetime.date(2030, 1, 1), datetime.date(2030, 1, 10)) == [
+        datetime.date(2030, 1, 2),
+        datetime.date(2030, 1, 7),
+        datetime.date(2030, 1, 9),
+    ]
+    assert series.get_dates(datetime.date(2024, 6, 1), datetime.date(2024, 7, 2)) == [
+        datetime.date(2024, 7, 1)
+    ]
+
+
+def test_clean_rejects_invalid_rules():
+    series = BookingSeries(
+        first_date=datetime.date(2024, 7, 1),
+        start_time=datetime.time(9),
+        end_time=datetime.time(10),
+        rrule="not a rule",
+    )
+    with pytest.raises(ValidationError):
+        series.clean()
+
+    series.rrule = "FREQ=DAILY;COUNT=2"
+    series.end_time = datetime.time(8)
+    with pytest.raises(ValidationError):
+        series.clean()
+
+
+@pytest.mark.django_db
+def test_create_series_saves_a_single_row(desk, user):
+    monday = next_monday()
+    mail.outbox = []
+
+    series = create_booking_series(
+        user,
+        desk,
+        monday,
+        datetime.time(9),
+        datetime.time(10),
+        "FREQ=WEEKLY;COUNT=52",
+    )
+
+    assert series.last_date == monday + datetime.timedelta(weeks=51)
+    assert BookingSeries.objects.count() == 1
+    assert not Bookings.objects.exists()
+    assert not mail.outbox
+
+    week_later = monday + datetime.timedelta(weeks=10)
+    slots = get_available_slots_for_bookable_asset(desk.id, week_later)
+    assert datetime.datetime.combine(week_later, datetime.time(9)) not in slots
+    assert datetime.datetime.combine(week_later, datetime.time(10)) in slots
+    with pytest.raises(SlotAlreadyClaimed):
+        book_slot(user, desk, week_later, datetime.time(9, 30), datetime.time(10))
+
+    cancel_booking_series(series)
+    slots = get_available_slots_for_bookable_asset(desk.id, week_later)
+    assert datetime.datetime.combine(week_later, datetime.time(9)) in slots
+    book_slot(user, desk, week_later, datetime.time(9, 30), datetime.time(10))
+
+
+@pytest.mark.django_db
+def test_series_conflicts_are_found_in_one_pass(desk, user):
+    monday = next_monday()
+    Bookings.objects.create(
+        user=user,
+        bookable_asset=desk,
+        date=monday + datetime.timedelta(weeks=3),
+        start_time=datetime.time(9, 30),
+        end_time=datetime.time(10),
+    )
+    NoBookings.objects.create(
+        asset=desk.asset,
+        start_date=monday + datetime.timedelta(weeks=5),
+        end_date=monday + datetime.timedelta(weeks=5),
+    )
+    create_booking_series(
+        user,
+        desk,
+        monday + datetime.timedelta(weeks=7),
+        datetime.time(8),
+        datetime.time(9, 30),
+        "FREQ=WEEKLY;COUNT=1",
+    )
+    series = BookingSeries(
+        user=user,
+        bookable_asset=desk,
+        first_date=monday,
+        start_time=datetime.time(9),
+        end_time=datetime.time(10),
+        rrule="FREQ=WEEKLY;BYDAY=MO;COUNT=104",
+    )
+
+    with CaptureQueriesContext(connection) as queries:
+        conflicts = get_series_conflicts(series)
+    assert len(queries) <= 5
+
+    assert conflicts == [
+        monday + datetime.timedelta(weeks=3),
+        monday + datetime.timedelta(weeks=5),
+        monday + datetime.timedelta(weeks=7),
+    ]
+    with pytest.raises(SeriesConflict) as error:
+        create_booking_series(
+            user,
+            desk,
+            monday,
+            datetime.time(9),
+            datetime.time(10),
+            "FREQ=WEEKLY;BYDAY=MO,SA;COUNT=4",
+        )
+    assert monday + datetime.timedelta(days=5) in error.value.dates
+    # The series is rolled back with the check
+    assert BookingSeries.objects.count() == 1
+
+
+@pytest.mark.django_db
+def test_validation_finds_series_across_midnight_before_rejecting(desk, user):
+    monday = next_monday()
+    tuesday = monday + datetime.timedelta(days=1)
+    create_booking_series(
+        user,
+        desk,
+        tuesday,
+        datetime.time(8),
+        datetime.time(9),
+        "FREQ=WEEKLY;COUNT=2",
+    )
+    pending = Bookings.objects.create(
+        user=user,
+        bookable_asset=desk,
+        date=monday,
+        start_time=datetime.time(16),
+        end_time=datetime.time(17),
+    )
+    Bookings.objects.filter(id=pending.id).update(status="pending")
+    booking = Bookings(
+        user=user,
+        bookable_asset=desk,
+        date=monday,
+        start_time=datetime.time(16, 30),
+        end_time=datetime.time(8, 30),
+        status="accepted",
+    )
+
+    assert validate_booking(booking, forms.Form({}))
+    # Nothing is changed when a check fails
+    pending.refresh_from_db()
+    assert pending.status == "pending"
+
+    booking.end_time = datetime.time(8)
+    assert not validate_booking(booking, forms.Form({}))
+    pending.refresh_from_db()
+    assert pending.status == "rejected"
+
+
+@pytest.mark.django_db
+def test_the_admin_form_checks_the_occurrences_of_the_series(desk, user):
+    monday = next_monday()
+    series = create_booking_series(
+        user,
+        desk,
+        monday,
+        datetime.time(9),
+        datetime.time(10),
+        "FREQ=WEEKLY;COUNT=4",
+    )
+    data = {
+        "user": user.id,
+        "bookable_asset": desk.id,
+        "first_date": monday + datetime.timedelta(weeks=2),
+        "start_time": "09:30",
+        "end_time": "10:30",
+        "rrule": "FREQ=WEEKLY;COUNT=2",
+        "status": "accepted",
+        "notes": "",
+    }
+
+    form = BookingSeriesForm(data)
+    assert not form.is_valid()
+    assert str(monday + datetime.timedelta(weeks=2)) in str(form.errors)
+
+    # An edit of the series is not a conflict with itself
+    form = BookingSeriesForm(data, instance=series)
+    assert form.is_valid(), form.errors
+    form.save()
+    assert BookingSeries.objects.get().first_date == data["first_date"]
@@ -0,0 +1,122 @@
+import datetime
+
+import pytest
+from django.core import mail
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from accounts.models import CustomUser
+from bookings.conftest import add_admin, create_desk, next_working_day
+from bookings.models import BookingNotification, Bookings, SlotClaim
+from bookings.services import book_slot, get_available_slots_for_bookable_asset
+from bookings.utils.booking_transitions import cancel_bookings, reject_bookings
+
+
+@pytest.fixture
+def desk(organization):
+    add_admin(organization)
+    return create_desk(organization, default_booking_status="pending")
+
+
+def book_day(desk, users, date):
+    """Book every slot from 8:00 to 12:00, taking turns between the users."""
+    bookings = []
+    for number in range(8):
+        start = datetime.datetime.combine(date, datetime.time(8)) + datetime.timedelta(
+            minutes=30 * number
+        )
+        bookings.append(
+            book_slot(
+                users[number % len(users)],
+                desk,
+                date,
+                start.time(),
+                (start + datetime.timedelta(minutes=30)).time(),
+            )
+        )
+    return bookings
+
+
+@pytest.fixture
+def users():
+    return [
+        CustomUser.objects.create(
+            username=f"user-{number}",
+            email=f"user-{number}@example.com",
+            first_name="User",
+        )
+        for number in range(2)
+    ]
+
+
+@pytest.mark.django_db
+def test_reject_bookings_sends_one_email_per_recipient(
+    desk, users, django_capture_on_commit_callbacks
+):
+    date = next_working_day()
+    bookings = book_day(desk, users, date)
+    notifications = BookingNotification.objects.count()
+    mail.outbox = []
+
+    with CaptureQueriesContext(connection) as queries:
+        with django_capture_on_commit_callbacks() as callbacks:
+            rejected = reject_bookings(Bookings.objects.filter(bookable_asset=desk))
+    # The notifications are only sent once the transition is committed
+    assert not mail.outbox
+    for callback in callbacks:
+        callback()
+    update_queries = [
+        query
+        for query in queries
+        if query["sql"].startswith('UPDATE "bookings_bookings"')
+    ]
+
+    assert rejected == len(bookings)
+    assert len(update_queries) == 1
+    assert set(Bookings.objects.values_list("status", flat=True)) == {"rejected"}
+    assert not SlotClaim.objects.exists()
+    assert sorted(email for message in mail.outbox for email in message.to) == [
+        "admin@example.com",
+        "user-0@example.com",
+        "user-1@example.com",
+    ]
+    assert BookingNotification.objects.count() == notifications + len(bookings)
+
+    slots = get_available_slots_for_bookable_asset(desk.id, date)
+    assert datetime.datetime.combine(date, datetime.time(8)) in slots
+
+    # Bookings that already have the status are left alone
+    mail.outbox = []
+    assert reject_bookings(Bookings.objects.all()) == 0
+    assert not mail.outbox
+
+
+@pytest.mark.django_db
+def test_cancel_bookings_uses_the_canceled_status(desk, users):
+    date = next_working_day()
+    bookings = book_day(desk, users, date)
+
+    assert cancel_bookings(bookings[:2]) == 2
+
+    assert list(
+        Bookings.objects.filter(status="canceled").values_list("id", flat=True)
+    ) == sorted(booking.id for booking in bookings[:2])
+    assert SlotClaim.objects.count() == len(bookings) - 2
+    book_slot(users[0], desk, date, datetime.time(8), datetime.time(9))
+
+
+@pytest.mark.django_db
+def test_a_rolled_back_transition_sends_nothing(
+    desk, users, django_capture_on_commit_callbacks
+):
+    bookings = book_day(desk, users, next_working_day())
+    mail.outbox = []
+
+    with django_capture_on_commit_callbacks(execute=True):
+        with pytest.raises(RuntimeError):
+            with transaction.atomic():
+                cancel_bookings(bookings)
+                raise RuntimeError
+
+    assert not mail.outbox
+    assert set(Bookings.objects.values_list("status", flat=True)) == {"pending"}
@@ -0,0 +1,187 @@
+import datetime
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from django import forms
+from django.db import connection, connections
+from django.test.utils import CaptureQueriesContext
+
+from accounts.models import Asset, BookableAsset, Organization
+from accounts.utils.seeding import seed_bookable_hours
+from bookings.conftest import next_working_day
+from bookings.models import Bookings
+from bookings.services import book_slot, get_available_slots_for_bookable_asset
+from bookings.utils.asset_schedule import get_asset_schedule
+from bookings.utils.slot_claims import SlotAlreadyClaimed
+from bookings.utils.validation_utils import validate_booking
+
+
+@pytest.fixture
+def organization(organization):
+    for name in ["Room", "Hall"]:
+        asset = Asset.objects.create(
+            organization=organization,
+            name=name,
+            slot_duration=30,
+            buffer_time=0,
+            default_booking_status="accepted",
+        )
+        seed_bookable_hours(asset)
+        BookableAsset.objects.create(asset=asset, name="Any")
+        for number in range(2):
+            BookableAsset.objects.create(asset=asset, name=f"{name} desk {number}")
+    return organization
+
+
+def set_scope(organization, exclusive_accross_organization, exclusive_accross_asset):
+    organization.exclusive_booking_accross_organization = exclusive_accross_organization
+    organization.exclusive_booking_accross_asset = exclusive_accross_asset
+    organization.save()
+
+
+def desks(name):
+    return list(BookableAsset.objects.filter(name__startswith=f"{name} desk"))
+
+
+def is_free(bookable_asset, date, time):
+    return datetime.datetime.combine(
+        date, time
+    ) in get_available_slots_for_bookable_asset(bookable_asset.id, date)
+
+
+@pytest.mark.django_db
+def test_a_booking_only_holds_its_bookable_asset_by_default(organization, user):
+    date = next_working_day()
+    room_desk, other_room_desk = desks("Room")
+    book_slot(user, room_desk, date, datetime.time(9), datetime.time(9, 30))
+
+    assert not is_free(room_desk, date, datetime.time(9))
+    assert is_free(other_room_desk, date, datetime.time(9))
+    book_slot(user, other_room_desk, date, datetime.time(9), datetime.time(9, 30))
+
+
+@pytest.mark.django_db
+def test_exclusive_booking_accross_asset(organization, user):
+    date = next_working_day()
+    set_scope(organization, False, True)
+    room_desk, other_room_desk = desks("Room")
+    hall_desk = desks("Hall")[0]
+    book_slot(user, room_desk, date, datetime.time(9), datetime.time(9, 30))
+
+    assert not is_free(other_room_desk, date, datetime.time(9))
+    assert is_free(other_room_desk, date, datetime.time(9, 30))
+    assert is_free(hall_desk, date, datetime.time(9))
+    any_room = BookableAsset.objects.get(asset=room_desk.asset, name="Any")
+    assert not is_free(any_room, date, datetime.time(9))
+
+    with pytest.raises(SlotAlreadyClaimed):
+        book_slot(user, other_room_desk, date, datetime.time(9), datetime.time(9, 30))
+    booking = Bookings(
+        user=user,
+        bookable_asset=other_room_desk,
+        date=date,
+        start_time=datetime.time(9),
+        end_time=datetime.time(10),
+        status="accepted",
+    )
+    assert validate_booking(booking, forms.Form({}))
+
+    # Bookings next to each other do not overlap
+    booking.start_time = datetime.time(9, 30)
+    assert not validate_booking(booking, forms.Form({}))
+
+
+@pytest.mark.django_db
+def test_exclusive_booking_accross_organization(
+    organization, user, django_capture_on_commit_callbacks
+):
+    date = next_working_day()
+    room_desk = desks("Room")[0]
+    hall_desk = desks("Hall")[0]
+    book_slot(user, room_desk, date, datetime.time(9), datetime.time(9, 30))
+    assert is_free(hall_desk, date, datetime.time(9))
+
+    # The scope is part of the memoised schedule, changing it has to be picked up
+    with django_capture_on_commit_callbacks(execute=True):
+        set_scope(organization, True, True)
+    assert get_asset_schedule(hall_desk.asset_id).conflict_scope == (
+        Organization.CONFLICT_SCOPE_ORGANIZATION
+    )
+    assert not is_free(hall_desk, date, datetime.time(9))
+    with pytest.raises(SlotAlreadyClaimed):
+        book_slot(user, hall_desk, date, datetime.time(9), datetime.time(9, 30))
+
+    # A booking in another asset invalidates the cached availability of the hall
+    with django_capture_on_commit_callbacks(execute=True):
+        book_slot(user, room_desk, date, datetime.time(11), datetime.time(11, 30))
+    assert not is_free(hall_desk, date, datetime.time(11))
+
+
+@pytest.mark.django_db
+def test_every_scope_fetches_the_bookings_with_one_query(organization, user):
+    date = next_working_day()
+    hall_desk = desks("Hall")[0]
+    query_counts = []
+    for scope in [(False, False), (False, True), (True, True)]:
+        set_scope(organization, *scope)
+        get_asset_schedule(hall_desk.asset_id)
+        with CaptureQueriesContext(connection) as queries:
+            get_available_slots_for_bookable_asset(hall_desk.id, date)
+        booking_queries = [
+            query
+            for query in queries
+            if query["sql"].startswith('SELECT "bookings_bookings"')
+        ]
+        assert len(booking_queries) == 1
+        query_counts.append(len(queries))
+
+    assert len(set(query_counts)) == 1
+
+
+@pytest.mark.slow
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.parametrize(
+    "exclusive_accross_organization, exclusive_accross_asset",
+    [(True, False), (False, True)],
+)
+def test_concurrent_bookings_of_siblings_respect_the_scope(
+    organization, user, exclusive_accross_organization, exclusive_accross_asset
+):
+    date = next_working_day()
+    set_scope(organization, exclusive_accross_organization, exclusive_accross_asset)
+    all_desks = desks("Room") + desks("Hall")
+    rnd = random.Random(14)
+    requests = [
+        (rnd.choice(all_desks), datetime.time(rnd.choice([9, 10, 11])))
+        for _ in range(120)
+    ]
+
+    def request_booking(desk_and_time):
+        desk, start_time = desk_and_time
+        end_time = (
+            datetime.datetime.combine(date, start_time)
+            + (datetime.timedelta(minutes=30))
+        ).time()
+        try:
+            book_slot(user, desk, date, start_time, end_time)
+            return True
+        except SlotAlreadyClaimed:
+            return False
+        finally:
+            connections.close_all()
+
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        booked = sum(executor.map(request_booking, requests))
+
+    booked_per_scope = {}
+    for booking in Bookings.objects.select_related("bookable_asset"):
+        scope = (
+            organization.id
+            if exclusive_accross_organization
+            else booking.bookable_asset.asset_id
+        )
+        key = (scope, booking.start_time)
+        booked_per_scope[key] = booked_per_scope.get(key, 0) + 1
+    assert set(booked_per_scope.values()) == {1}
+    assert booked == len(booked_per_scope)
@@ -0,0 +1,108 @@
+import datetime
+import random
+
+import pytest
+
+from bookings.models import Bookings
+from bookings.utils.db_helpers import calculate_slots, exclude_booked_slots
+
+
+def exclude_booked_slots_nested_loop(bookings, slots, slot_duration=None):
+    """The previous implementation, every slot is checked against every booking."""
+    available_slots = []
+    for slot in slots:
+        slot_end = slot + slot_duration
+        is_available = True
+        for booking in bookings:
+            if (
+                booking.get_start_time() < slot_end.time()
+                and slot.time() < booking.get_end_time()
+            ):
+                is_available = False
+                break
+        if is_available:
+            available_slots.append(slot)
+    return available_slots
+
+
+def make_slots(date, slot_minutes, start_hour=0, end_hour=23, end_minute=59):
+    return calculate_slots(
+        datetime.datetime.combine(date, datetime.time(start_hour)),
+        datetime.datetime.combine(date, datetime.time(end_hour, end_minute)),
+        datetime.datetime.combine(date, datetime.time(start_hour)),
+        datetime.timedelta(minutes=slot_minutes),
+    )
+
+
+def make_bookings(rnd, count, slot_minutes):
+    bookings = []
+    for _ in range(count):
+        start = rnd.randrange(0, 23 * 60, slot_minutes)
+        end = min(start + rnd.randrange(slot_minutes, 180, slot_minutes), 23 * 60 + 59)
+        bookings.append(
+            Bookings(
+                start_time=datetime.time(*divmod(start, 60)),
+                end_time=datetime.time(*divmod(end, 60)),
+            )
+        )
+    return bookings
+
+
+def test_exclude_booked_slots_touching_bookings_do_not_overlap():
+    date = datetime.date(2024, 7, 1)
+    slots = make_slots(date, 30, start_hour=8, end_hour=12, end_minute=0)
+    bookings = [
+        Bookings(start_time=datetime.time(9, 0), end_time=datetime.time(10, 0)),
+        Bookings(start_time=datetime.time(8, 45), end_time=datetime.time(9, 15)),
+    ]
+
+    available = exclude_booked_slots(bookings, slots, datetime.timedelta(minutes=30))
+
+    assert [slot.time() for slot in available] == [
+        datetime.time(8, 0),
+        datetime.time(10, 0),
+        datetime.time(10, 30),
+        datetime.time(11, 0),
+        datetime.time(11, 30),
+    ]
+
+
+def test_exclude_booked_slots_matches_nested_loop():
+    rnd = random.Random(2024)
+    date = datetime.date(2024, 7, 1)
+    for _ in range(200):
+        slot_minutes = rnd.choice([5, 15, 30, 60])
+        slot_duration = datetime.timedelta(minutes=slot_minutes)
+        slots = make_slots(date, slot_minutes)
+        bookings = make_bookings(rnd, rnd.randint(0, 40), rnd.choice([5, 15]))
+
+        assert exclude_booked_slots(
+            bookings, slots, slot_duration
+        ) == exclude_booked_slots_nested_loop(bookings, slots, slot_duration)
+
+
+@pytest.mark.slow
+@pytest.mark.benchmark
+@pytest.mark.django_db
+def test_benchmark_exclude_booked_slots(benchmark):
+    """Record the sweep next to the nested loop it replaced, see benchmark_baseline.json."""
+    rnd = random.Random(7)
+    date = datetime.date(2024, 7, 1)
+    slot_duration = datetime.timedelta(minutes=5)
+    slots = make_slots(date, 5)
+    # A busy day, bookings are mostly in the evening so most slots are free and the
+    # nested loop has to look at every booking for them
+    bookings = [
+        booking
+        for booking in make_bookings(rnd, 600, 5)
+        if booking.get_start_time() >= datetime.time(18)
+    ]
+
+    benchmark(
+        "exclude_booked_slots_nested_loop",
+        lambda: exclude_booked_slots_nested_loop(bookings, slots, slot_duration),
+    )
+    benchmark(
+        "exclude_booked_slots",
+        lambda: exclude_booked_slots(bookings, slots, slot_duration),
+    )
@@ -0,0 +1,103 @@
+import datetime
+
+import pytest
+
+from accounts.models import Asset, BookableAsset, CustomUser, Organization
+from bookings.models import Bookings
+from bookings.utils import email_rendering
+from bookings.utils.email_helpers import prepare_calendar_event_details
+from bookings.utils.email_rendering import (
+    BOOKING_STATUS_SUMMARY_TEMPLATE,
+    PARTICIPANT_NOTIFICATION_TEMPLATE,
+    get_booking_email_context,
+    render_booking_notification,
+    render_email,
+)
+
+
+@pytest.fixture
+def booking(config):
+    organization = Organization.objects.create(name="Smith & Sons")
+    asset = Asset.objects.create(
+        organization=organization,
+        name="Room",
+        slot_duration=30,
+        buffer_time=0,
+        default_booking_status="pending",
+    )
+    desk = BookableAsset.objects.create(asset=asset, name="Desk <1>")
+    user = CustomUser.objects.create(
+        username="user", email="user@example.com", first_name="Jane", last_name="Doe"
+    )
+    return Bookings.objects.create(
+        user=user,
+        bookable_asset=desk,
+        date=datetime.date.today() + datetime.timedelta(days=1),
+        start_time=datetime.time(10),
+        end_time=datetime.time(10, 30),
+    )
+
+
+@pytest.mark.django_db
+def test_the_plain_part_is_rendered_from_its_own_template(booking):
+    shared_context = get_booking_email_context(booking, "Booking @ Smith & Sons")
+
+    subject, html_message, plain_message = render_booking_notification(
+        shared_context, is_admin=True
+    )
+
+    assert subject == "Admin Notification: Booking @ Smith & Sons"
+    assert "Booking @ Smith &amp; Sons" in html_message
+    # Text is not escaped and holds neither markup nor styles
+    assert "Bookable asset: Desk <1>" in plain_message
+    assert "Full Name: Jane Doe" in plain_message
+    assert "font-family" not in plain_message
+    assert f"/approve_booking/{booking.id}/" in plain_message
+    assert "Cancel:" not in plain_message
+
+    _, _, plain_message = render_booking_notification(shared_context)
+    assert f"/cancel_booking/{booking.id}/" in plain_message
+    assert "Approve:" not in plain_message
+
+
+@pytest.mark.django_db
+def test_the_admin_and_user_emails_share_the_calendar_links(booking, monkeypatch):
+    booking.status = "accepted"
+    calls = []
+
+    def count_calls(booking, message):
+        calls.append(booking)
+        return prepare_calendar_event_details(booking, message)
+
+    monkeypatch.setattr(email_rendering, "prepare_calendar_event_details", count_calls)
+    shared_context = get_booking_email_context(booking, "Booking")
+    plain_messages = [
+        render_booking_notification(shared_context, is_admin=is_admin)[2]
+        for is_admin in [False, True]
+    ]
+
+    assert len(calls) == 1
+    for plain_message in plain_messages:
+        assert shared_context["google_calendar_url"] in plain_message
+
+
+@pytest.mark.django_db
+def test_the_calendar_event_of_a_booking_crossing_midnight_ends_the_next_day(
+    booking,
+):
+    booking.start_time = datetime.time(22)
+    booking.end_time = datetime.time(1)
+
+    event_details = prepare_calendar_event_details(booking, "")
+
+    assert event_details["end"] - event_details["start"] == datetime.timedelta(hours=3)
+
+
+@pytest.mark.django_db
+def test_every_email_template_has_a_plain_text_template(booking):
+    context = {"subject": "Subject", "message": "Hello", "booking": booking}
+    render_email(PARTICIPANT_NOTIFICATION_TEMPLATE, context)
+    _, plain_message = render_email(
+        BOOKING_STATUS_SUMMARY_TEMPLATE, {**context, "bookings": [booking]}
+    )
+    assert ": Room - Desk <1>, " in plain_message
@@ -0,0 +1,120 @@
+import datetime
+import tempfile
+
+import pytest
+from django.core import mail
+
+from accounts.models import Organization
+from bookings.conftest import create_desk, next_working_day
+from bookings.models import Bookings
+from bookings.utils.booking_transitions import transition_bookings
+from bookings.utils.ics import (
+    ICS_LINE_LENGTH,
+    build_ics_event,
+    get_booking_ics,
+    get_bookings_ics,
+)
+
+
+@pytest.fixture
+def organization(config):
+    return Organization.objects.create(name="Organization, Inc")
+
+
+@pytest.fixture
+def desk(organization):
+    return create_desk(organization, default_booking_status="pending")
+
+
+def create_booking(user, desk, start_time, end_time, status="accepted"):
+    return Bookings.objects.create(
+        user=user,
+        bookable_asset=desk,
+        date=next_working_day(),
+        start_time=start_time,
+        end_time=end_time,
+        status=status,
+    )
+
+
+def test_events_are_escaped_and_folded():
+    start = datetime.datetime(2024, 7, 1, 8, tzinfo=datetime.timezone.utc)
+    event = build_ics_event(
+        "booking-1@tad-book",
+        start,
+        start + datetime.timedelta(hours=1),
+        "Desk; by the window",
+        "Bring the projector, the cables\nand the remote " + "é" * 60,
+        "Organization, Inc",
+    )
+
+    assert event.endswith("\r\n")
+    assert "\n" not in event.replace("\r\n", "")
+    assert "SUMMARY:Desk\\; by the window\r\n" in event
+    assert "LOCATION:Organization\\, Inc\r\n" in event
+    assert "DTSTART:20240701T080000Z\r\n" in event
+    lines = event.split("\r\n")
+    assert all(len(line.encode()) <= ICS_LINE_LENGTH for line in lines)
+    unfolded = event.replace("\r\n ", "")
+    assert "the cables\\nand the remote " + "é" * 60 in unfolded
+
+
+@pytest.mark.django_db
+def test_booking_invites_are_cached_per_update(desk, user, django_assert_num_queries):
+    booking = Bookings.objects.select_related(
+        "bookable_asset__asset__organization"
+    ).get(id=create_booking(user, desk, datetime.time(22), datetime.time(1)).id)
+
+    ics = get_booking_ics(booking)
+    assert isinstance(ics, bytes)
+    assert ics.startswith(b"BEGIN:VCALENDAR\r\n")
+    assert ics.count(b"BEGIN:VEVENT") == 1
+    # The booking ends at 01:00 the next day, which is 23:00 UTC on its own day
+    assert f"DTSTART:{booking.date:%Y%m%d}T200000Z".encode() in ics
+    assert f"DTEND:{booking.date:%Y%m%d}T230000Z".encode() in ics
+
+    with django_assert_num_queries(0):
+        assert get_booking_ics(booking) == ics
+
+    booking.end_time = datetime.time(23)
+    booking.save()
+    assert get_booking_ics(booking) != ics
+
+
+@pytest.mark.django_db
+def test_many_bookings_share_one_calendar(desk, user):
+    bookings = [
+        create_booking(user, desk, datetime.time(9), datetime.time(10)),
+        create_booking(user, desk, datetime.time(11), datetime.time(12)),
+    ]
+
+    ics = get_bookings_ics(bookings)
+
+    assert ics.count(b"BEGIN:VCALENDAR") == 1
+    assert ics.count(b"BEGIN:VEVENT") == 2
+    assert f"UID:booking-{bookings[1].id}@tad-book".encode() in ics
+
+
+@pytest.mark.django_db
+def test_invites_are_attached_without_files(
+    desk, user, monkeypatch, tmp_path, django_capture_on_commit_callbacks
+):
+    def no_files(*args, **kwargs):
+        raise AssertionError("The invite must not be written to disk")
+
+    monkeypatch.setattr(tempfile, "NamedTemporaryFile", no_files)
+    monkeypatch.chdir(tmp_path)
+    bookings = [
+        create_booking(user, desk, datetime.time(9), datetime.time(10), "pending"),
+        create_booking(user, desk, datetime.time(11), datetime.time(12), "pending"),
+    ]
+    mail.outbox = []
+
+    with django_capture_on_commit_callbacks(execute=True):
+        transition_bookings(Bookings.objects.all(), "accepted")
+
+    assert [message.to for message in mail.outbox] == [["user@example.com"]]
+    name, content, mimetype = mail.outbox[0].attachments[0]
+    assert mimetype == "text/calendar"
+    assert content.count("BEGIN:VEVENT") == 2
+    assert not list(tmp_path.iterdir())
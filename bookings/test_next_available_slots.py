@@ -0,0 +1,135 @@
+import datetime
+
+import pytest
+from django.test import Client
+
+from accounts.models import (
+    Asset,
+    BookableAsset,
+    CustomUser,
+    Membership,
+    Organization,
+)
+from accounts.utils.seeding import seed_bookable_hours
+from bookings import services
+from bookings.models import NoBookings
+from bookings.services import NEXT_AVAILABLE_MAX_DAYS, find_next_available_slots
+
+URL = "/tad_book/bookings/next_available_slots/"
+
+
+def create_desk(organization, name, max_days_ahead=None):
+    asset = Asset.objects.create(
+        organization=organization,
+        name=name,
+        slot_duration=30,
+        buffer_time=0,
+        max_days_ahead=max_days_ahead,
+    )
+    seed_bookable_hours(asset)
+    return BookableAsset.objects.create(asset=asset, name=f"{name} desk")
+
+
+def block_days(desk, first_date, last_date):
+    NoBookings.objects.create(
+        asset=desk.asset, start_date=first_date, end_date=last_date
+    )
+
+
+@pytest.fixture
+def windows(monkeypatch):
+    """Record the assets and date ranges the search computes the availability for."""
+    windows = []
+    get_capacity = services.get_capacity_range_for_bookable_assets
+
+    def record(asset, bookable_assets, start_date, end_date):
+        windows.append((asset.id, start_date, end_date))
+        return get_capacity(asset, bookable_assets, start_date, end_date)
+
+    monkeypatch.setattr(services, "get_capacity_range_for_bookable_assets", record)
+    return windows
+
+
+def monday_morning():
+    date = datetime.date.today() + datetime.timedelta(days=1)
+    while date.weekday() != 0:
+        date += datetime.timedelta(days=1)
+    return datetime.datetime.combine(date, datetime.time(7))
+
+
+@pytest.mark.django_db
+def test_the_search_window_doubles_until_slots_are_found(organization, windows):
+    desk = create_desk(organization, "Room")
+    after = monday_morning()
+    today = after.date()
+    # The first free day is Monday next week, the eighth day of the search
+    block_days(desk, today, today + datetime.timedelta(days=6))
+
+    slots = find_next_available_slots([desk], count=2, after=after)
+
+    assert [(start - today).days for _, start, _ in windows] == [0, 1, 3, 7]
+    assert [(end - start).days + 1 for _, start, end in windows] == [1, 2, 4, 8]
+    next_monday = today + datetime.timedelta(days=7)
+    assert slots == [
+        (datetime.datetime.combine(next_monday, datetime.time(8)), desk, None),
+        (datetime.datetime.combine(next_monday, datetime.time(8, 30)), desk, None),
+    ]
+
+
+@pytest.mark.django_db
+def test_the_search_stops_after_a_year_or_at_max_days_ahead(organization, windows):
+    after = monday_morning()
+    today = after.date()
+    desk = create_desk(organization, "Room")
+    block_days(desk, today, today + datetime.timedelta(days=2 * 365))
+    near_desk = create_desk(organization, "Hall", max_days_ahead=5)
+    block_days(near_desk, today, today + datetime.timedelta(days=6))
+
+    assert find_next_available_slots([desk, near_desk], after=after) == []
+    assert max(end for asset_id, _, end in windows if asset_id == desk.asset_id) == (
+        today + datetime.timedelta(days=NEXT_AVAILABLE_MAX_DAYS)
+    )
+    assert max(
+        end for asset_id, _, end in windows if asset_id == near_desk.asset_id
+    ) == today + datetime.timedelta(days=5)
+
+
+@pytest.mark.django_db
+def test_the_view_only_searches_the_organizations_of_the_user(organization):
+    other_organization = Organization.objects.create(name="Other")
+    desk = create_desk(organization, "Room")
+    other_desk = create_desk(other_organization, "Hall")
+    user = CustomUser.objects.create(username="user", email="user@example.com")
+    Membership.objects.create(
+        user=user,
+        organization=organization,
+        role=Membership.MEMBER,
+        status="accepted",
+    )
+    client = Client()
+    client.force_login(user)
+
+    def searched(params):
+        response = client.get(URL, params)
+        assert response.status_code == 200
+        return {
+            next_slot["bookable_asset"] for next_slot in response.context["next_slots"]
+        }
+
+    assert searched({"organization": organization.id}) == {desk}
+    assert searched({"organization": other_organization.id}) == set()
+    assert searched({"asset": other_desk.asset_id}) == set()
+    assert searched({"bookable_asset": [desk.id, other_desk.id]}) == {desk}
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize(
+    "params",
+    [{"asset": "room"}, {"organization": "1;"}, {"bookable_asset": ["1", "x"]}],
+)
+def test_the_view_rejects_ids_that_are_not_numbers(organization, params):
+    user = CustomUser.objects.create(username="user", email="user@example.com")
+    client = Client()
+    client.force_login(user)
+
+    assert client.get(URL, params).status_code == 400
@@ -0,0 +1,172 @@
+import datetime
+
+import pytest
+from django.core import mail
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from accounts.models import CustomUser
+from bookings.conftest import add_admin, create_desk, next_working_day
+from bookings.models import BookingNotification, Bookings, NotificationOutbox
+from bookings.tasks import dispatch_notification_outbox
+from bookings.utils import notification_outbox
+from bookings.utils.notification_outbox import OUTBOX_MAX_ATTEMPTS
+
+
+@pytest.fixture
+def desk(organization):
+    add_admin(organization)
+    return create_desk(organization)
+
+
+def create_booking(user, desk):
+    return Bookings.objects.create(
+        user=user,
+        bookable_asset=desk,
+        date=next_working_day(),
+        start_time=datetime.time(9),
+        end_time=datetime.time(10),
+        status="accepted",
+    )
+
+
+def age_outbox():
+    """Make the outbox rows old enough for the sweep."""
+    NotificationOutbox.objects.update(
+        create_datetime=datetime.datetime.now(datetime.timezone.utc)
+        - datetime.timedelta(hours=1)
+    )
+
+
+@pytest.mark.django_db
+def test_saving_a_booking_only_writes_the_outbox(
+    desk, user, django_capture_on_commit_callbacks
+):
+    mail.outbox = []
+    with django_capture_on_commit_callbacks() as callbacks:
+        with CaptureQueriesContext(connection) as queries:
+            booking = create_booking(user, desk)
+
+    assert not mail.outbox
+    assert not BookingNotification.objects.exists()
+    assert not any("bookings_bookingnotification" in q["sql"] for q in queries)
+    entry = NotificationOutbox.objects.get()
+    assert entry.booking == booking
+    assert entry.kind == NotificationOutbox.BOOKING_CREATED
+    assert entry.processed_datetime is None
+
+    for callback in callbacks:
+        callback()
+    assert sorted(email for message in mail.outbox for email in message.to) == [
+        "admin@example.com",
+        "user@example.com",
+    ]
+    assert all(message.attachments for message in mail.outbox)
+    assert BookingNotification.objects.filter(booking=booking).count() == 2
+    entry.refresh_from_db()
+    assert entry.processed_datetime is not None
+    assert entry.attempts == 1
+
+    # The sweep does not send it again
+    age_outbox()
+    mail.outbox = []
+    dispatch_notification_outbox()
+    assert not mail.outbox
+
+
+@pytest.mark.django_db
+def test_participant_changes_are_queued_with_the_participants(
+    desk, user, django_capture_on_commit_callbacks
+):
+    booking = create_booking(user, desk)
+    participant = CustomUser.objects.create(
+        username="participant", email="participant@example.com", first_name="Guest"
+    )
+    mail.outbox = []
+    with django_capture_on_commit_callbacks(execute=True):
+        booking.participants.add(participant)
+
+    entry = NotificationOutbox.objects.get(kind=NotificationOutbox.PARTICIPANTS_ADDED)
+    assert entry.participant_ids == [participant.id]
+    assert [message.to for message in mail.outbox] == [["participant@example.com"]]
+    assert mail.outbox[0].subject == "You've been added to a booking"
+
+
+@pytest.mark.django_db
+def test_failed_notifications_are_retried_by_the_sweep(
+    desk, user, monkeypatch, django_capture_on_commit_callbacks
+):
+    def fail(entry, messages):
+        raise ConnectionRefusedError("The mail server is down")
+
+    monkeypatch.setitem(
+        notification_outbox.OUTBOX_SENDERS, NotificationOutbox.BOOKING_CREATED, fail
+    )
+    mail.outbox = []
+    with django_capture_on_commit_callbacks(execute=True):
+        create_booking(user, desk)
+    entry = NotificationOutbox.objects.get()
+    assert entry.processed_datetime is None
+    assert entry.claimed_datetime is None
+    assert "The mail server is down" in entry.last_error
+
+    # Too recent for the sweep, it is still being sent after its commit
+    dispatch_notification_outbox()
+    entry.refresh_from_db()
+    assert entry.attempts == 1
+
+    monkeypatch.undo()
+    age_outbox()
+    dispatch_notification_outbox()
+    entry.refresh_from_db()
+    assert entry.processed_datetime is not None
+    assert entry.attempts == 2
+    assert len(mail.outbox) == 2
+
+    # Rows that keep failing are given up on
+    NotificationOutbox.objects.update(
+        processed_datetime=None, attempts=OUTBOX_MAX_ATTEMPTS
+    )
+    mail.outbox = []
+    dispatch_notification_outbox()
+    assert not mail.outbox
+
+
+@pytest.mark.django_db
+def test_a_retry_only_sends_the_messages_that_failed(
+    desk, user, monkeypatch, django_capture_on_commit_callbacks
+):
+    send_email_batch = notification_outbox.send_email_batch
+
+    def refuse_the_admin(messages):
+        metrics = send_email_batch(
+            [m for m in messages if m["recipient_list"] != ["admin@example.com"]]
+        )
+        failed_indexes = [
+            index
+            for index, message in enumerate(messages)
+            if message["recipient_list"] == ["admin@example.com"]
+        ]
+        return {**metrics, "failed_indexes": failed_indexes}
+
+    monkeypatch.setattr(notification_outbox, "send_email_batch", refuse_the_admin)
+    mail.outbox = []
+    with django_capture_on_commit_callbacks(execute=True):
+        booking = create_booking(user, desk)
+    entry = NotificationOutbox.objects.get()
+    assert entry.processed_datetime is None
+    assert entry.delivered_messages == ["user"]
+    assert [message.to for message in mail.outbox] == [["user@example.com"]]
+
+    monkeypatch.undo()
+    age_outbox()
+    mail.outbox = []
+    dispatch_notification_outbox()
+    entry.refresh_from_db()
+    assert entry.processed_datetime is not None
+    assert [message.to for message in mail.outbox] == [["admin@example.com"]]
+    assert sorted(
+        BookingNotification.objects.filter(booking=booking).values_list(
+            "recipients__email", flat=True
+        )
+    ) == ["admin@example.com", "user@example.com"]
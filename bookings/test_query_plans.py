@@ -0,0 +1,208 @@
+"""Check that the hot queries on bookings find their rows through an index.
+
+The queries are captured while the real code runs, with their parameters, and every
+one that reads a checked table is passed to EXPLAIN QUERY PLAN. A full scan of a
+checked table fails the test, so a change to a filter that no longer matches an
+index shows up here before it shows up in production.
+"""
+
+import datetime
+import re
+from contextlib import contextmanager
+
+import pytest
+from django.db import connection
+from django.test import Client
+from django.utils import timezone
+
+from bookings.conftest import add_admin, create_desk
+from bookings.models import Bookings, NoBookings
+from bookings.services import get_available_slots_for_bookable_asset
+from bookings.tasks import (
+    send_reminder_email_booking_in_30_min,
+    send_reminder_email_booking_still_pending,
+    send_reminder_email_booking_today,
+)
+from bookings.utils.db_helpers import (
+    check_no_bookings_day,
+    get_bookings_for_date_and_time,
+    get_no_bookings_dates_for_range,
+)
+
+CHECKED_TABLES = [
+    "bookings_bookings",
+    "bookings_nobookings",
+    "bookings_reminderledger",
+]
+
+pytestmark = [
+    pytest.mark.django_db,
+    pytest.mark.skipif(
+        connection.vendor != "sqlite", reason="The plans are read in SQLite's format"
+    ),
+]
+
+
+@contextmanager
+def capture_queries():
+    """Collect the sql and parameters of every query run inside the block."""
+    queries = []
+
+    def record(execute, sql, params, many, context):
+        queries.append((sql, params))
+        return execute(sql, params, many, context)
+
+    with connection.execute_wrapper(record):
+        yield queries
+
+
+def get_query_plan(sql, params):
+    with connection.cursor() as cursor:
+        cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+        return [row[-1] for row in cursor.fetchall()]
+
+
+def get_checked_names(sql):
+    """Return the names the checked tables go by in the plan, subqueries alias them."""
+    names = {table: table for table in CHECKED_TABLES if f'"{table}"' in sql}
+    for table, alias in re.findall(r'"(\w+)" ([A-Z]\d+)\b', sql):
+        if table in CHECKED_TABLES:
+            names[alias] = table
+    return names
+
+
+def assert_uses_indexes(queries):
+    """Fail when a query reads a checked table without searching an index."""
+    checked = 0
+    for sql, params in queries:
+        if not sql.startswith("SELECT"):
+            continue
+        names = get_checked_names(sql)
+        if not names:
+            continue
+        checked += 1
+        plan = get_query_plan(sql, params)
+        for step in plan:
+            for name, table in names.items():
+                assert not step.startswith(
+                    f"SCAN {name}"
+                ), f"Full scan of {table}:\n{sql}\n" + "\n".join(plan)
+    assert checked, "None of the queries read a checked table"
+
+
+@pytest.fixture
+def data(organization):
+    admin = add_admin(organization)
+    bookable_asset = create_desk(organization, default_booking_status="pending")
+    asset = bookable_asset.asset
+    today = datetime.date.today()
+    NoBookings.objects.create(
+        asset=asset,
+        start_date=today + datetime.timedelta(days=20),
+        end_date=today + datetime.timedelta(days=21),
+    )
+    Bookings.objects.bulk_create(
+        [
+            Bookings(
+                user=admin,
+                bookable_asset=bookable_asset,
+                date=today + datetime.timedelta(days=days),
+                start_time=datetime.time(9),
+                end_time=datetime.time(9, 30),
+                status=status,
+            )
+            for days in range(5)
+            for status in ["pending", "accepted", "rejected"]
+        ]
+    )
+    return {
+        "organization": organization,
+        "admin": admin,
+        "asset": asset,
+        "bookable_asset": bookable_asset,
+        "date": today + datetime.timedelta(days=1),
+    }
+
+
+def test_db_helpers_queries_use_indexes(data):
+    asset = data["asset"]
+    date = data["date"]
+    with capture_queries() as queries:
+        check_no_bookings_day(asset.id, date)
+        get_no_bookings_dates_for_range(
+            asset.id, date, date + datetime.timedelta(days=30)
+        )
+        list(
+            get_bookings_for_date_and_time(
+                date, datetime.time(9), datetime.time(10), data["bookable_asset"]
+            )
+        )
+        get_available_slots_for_bookable_asset(data["bookable_asset"].id, date)
+    assert_uses_indexes(queries)
+
+
+def test_organization_scope_queries_use_indexes(data):
+    organization = data["organization"]
+    organization.exclusive_booking_accross_organization = True
+    organization.exclusive_booking_accross_asset = True
+    organization.save()
+    with capture_queries() as queries:
+        get_available_slots_for_bookable_asset(data["bookable_asset"].id, data["date"])
+    assert_uses_indexes(queries)
+
+
+def test_reminder_task_queries_use_indexes(data):
+    soon = timezone.localtime() + datetime.timedelta(minutes=10)
+    Bookings.objects.bulk_create(
+        [
+            Bookings(
+                user=data["admin"],
+                bookable_asset=data["bookable_asset"],
+                date=soon.date(),
+                start_time=soon.time().replace(second=0, microsecond=0),
+                end_time=(soon + datetime.timedelta(minutes=30))
+                .time()
+                .replace(second=0, microsecond=0),
+                status="accepted",
+            )
+        ]
+    )
+    with capture_queries() as queries:
+        send_reminder_email_booking_still_pending()
+        send_reminder_email_booking_today()
+        send_reminder_email_booking_in_30_min()
+        # The second run finds the reminder in the ledger
+        send_reminder_email_booking_in_30_min()
+    assert_uses_indexes(queries)
+
+
+def test_calendar_view_queries_use_indexes(data):
+    admin = data["admin"]
+    client = Client()
+    client.force_login(admin)
+    for url in [
+        f"/tad_book/bookings/organization/{data['organization'].slug}/manage_bookings/calendar/",
+        f"/tad_book/bookings/admin/{admin.slug}/manage_bookings/calendar/",
+        f"/tad_book/bookings/user/{admin.slug}/manage_bookings/calendar/",
+    ]:
+        with capture_queries() as queries:
+            response = client.get(url)
+        assert response.status_code == 200
+        assert_uses_indexes(queries)
+
+
+def test_count_view_queries_use_indexes(data):
+    client = Client()
+    client.force_login(data["admin"])
+    for view in [
+        "upcomming_bookings_count",
+        "today_upcomming_bookings_count",
+        "current_bookings_count",
+        "upcomming_pending_bookings_count",
+    ]:
+        with capture_queries() as queries:
+            response = client.get(
+                f"/tad_book/bookings/{view}/{data['organization'].id}/"
+            )
+        assert response.status_code == 200
+        assert_uses_indexes(queries)
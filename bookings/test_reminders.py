@@ -0,0 +1,429 @@
+import datetime
+from types import SimpleNamespace
+
+import pytest
+from django.core import mail
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from accounts.models import (
+    Asset,
+    BookableAsset,
+    Config,
+    CustomUser,
+    Organization,
+)
+from bookings import signals, tasks
+from bookings.conftest import add_admin
+from bookings.models import BookingNotification, Bookings, ReminderLedger
+from bookings.tasks import (
+    reconcile_booking_reminders,
+    send_booking_reminders,
+    send_reminder_email_booking_in_30_min,
+    send_reminder_email_booking_today,
+    send_scheduled_booking_reminder,
+)
+from bookings.utils.reminder_ledger import claim_reminders
+
+
+@pytest.fixture
+def desks(config):
+    desks = []
+    for number in range(2):
+        organization = Organization.objects.create(name=f"Organization {number}")
+        add_admin(organization, username=f"admin-{number}")
+        asset = Asset.objects.create(
+            organization=organization,
+            name="Room",
+            slot_duration=30,
+            buffer_time=0,
+            default_booking_status="accepted",
+        )
+        desks.append(BookableAsset.objects.create(asset=asset, name="Desk"))
+    return desks
+
+
+def create_bookings_today(desks, count):
+    """Create accepted bookings today, each with a user and a participant of its own."""
+    bookings = []
+    for number in range(count):
+        user = CustomUser.objects.create(
+            username=f"user-{number}", email=f"user-{number}@example.com"
+        )
+        participant = CustomUser.objects.create(
+            username=f"participant-{number}", email=f"participant-{number}@example.com"
+        )
+        booking = Bookings.objects.create(
+            user=user,
+            bookable_asset=desks[number % len(desks)],
+            date=datetime.date.today(),
+            start_time=datetime.time(0, number),
+            end_time=datetime.time(0, number + 1),
+        )
+        booking.participants.add(participant)
+        bookings.append(booking)
+    return bookings
+
+
+def count_reminder_queries(booking_ids):
+    with CaptureQueriesContext(connection) as queries:
+        send_booking_reminders(booking_ids, "Booking Reminder Today")
+    return len(queries)
+
+
+@pytest.mark.django_db
+def test_reminder_chunks_run_in_a_constant_number_of_queries(desks):
+    bookings = create_bookings_today(desks, 8)
+    Config.get_instance()
+
+    assert count_reminder_queries([booking.id for booking in bookings[:2]]) == (
+        count_reminder_queries([booking.id for booking in bookings])
+    )
+
+
+@pytest.mark.django_db
+def test_reminder_notifications_are_stored_with_their_recipients(desks):
+    bookings = create_bookings_today(desks, 3)
+
+    send_booking_reminders([booking.id for booking in bookings], "Booking Reminder")
+
+    notifications = BookingNotification.objects.prefetch_related("recipients")
+    assert sorted(
+        (
+            notification.booking_id,
+            sorted(recipient.username for recipient in notification.recipients.all()),
+        )
+        for notification in notifications
+    ) == sorted(
+        [
+            (booking.id, [f"participant-{number}", booking.user.username])
+            for number, booking in enumerate(bookings)
+        ]
+        + [
+            (booking.id, [f"admin-{number % 2}"])
+            for number, booking in enumerate(bookings)
+        ]
+    )
+    assert {notification.subject for notification in notifications} == {
+        "Booking Reminder"
+    }
+
+
+@pytest.mark.django_db
+def test_todays_reminders_fan_out_in_chunks(desks, monkeypatch):
+    monkeypatch.setattr(tasks, "REMINDER_CHUNK_SIZE", 2)
+    bookings = create_bookings_today(desks, 5)
+    Bookings.objects.create(
+        user=bookings[0].user,
+        bookable_asset=desks[0],
+        date=datetime.date.today() + datetime.timedelta(days=1),
+        start_time=datetime.time(9),
+        end_time=datetime.time(10),
+    )
+    chunks = []
+    get_reminder_bookings = tasks.get_reminder_bookings
+    monkeypatch.setattr(
+        tasks,
+        "get_reminder_bookings",
+        lambda booking_ids: chunks.append(booking_ids)
+        or get_reminder_bookings(booking_ids),
+    )
+    mail.outbox = []
+
+    send_reminder_email_booking_today()
+
+    assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+    assert sorted(booking_id for chunk in chunks for booking_id in chunk) == sorted(
+        booking.id for booking in bookings
+    )
+    recipients = sorted(email for message in mail.outbox for email in message.to)
+    assert recipients == sorted(
+        [f"user-{number}@example.com" for number in range(5)]
+        + [f"participant-{number}@example.com" for number in range(5)]
+        + ["admin-0@example.com"] * 3
+        + ["admin-1@example.com"] * 2
+    )
+    assert all(message.attachments for message in mail.outbox)
+
+
+@pytest.mark.django_db
+def test_a_reminder_is_claimed_once(desks):
+    first, second = create_bookings_today(desks, 2)
+
+    assert claim_reminders([first.id], ReminderLedger.TODAY) == [first.id]
+    assert claim_reminders([first.id], ReminderLedger.TODAY) == []
+    assert claim_reminders([first.id], ReminderLedger.IN_30_MIN) == [first.id]
+    assert claim_reminders([first.id, second.id], ReminderLedger.TODAY) == [second.id]
+    assert claim_reminders([first.id, second.id], ReminderLedger.TODAY) == []
+
+
+@pytest.mark.django_db
+def test_overlapping_runs_send_each_reminder_once(desks):
+    soon = timezone.localtime() + datetime.timedelta(minutes=10)
+    user = CustomUser.objects.create(username="user", email="user@example.com")
+    booking = Bookings.objects.create(
+        user=user,
+        bookable_asset=desks[0],
+        date=soon.date(),
+        start_time=soon.time().replace(second=0, microsecond=0),
+        end_time=(soon + datetime.timedelta(minutes=30))
+        .time()
+        .replace(second=0, microsecond=0),
+    )
+    mail.outbox = []
+
+    send_reminder_email_booking_in_30_min()
+    send_reminder_email_booking_in_30_min()
+    send_reminder_email_booking_today()
+    send_reminder_email_booking_today()
+
+    subjects = sorted(
+        message.subject for message in mail.outbox if message.to == [user.email]
+    )
+    expected = ["Booking starting in 30 minutes"]
+    if soon.date() == timezone.localdate():
+        expected.insert(0, "Booking Reminder Today")
+    assert subjects == expected
+    assert booking.reminders.count() == len(expected)
+
+
+@pytest.mark.django_db
+def test_a_reminder_that_was_not_delivered_is_sent_again(desks, monkeypatch):
+    first, second = create_bookings_today(desks, 2)
+    send_email_batch = tasks.send_email_batch
+
+    def refuse_the_first_user(messages):
+        refused = [first.user.email, "participant-0@example.com"]
+        failed_indexes = [
+            index
+            for index, message in enumerate(messages)
+            if message["recipient_list"] == refused
+        ]
+        metrics = send_email_batch(
+            [message for message in messages if message["recipient_list"] != refused]
+        )
+        return {**metrics, "failed_indexes": failed_indexes}
+
+    monkeypatch.setattr(tasks, "send_email_batch", refuse_the_first_user)
+    mail.outbox = []
+    send_booking_reminders(
+        [first.id, second.id], "Booking Reminder Today", ReminderLedger.TODAY
+    )
+    # Only the delivered messages are stored, the claim of the failed one is given back
+    assert not BookingNotification.objects.filter(
+        booking=first, recipients__email=first.user.email
+    ).exists()
+    assert BookingNotification.objects.filter(booking=second).count() == 2
+    assert list(ReminderLedger.objects.values_list("booking_id", flat=True)) == [
+        second.id
+    ]
+
+    monkeypatch.undo()
+    mail.outbox = []
+    send_booking_reminders(
+        [first.id, second.id], "Booking Reminder Today", ReminderLedger.TODAY
+    )
+    assert sorted(message.to[0] for message in mail.outbox) == [
+        "admin-0@example.com",
+        first.user.email,
+    ]
+
+
+@pytest.mark.django_db
+def test_claiming_a_chunk_is_two_queries(desks, django_assert_num_queries):
+    bookings = create_bookings_today(desks, 6)
+    booking_ids = [booking.id for booking in bookings]
+    claim_reminders([booking_ids[2]], ReminderLedger.TODAY)
+
+    with django_assert_num_queries(2):
+        claimed = claim_reminders(booking_ids, ReminderLedger.TODAY)
+
+    assert claimed == booking_ids[:2] + booking_ids[3:]
+
+
+class ScheduledTasks:
+    """Stands in for send_scheduled_booking_reminder and records what is scheduled."""
+
+    def __init__(self):
+        self.scheduled = {}
+        self.revoked = []
+
+    def apply_async(self, args, eta):
+        task_id = f"task-{len(self.scheduled) + 1}"
+        self.scheduled[task_id] = (args, eta)
+        return SimpleNamespace(id=task_id)
+
+    def revoke(self, task_ids):
+        self.revoked.extend(task_ids)
+
+    def pending(self):
+        return {
+            task_id: scheduled
+            for task_id, scheduled in self.scheduled.items()
+            if task_id not in self.revoked
+        }
+
+
+@pytest.fixture
+def scheduled_tasks(monkeypatch):
+    scheduled_tasks = ScheduledTasks()
+    monkeypatch.setattr(tasks, "send_scheduled_booking_reminder", scheduled_tasks)
+    monkeypatch.setattr(tasks, "revoke_reminder_tasks", scheduled_tasks.revoke)
+    return scheduled_tasks
+
+
+def create_booking_at(desk, start, user=None):
+    start = timezone.localtime(start)
+    return Bookings.objects.create(
+        user=user
+        or CustomUser.objects.create(username="user", email="user@example.com"),
+        bookable_asset=desk,
+        date=start.date(),
+        start_time=start.time().replace(second=0, microsecond=0),
+        end_time=(start + datetime.timedelta(minutes=30))
+        .time()
+        .replace(second=0, microsecond=0),
+    )
+
+
+@pytest.mark.django_db
+def test_reminders_are_scheduled_and_revoked_with_the_booking(
+    desks, scheduled_tasks, django_capture_on_commit_callbacks, monkeypatch
+):
+    start = (timezone.now() + datetime.timedelta(minutes=40)).replace(second=0)
+    with django_capture_on_commit_callbacks(execute=True):
+        booking = create_booking_at(desks[0], start)
+
+    [(args, eta)] = scheduled_tasks.pending().values()
+    assert args[:2] == (booking.id, ReminderLedger.IN_30_MIN)
+    assert eta == start.replace(microsecond=0) - datetime.timedelta(minutes=30)
+
+    # Saving without moving it keeps the task without looking at it
+    rescheduled = []
+    schedule_booking_reminders = signals.schedule_booking_reminders
+
+    def record(bookings):
+        rescheduled.extend(bookings)
+        schedule_booking_reminders(bookings)
+
+    monkeypatch.setattr(signals, "schedule_booking_reminders", record)
+    with django_capture_on_commit_callbacks(execute=True):
+        booking.notes = "Bring a laptop"
+        booking.save()
+        Bookings.objects.get(id=booking.id).save()
+    assert not rescheduled
+    assert len(scheduled_tasks.scheduled) == 1
+    assert not scheduled_tasks.revoked
+
+    with django_capture_on_commit_callbacks(execute=True):
+        booking.start_time = (
+            timezone.localtime(start) + datetime.timedelta(minutes=5)
+        ).time()
+        booking.save()
+    [(args, eta)] = scheduled_tasks.pending().values()
+    assert scheduled_tasks.revoked == ["task-1"]
+    assert rescheduled == [booking]
+    assert eta == booking.start_at - datetime.timedelta(minutes=30)
+
+    with django_capture_on_commit_callbacks(execute=True):
+        booking.status = "canceled"
+        booking.save()
+    assert not scheduled_tasks.pending()
+
+
+@pytest.mark.django_db
+def test_later_reminders_are_scheduled_by_the_sweep(
+    desks, scheduled_tasks, django_capture_on_commit_callbacks, monkeypatch
+):
+    with django_capture_on_commit_callbacks(execute=True):
+        booking = create_booking_at(
+            desks[0], timezone.now() + datetime.timedelta(hours=3)
+        )
+    assert not scheduled_tasks.scheduled
+
+    monkeypatch.setattr(tasks, "REMINDER_SCHEDULE_HORIZON", datetime.timedelta(hours=3))
+    reconcile_booking_reminders()
+    reconcile_booking_reminders()
+
+    assert [args[:2] for args, _ in scheduled_tasks.pending().values()] == [
+        (booking.id, ReminderLedger.IN_30_MIN)
+    ]
+
+
+@pytest.mark.django_db
+def test_a_scheduled_reminder_is_sent_once_when_due(desks):
+    booking = create_booking_at(desks[0], timezone.now() + datetime.timedelta(hours=2))
+    due = booking.start_at - datetime.timedelta(minutes=30)
+    mail.outbox = []
+
+    # Too early, and stale once the booking is moved
+    send_scheduled_booking_reminder(
+        booking.id, ReminderLedger.IN_30_MIN, due.isoformat()
+    )
+    booking.start_time = (timezone.localtime() + datetime.timedelta(minutes=20)).time()
+    booking.save()
+    send_scheduled_booking_reminder(
+        booking.id, ReminderLedger.IN_30_MIN, due.isoformat()
+    )
+    assert not mail.outbox
+
+    booking.refresh_from_db()
+    due = (booking.start_at - datetime.timedelta(minutes=30)).isoformat()
+    send_scheduled_booking_reminder(booking.id, ReminderLedger.IN_30_MIN, due)
+    send_scheduled_booking_reminder(booking.id, ReminderLedger.IN_30_MIN, due)
+    assert sorted(email for message in mail.outbox for email in message.to) == [
+        "admin-0@example.com",
+        "user@example.com",
+    ]
+
+
+@pytest.mark.django_db
+def test_a_moved_booking_is_reminded_of_its_new_start(desks):
+    booking = create_booking_at(
+        desks[0], timezone.now() + datetime.timedelta(minutes=20)
+    )
+    ReminderLedger.objects.create(
+        booking=booking, reminder_kind=ReminderLedger.STILL_PENDING
+    )
+
+    def remind():
+        mail.outbox = []
+        due = (booking.start_at - datetime.timedelta(minutes=30)).isoformat()
+        send_scheduled_booking_reminder(booking.id, ReminderLedger.IN_30_MIN, due)
+        return sorted(email for message in mail.outbox for email in message.to)
+
+    assert remind() == ["admin-0@example.com", "user@example.com"]
+    assert remind() == []
+
+    booking = Bookings.objects.get(id=booking.id)
+    booking.start_time = (
+        timezone.localtime(booking.start_at) + datetime.timedelta(minutes=5)
+    ).time()
+    booking.save()
+    assert list(booking.reminders.values_list("reminder_kind", flat=True)) == [
+        ReminderLedger.STILL_PENDING
+    ]
+    assert remind() == ["admin-0@example.com", "user@example.com"]
+
+
+@pytest.mark.django_db
+def test_the_pending_reminder_only_goes_to_the_admins(desks):
+    desks[0].asset.default_booking_status = "pending"
+    desks[0].asset.save()
+    booking = create_booking_at(desks[0], timezone.now() + datetime.timedelta(days=2))
+    Bookings.objects.filter(id=booking.id).update(
+        create_datetime=timezone.now() - datetime.timedelta(days=1, minutes=5)
+    )
+    booking.refresh_from_db()
+    mail.outbox = []
+
+    send_scheduled_booking_reminder(
+        booking.id,
+        ReminderLedger.STILL_PENDING,
+        (booking.create_datetime + datetime.timedelta(days=1)).isoformat(),
+    )
+    reconcile_booking_reminders()
+
+    assert [message.to for message in mail.outbox] == [["admin-0@example.com"]]
+    assert mail.outbox[0].subject.endswith("Booking still pending after 24 hours")
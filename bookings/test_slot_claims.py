@@ -0,0 +1,213 @@
+import datetime
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from django.db import connections
+from django.test import Client
+
+from accounts.models import Asset, BookableAsset, CustomUser, Membership
+from bookings.conftest import create_desk, next_working_day
+from bookings.models import Bookings, SlotClaim
+from bookings.services import book_slot
+from bookings.utils.asset_schedule import bump_schedule_version
+from bookings.utils.slot_claims import (
+    SlotAlreadyClaimed,
+    get_claimed_slots,
+    prune_past_slot_claims,
+)
+
+CONCURRENT_USERS = 20
+CONCURRENT_REQUESTS = 200
+CONTESTED_SLOTS = ["08:00", "08:30", "09:00", "09:30", "10:00", "10:30"]
+
+
+@pytest.fixture
+def desk(organization):
+    return create_desk(organization, default_booking_status="pending")
+
+
+@pytest.fixture
+def users(desk):
+    users = []
+    for number in range(CONCURRENT_USERS):
+        user = CustomUser.objects.create(
+            username=f"user-{number}",
+            email=f"user-{number}@example.com",
+            first_name="User",
+        )
+        Membership.objects.create(
+            user=user,
+            organization=desk.asset.organization,
+            role=Membership.MEMBER,
+            status="accepted",
+        )
+        users.append(user)
+    return users
+
+
+def claimed_times(booking):
+    return sorted(
+        booking.slot_claims.values_list("start_time", flat=True),
+    )
+
+
+@pytest.mark.django_db
+def test_book_slot_claims_every_covered_slot(desk, users):
+    date = next_working_day()
+    booking = book_slot(users[0], desk, date, datetime.time(9), datetime.time(10))
+
+    assert claimed_times(booking) == [datetime.time(9), datetime.time(9, 30)]
+
+    # Overlapping the second half of the booking
+    with pytest.raises(SlotAlreadyClaimed):
+        book_slot(users[1], desk, date, datetime.time(9, 30), datetime.time(10))
+    # A booking off the grid holds the slots it overlaps
+    with pytest.raises(SlotAlreadyClaimed):
+        book_slot(users[1], desk, date, datetime.time(9, 45), datetime.time(10, 15))
+    assert Bookings.objects.count() == 1
+
+    book_slot(users[1], desk, date, datetime.time(10), datetime.time(10, 30))
+    assert SlotClaim.objects.count() == 3
+
+
+@pytest.mark.django_db
+def test_slot_claims_follow_the_booking(desk, users):
+    date = next_working_day()
+    booking = book_slot(users[0], desk, date, datetime.time(9), datetime.time(9, 30))
+
+    booking.start_time = datetime.time(11)
+    booking.end_time = datetime.time(12)
+    booking.save()
+    assert claimed_times(booking) == [datetime.time(11), datetime.time(11, 30)]
+    book_slot(users[1], desk, date, datetime.time(9), datetime.time(9, 30))
+
+    booking.status = "rejected"
+    booking.save()
+    assert claimed_times(booking) == []
+    book_slot(users[2], desk, date, datetime.time(11), datetime.time(12))
+
+
+@pytest.mark.django_db
+def test_a_booking_across_midnight_claims_the_slots_of_both_dates(desk, users):
+    date = next_working_day()
+    next_date = date + datetime.timedelta(days=1)
+    booking = book_slot(users[0], desk, date, datetime.time(23, 30), datetime.time(1))
+
+    assert sorted(booking.slot_claims.values_list("date", "start_time")) == [
+        (date, datetime.time(23, 30)),
+        (next_date, datetime.time(0)),
+        (next_date, datetime.time(0, 30)),
+    ]
+    with pytest.raises(SlotAlreadyClaimed):
+        book_slot(users[1], desk, date, datetime.time(23, 30), datetime.time(0))
+    with pytest.raises(SlotAlreadyClaimed):
+        book_slot(users[1], desk, next_date, datetime.time(0, 30), datetime.time(1))
+
+    # Moved to the evening, the slots after midnight are given back
+    booking.start_time = datetime.time(22)
+    booking.end_time = datetime.time(0)
+    booking.save()
+    assert claimed_times(booking) == [
+        datetime.time(hour, minute) for hour in [22, 23] for minute in [0, 30]
+    ]
+    book_slot(users[1], desk, next_date, datetime.time(0), datetime.time(1))
+
+
+@pytest.mark.django_db
+def test_bookings_from_before_a_schedule_change_are_still_found(desk, users):
+    date = next_working_day()
+    book_slot(users[0], desk, date, datetime.time(9), datetime.time(10))
+
+    # The new grid starts its slots at 8:00, 8:45, 9:30, so the claims of 9:00 and
+    # 9:30 do not hold 8:45
+    Asset.objects.filter(id=desk.asset_id).update(slot_duration=45)
+    bump_schedule_version(desk.asset_id)
+    assert get_claimed_slots(
+        desk, date, datetime.time(8, 45), datetime.time(9, 15)
+    ) == [(date, datetime.time(8, 45))]
+    with pytest.raises(SlotAlreadyClaimed):
+        book_slot(users[1], desk, date, datetime.time(8, 45), datetime.time(9, 15))
+    assert Bookings.objects.count() == 1
+
+
+@pytest.mark.django_db
+def test_the_claims_of_past_days_are_pruned(desk, users):
+    date = next_working_day()
+    book_slot(users[0], desk, date, datetime.time(9), datetime.time(10))
+    book_slot(users[0], desk, date, datetime.time(23, 30), datetime.time(0, 30))
+
+    assert prune_past_slot_claims(today=date) == 0
+    assert prune_past_slot_claims(today=date + datetime.timedelta(days=1)) == 3
+    assert list(SlotClaim.objects.values_list("date", "start_time")) == [
+        (date + datetime.timedelta(days=1), datetime.time(0))
+    ]
+
+
+@pytest.mark.django_db
+def test_any_does_not_claim_slots(desk, users):
+    any_desk = BookableAsset.objects.create(asset=desk.asset, name="Any")
+    date = next_working_day()
+
+    book_slot(users[0], any_desk, date, datetime.time(9), datetime.time(9, 30))
+    book_slot(users[1], any_desk, date, datetime.time(9), datetime.time(9, 30))
+
+    assert not SlotClaim.objects.exists()
+
+
+@pytest.mark.slow
+@pytest.mark.django_db(transaction=True)
+def test_concurrent_requests_book_every_slot_once(desk, users):
+    date = next_working_day()
+    clients = []
+    for user in users:
+        client = Client()
+        client.force_login(user)
+        clients.append(client)
+
+    rnd = random.Random(11)
+    requests = [
+        (rnd.choice(clients), rnd.choice(CONTESTED_SLOTS))
+        for _ in range(CONCURRENT_REQUESTS)
+    ]
+
+    def request_booking(client_and_slot):
+        client, time_slot = client_and_slot
+        # Every thread has a client of its own, they share the session of the user
+        thread_client = Client()
+        thread_client.cookies = client.cookies
+        try:
+            response = thread_client.post(
+                f"/tad_book/bookings/request_booking/{time_slot}/",
+                {
+                    "bookable_asset": desk.id,
+                    "selected_date": date.strftime("%d-%m-%Y"),
+                },
+            )
+            return time_slot, response.status_code, response.content.decode()
+        finally:
+            connections.close_all()
+
+    with ThreadPoolExecutor(max_workers=32) as executor:
+        results = list(executor.map(request_booking, requests))
+
+    assert all(status_code == 200 for _, status_code, _ in results)
+    booked = [
+        time_slot
+        for time_slot, _, content in results
+        if "A booking has been requested" in content
+    ]
+    refused = [
+        time_slot
+        for time_slot, _, content in results
+        if "has just been booked by someone else" in content
+    ]
+    assert sorted(booked) == sorted(set(time_slot for _, time_slot in requests))
+    assert len(booked) + len(refused) == CONCURRENT_REQUESTS
+
+    bookings = Bookings.objects.filter(bookable_asset=desk, date=date)
+    assert sorted(booking.start_time.strftime("%H:%M") for booking in bookings) == (
+        sorted(booked)
+    )
+    assert SlotClaim.objects.filter(booking__in=bookings).count() == len(booked)
+    assert not SlotClaim.objects.filter(booking=None).exists()
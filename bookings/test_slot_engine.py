@@ -0,0 +1,174 @@
+import datetime
+import random
+
+from bookings.utils import slot_engine
+from bookings.utils.db_helpers import (
+    calculate_slots,
+    calculate_slots_for_working_hours,
+    count_booked_bookable_assets_per_slot,
+)
+from bookings.models import Bookings
+
+DATE = datetime.date(2024, 7, 1)
+
+
+def calculate_slots_with_datetimes(start, end, buffer, duration):
+    """The slots as the datetime based calculate_slots returns them, in minutes."""
+    midnight = datetime.datetime.combine(DATE, datetime.time())
+    slots = calculate_slots(
+        midnight + datetime.timedelta(minutes=start),
+        midnight + datetime.timedelta(minutes=end),
+        midnight + datetime.timedelta(minutes=start + buffer),
+        datetime.timedelta(minutes=duration),
+    )
+    return [(slot - midnight) / datetime.timedelta(minutes=1) for slot in slots]
+
+
+def count_busy_per_slot_brute_force(starts, duration, busy_by_resource):
+    return [
+        sum(
+            any(
+                busy_start < start + duration and start < busy_end
+                for busy_start, busy_end in intervals
+            )
+            for intervals in busy_by_resource.values()
+        )
+        for start in starts
+    ]
+
+
+def random_day(rnd):
+    start = rnd.randrange(0, 20 * 60, 5)
+    end = rnd.randrange(start, 24 * 60)
+    return slot_engine.DaySchedule(
+        start=start,
+        end=end,
+        buffer=rnd.choice([0, 0, 10, 15, 7.5, 60]),
+        duration=rnd.choice([5, 15, 20, 30, 45, 60]),
+    )
+
+
+def random_busy(rnd, count):
+    busy = []
+    for _ in range(count):
+        start = rnd.randrange(0, 24 * 60)
+        busy.append((start, start + rnd.randrange(0, 240)))
+    return busy
+
+
+def test_slot_starts_matches_calculate_slots():
+    rnd = random.Random(9)
+    for _ in range(500):
+        day = random_day(rnd)
+        starts = slot_engine.slot_starts(day.start, day.end, day.buffer, day.duration)
+
+        assert starts == calculate_slots_with_datetimes(*day)
+        assert all(day.start + day.buffer <= start for start in starts)
+        assert all(start + day.duration <= day.end for start in starts)
+        assert all(b - a == day.duration for a, b in zip(starts, starts[1:]))
+
+
+def test_count_busy_per_slot_matches_brute_force():
+    rnd = random.Random(10)
+    for _ in range(500):
+        day = random_day(rnd)
+        starts = slot_engine.slot_starts(day.start, day.end, day.buffer, day.duration)
+        busy_by_resource = {
+            resource: random_busy(rnd, rnd.randint(0, 8))
+            for resource in range(rnd.randint(0, 5))
+        }
+
+        counts = slot_engine.count_busy_per_slot(starts, day.duration, busy_by_resource)
+
+        assert counts == count_busy_per_slot_brute_force(
+            starts, day.duration, busy_by_resource
+        )
+        assert all(0 <= count <= len(busy_by_resource) for count in counts)
+        assert slot_engine.free_capacity(
+            starts, day.duration, busy_by_resource, len(busy_by_resource)
+        ) == [
+            (start, len(busy_by_resource) - count)
+            for start, count in zip(starts, counts)
+            if count < len(busy_by_resource)
+        ]
+
+
+def test_free_slots_do_not_overlap_busy_intervals():
+    rnd = random.Random(11)
+    for _ in range(500):
+        day = random_day(rnd)
+        starts = slot_engine.slot_starts(day.start, day.end, day.buffer, day.duration)
+        busy = random_busy(rnd, rnd.randint(0, 10))
+
+        free = slot_engine.free_slots(starts, day.duration, busy)
+
+        assert set(free) <= set(starts)
+        for start in starts:
+            overlaps = any(
+                busy_start < start + day.duration and start < busy_end
+                for busy_start, busy_end in busy
+            )
+            assert (start in free) != overlaps
+
+
+def test_free_slots_for_days_matches_single_days():
+    rnd = random.Random(12)
+    days = {key: random_day(rnd) for key in range(200)}
+    busy_by_day = {key: random_busy(rnd, 3) for key in range(0, 200, 2)}
+
+    free = slot_engine.free_slots_for_days(days, busy_by_day)
+
+    for key, day in days.items():
+        starts = slot_engine.slot_starts(day.start, day.end, day.buffer, day.duration)
+        assert free[key] == slot_engine.free_slots(
+            starts, day.duration, busy_by_day.get(key, [])
+        )
+
+
+def test_epoch_minutes_span_several_days():
+    monday = 1000 * 24 * 60
+    days = {
+        day: slot_engine.DaySchedule(
+            start=monday + day * 24 * 60 + 8 * 60,
+            end=monday + day * 24 * 60 + 10 * 60,
+            buffer=0,
+            duration=60,
+        )
+        for day in range(2)
+    }
+
+    free = slot_engine.free_slots_for_days(
+        days, {1: [(monday + 24 * 60 + 8 * 60, monday + 24 * 60 + 8 * 60 + 30)]}
+    )
+
+    assert free == {
+        0: [monday + 8 * 60, monday + 9 * 60],
+        1: [monday + 24 * 60 + 9 * 60],
+    }
+
+
+def test_django_adapters_convert_to_and_from_minutes():
+    slots = calculate_slots_for_working_hours(
+        DATE, datetime.time(8), datetime.time(10), 15, 30
+    )
+    assert slots == [
+        datetime.datetime(2024, 7, 1, 8, 30),
+        datetime.datetime(2024, 7, 1, 9, 0),
+        datetime.datetime(2024, 7, 1, 9, 30),
+    ]
+
+    bookings = [
+        Bookings(
+            bookable_asset_id=1,
+            start_time=datetime.time(8, 45),
+            end_time=datetime.time(9, 0, 30),
+        ),
+        Bookings(
+            bookable_asset_id=2,
+            start_time=datetime.time(9, 0),
+            end_time=datetime.time(9, 30),
+        ),
+    ]
+    assert count_booked_bookable_assets_per_slot(
+        bookings, slots, datetime.timedelta(minutes=30)
+    ) == [1, 2, 0]
@@ -135,6 +135,11 @@ urlpatterns = [
 
 htmx_urlpatterns = [
     path("get_bookable_assets/", views.get_bookable_assets, name="get_bookable_assets"),
+    path(
+        "next_available_slots/",
+        views.next_available_slots,
+        name="next_available_slots",
+    ),
     path(
         "request_booking/<str:time_slot>/",
         views.request_booking,
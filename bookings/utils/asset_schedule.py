@@ -0,0 +1,232 @@
+import datetime
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+from django.core.cache import cache
+
+from accounts.models import Asset, BookableAsset, Config, Organization
+from bookings.utils.db_helpers import (
+    get_config,
+    get_weekday_num_from_date,
+    minutes_to_slots,
+)
+from bookings.utils.slot_engine import minutes_to_time, slot_starts, time_to_minutes
+
+SCHEDULE_VERSION_KEY = "availability:schedule_version:{asset_id}"
+BOOKINGS_VERSION_KEY = "availability:bookings_version:{asset_id}"
+ORGANIZATION_BOOKINGS_VERSION_KEY = (
+    "availability:organization_bookings_version:{organization_id}"
+)
+
+# Schedules built by this process, keyed by asset id with the versions they were built for
+_asset_schedules = {}
+# Seconds a memoised schedule is kept even if its version did not change, in case a
+# bump was lost, like when the cache was cleared
+ASSET_SCHEDULE_TTL = 300
+
+
+def _get_version(key):
+    """Return the version stored under key, starting a new one if it is missing."""
+    version = cache.get(key)
+    if version is None:
+        # Start from the current time so a version that was evicted from the cache
+        # can never come back with a number that was already used
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def _bump_version(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), None)
+
+
+def get_schedule_version(asset_id):
+    """Return the version of the asset settings, bookable hours, no bookings days and pool."""
+    return _get_version(SCHEDULE_VERSION_KEY.format(asset_id=asset_id))
+
+
+def bump_schedule_version(asset_id):
+    """Invalidate the schedule and the cached availability of the given asset."""
+    _bump_version(SCHEDULE_VERSION_KEY.format(asset_id=asset_id))
+
+
+def get_bookings_version(asset_id):
+    """Return the version of the bookings the availability of the given asset depends on.
+
+    These are the bookings of the bookable assets of the asset, or of the whole
+    organization when its bookings can not overlap across the organization.
+    """
+    schedule = get_asset_schedule(asset_id)
+    if schedule.conflict_scope == Organization.CONFLICT_SCOPE_ORGANIZATION:
+        return _get_version(
+            ORGANIZATION_BOOKINGS_VERSION_KEY.format(
+                organization_id=schedule.organization_id
+            )
+        )
+    return _get_version(BOOKINGS_VERSION_KEY.format(asset_id=asset_id))
+
+
+def bump_bookings_version(asset_id):
+    """Invalidate the cached availability of the given asset after a booking changed."""
+    _bump_version(BOOKINGS_VERSION_KEY.format(asset_id=asset_id))
+    try:
+        organization_id = get_asset_schedule(asset_id).organization_id
+    except Asset.DoesNotExist:
+        return
+    _bump_version(
+        ORGANIZATION_BOOKINGS_VERSION_KEY.format(organization_id=organization_id)
+    )
+
+
+def get_config_version():
+    """Return the version of the config, it is part of the schedule of every asset."""
+    return Config.get_version()
+
+
+@dataclass(frozen=True)
+class AssetSchedule:
+    """The bookable hours and slot settings of an asset.
+
+    days holds a (start, end, is_active) tuple in minutes since midnight for every day
+    of the week, indexed like DAYS_OF_WEEK (0 is Sunday), or None when the asset has
+    no bookable hours for that day. slot_duration and buffer_time are in minutes and
+    already fall back to the config. conflict_scope is one of the CONFLICT_SCOPE
+    constants of Organization.
+    """
+
+    asset_id: int
+    organization_id: int
+    conflict_scope: str
+    days: tuple
+    slot_duration: float
+    buffer_time: float
+    max_days_ahead: Optional[int]
+
+    def get_day(self, date):
+        return self.days[get_weekday_num_from_date(date)]
+
+    def is_working_day(self, date):
+        day = self.get_day(date)
+        return day is not None and day[2]
+
+    def get_working_hours(self, date):
+        """Return the start and end time of the given date, None if it is not a working day."""
+        if not self.is_working_day(date):
+            return None
+        start, end, _ = self.get_day(date)
+        return minutes_to_time(start), minutes_to_time(end)
+
+    def is_in_bookable_time_frame(self, target_date, today=None):
+        """Check if the target_date is not further ahead than max_days_ahead allows."""
+        if self.max_days_ahead is not None and self.max_days_ahead > 0:
+            today = today or datetime.date.today()
+            max_bookable_date = today + datetime.timedelta(days=self.max_days_ahead)
+            return today <= target_date <= max_bookable_date
+        return True
+
+    def get_slots(self, date):
+        """Return the slots of the given date, ignoring no bookings days and bookings."""
+        if not self.is_working_day(date):
+            return []
+        start, end, _ = self.get_day(date)
+        return minutes_to_slots(
+            date, slot_starts(start, end, self.buffer_time, self.slot_duration)
+        )
+
+    def get_conflicting_bookable_assets(self, bookable_assets):
+        """Return the bookable assets whose bookings can not overlap with bookings of
+        the given bookable assets of this asset.
+
+        For the widest scopes this is a queryset, it becomes a subquery of the query
+        it is passed to, so the bookings of a whole organization are still fetched with
+        a single query. "Any" is left out, its bookings are requests that hold nothing.
+
+        :param bookable_assets: A bookable asset or an iterable of bookable assets or their ids.
+        :return: A list or a queryset of bookable assets.
+        """
+        if self.conflict_scope == Organization.CONFLICT_SCOPE_ORGANIZATION:
+            return BookableAsset.objects.filter(
+                asset__organization_id=self.organization_id
+            ).exclude(name="Any")
+        if self.conflict_scope == Organization.CONFLICT_SCOPE_ASSET:
+            return BookableAsset.objects.filter(asset_id=self.asset_id).exclude(
+                name="Any"
+            )
+        if isinstance(bookable_assets, BookableAsset):
+            return [bookable_assets]
+        return bookable_assets
+
+
+def build_asset_schedule(asset_id):
+    """Build the schedule of an asset with a single query, the config comes from the cache.
+
+    The conflict scope of the organization is part of the schedule, so a change of the
+    exclusive booking flags has to bump the schedule version of its assets.
+    """
+    rows = list(
+        Asset.objects.filter(id=asset_id).values(
+            "slot_duration",
+            "buffer_time",
+            "max_days_ahead",
+            "organization_id",
+            "organization__exclusive_booking_accross_organization",
+            "organization__exclusive_booking_accross_asset",
+            "assetbookablehours__day_of_week",
+            "assetbookablehours__start_time",
+            "assetbookablehours__end_time",
+            "assetbookablehours__is_active",
+        )
+    )
+    if not rows:
+        raise Asset.DoesNotExist(f"Asset {asset_id} does not exist")
+
+    days = [None] * 7
+    for row in rows:
+        if row["assetbookablehours__day_of_week"] is not None:
+            days[row["assetbookablehours__day_of_week"]] = (
+                time_to_minutes(row["assetbookablehours__start_time"]),
+                time_to_minutes(row["assetbookablehours__end_time"]),
+                row["assetbookablehours__is_active"],
+            )
+
+    config = get_config()
+    config_slot_duration = config.slot_duration if config else 30
+    config_buffer_time = config.buffer_time if config else 0
+    return AssetSchedule(
+        asset_id=asset_id,
+        organization_id=rows[0]["organization_id"],
+        conflict_scope=Organization.get_conflict_scope(
+            rows[0]["organization__exclusive_booking_accross_organization"],
+            rows[0]["organization__exclusive_booking_accross_asset"],
+        ),
+        days=tuple(days),
+        slot_duration=rows[0]["slot_duration"] or config_slot_duration,
+        buffer_time=rows[0]["buffer_time"] or config_buffer_time,
+        max_days_ahead=rows[0]["max_days_ahead"],
+    )
+
+
+def get_asset_schedule(asset_id):
+    """Get the schedule of an asset, memoised in this process until its version changes.
+
+    The versions live in the shared cache, so a change made in any gunicorn or celery
+    worker is picked up by all of them on their next lookup. A schedule is rebuilt
+    after ASSET_SCHEDULE_TTL seconds regardless.
+    """
+    asset_id = int(asset_id)
+    version = (get_schedule_version(asset_id), get_config_version())
+    now = time.monotonic()
+    memoised = _asset_schedules.get(asset_id)
+    if (
+        memoised is not None
+        and memoised[0] == version
+        and now - memoised[1] < ASSET_SCHEDULE_TTL
+    ):
+        return memoised[2]
+    schedule = build_asset_schedule(asset_id)
+    _asset_schedules[asset_id] = (version, now, schedule)
+    return schedule
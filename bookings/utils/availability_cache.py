@@ -0,0 +1,74 @@
+from django.core.cache import cache
+
+from bookings.services import get_capacity_range
+from bookings.utils.asset_schedule import (
+    get_bookings_version,
+    get_config_version,
+    get_schedule_version,
+)
+
+# The versions never expire, the cached slots are dropped after an hour
+AVAILABILITY_CACHE_TIMEOUT = 60 * 60
+
+AVAILABLE_SLOTS_KEY = "availability:slots:{bookable_asset_id}:{date}:{schedule_version}:{bookings_version}:{config_version}"
+CACHE_HITS_KEY = "availability:hits"
+CACHE_MISSES_KEY = "availability:misses"
+
+
+def _count(key):
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        pass
+
+
+def get_cached_available_slots(bookable_asset, date):
+    """Get the available slots with their free capacity, see get_available_slots_with_capacity.
+
+    The result is cached per bookable asset and date. The key also holds the schedule
+    and bookings versions of the asset the bookable asset belongs to and the config
+    version, so any change to the bookings, no bookings days, bookable hours, asset or
+    config makes the old entries unreachable.
+
+    :param bookable_asset: The bookable asset to get the available slots for.
+    :param date: The date to get the available slots for.
+    :return: A list of (slot, free_capacity) tuples.
+    """
+    asset_id = bookable_asset.asset_id
+    key = AVAILABLE_SLOTS_KEY.format(
+        bookable_asset_id=bookable_asset.id,
+        date=date.isoformat(),
+        schedule_version=get_schedule_version(asset_id),
+        bookings_version=get_bookings_version(asset_id),
+        config_version=get_config_version(),
+    )
+    available_slots = cache.get(key)
+    if available_slots is not None:
+        _count(CACHE_HITS_KEY)
+        return available_slots
+
+    _count(CACHE_MISSES_KEY)
+    available_slots = get_capacity_range(bookable_asset, date, date)[date]
+    cache.set(key, available_slots, AVAILABILITY_CACHE_TIMEOUT)
+    return available_slots
+
+
+def get_availability_cache_stats():
+    """Return the number of cache hits and misses and the hit ratio of the availability cache.
+
+    The counters are kept in the cache, so they add up the hits and misses of every
+    process that shares it. log_availability_cache_stats logs and resets them hourly.
+    """
+    hits = cache.get(CACHE_HITS_KEY, 0)
+    misses = cache.get(CACHE_MISSES_KEY, 0)
+    total = hits + misses
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_ratio": hits / total if total else 0.0,
+    }
+
+
+def reset_availability_cache_stats():
+    cache.delete_many([CACHE_HITS_KEY, CACHE_MISSES_KEY])
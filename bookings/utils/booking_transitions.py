@@ -0,0 +1,77 @@
+from django.db import transaction
+from django.utils import timezone
+
+from bookings.models import Bookings, SlotClaim
+from bookings.tasks import (
+    schedule_booking_reminders,
+    send_booking_status_notifications,
+)
+from bookings.utils.asset_schedule import bump_bookings_version
+from bookings.utils.slot_claims import INACTIVE_BOOKING_STATUSES, sync_slot_claims
+
+
+def transition_bookings(bookings, status):
+    """Move bookings to a status with a single update instead of a save per booking.
+
+    The update does not send the post_save signals, so what their receivers do for a
+    single booking is done here once for all of them: the cached availability of every
+    affected asset is invalidated, the slot claims follow the status, the reminders
+    follow the status and one notification job is sent, which mails every recipient a
+    single summary of their bookings. The reminders and the notifications wait for
+    the commit, so a worker reads the new statuses and a rolled back transition sends
+    nothing.
+
+    :param bookings: A queryset or an iterable of bookings.
+    :param status: The new status, one of BOOKING_STATUS_CHOICES.
+    :return: The number of bookings that changed status.
+    """
+    if not hasattr(bookings, "values_list"):
+        bookings = Bookings.objects.filter(id__in=[booking.id for booking in bookings])
+
+    changed = list(
+        bookings.exclude(status=status).values_list(
+            "id", "status", "bookable_asset__asset_id"
+        )
+    )
+    if not changed:
+        return 0
+    booking_ids = [booking_id for booking_id, _, _ in changed]
+
+    with transaction.atomic():
+        Bookings.objects.filter(id__in=booking_ids).update(
+            status=status, update_datetime=timezone.now()
+        )
+        if status in INACTIVE_BOOKING_STATUSES:
+            SlotClaim.objects.filter(booking_id__in=booking_ids).delete()
+        else:
+            # Bookings that come back from an inactive status take their slots again
+            for booking in Bookings.objects.filter(
+                id__in=[
+                    booking_id
+                    for booking_id, old_status, _ in changed
+                    if old_status in INACTIVE_BOOKING_STATUSES
+                ]
+            ).select_related("bookable_asset"):
+                sync_slot_claims(booking)
+
+    for asset_id in {asset_id for _, _, asset_id in changed}:
+        transaction.on_commit(lambda asset_id=asset_id: bump_bookings_version(asset_id))
+
+    reminder_bookings = Bookings.objects.filter(id__in=booking_ids).only(
+        "id", "status", "start_at", "create_datetime"
+    )
+    transaction.on_commit(lambda: schedule_booking_reminders(reminder_bookings))
+    transaction.on_commit(
+        lambda: send_booking_status_notifications.delay(booking_ids, status)
+    )
+    return len(changed)
+
+
+def reject_bookings(bookings):
+    """Reject the bookings, see transition_bookings."""
+    return transition_bookings(bookings, "rejected")
+
+
+def cancel_bookings(bookings):
+    """Cancel the bookings, see transition_bookings."""
+    return transition_bookings(bookings, "canceled")
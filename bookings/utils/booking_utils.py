@@ -5,14 +5,3 @@ BOOKING_STATUS_CHOICES = [
     ("canceled", "Canceled"),
 ]
 
-
-def cancel_bookings(bookings):
-    for booking in bookings:
-        booking.status = "cancelled"
-        booking.save()
-
-
-def reject_bookings(bookings):
-    for booking in bookings:
-        booking.status = "rejected"
-        booking.save()
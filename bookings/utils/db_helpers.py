@@ -1,10 +1,11 @@
 import datetime
+from collections import defaultdict
 from typing import Optional
-from accounts.models import Asset, AssetBookableHours, Config
-from accounts.utils.date_time import get_weekday_num
-from django.core.cache import cache
+from accounts.models import Asset, AssetBookableHours, BookableAsset, Config
+from accounts.utils.date_time import get_weekday_num, make_aware_in_site_time_zone
 
-from bookings.models import Bookings, NoBookings
+from bookings.models import Bookings, BookingSeries, NoBookings, get_booking_range
+from bookings.utils import slot_engine
 from django.db.models import Q
 
 
@@ -105,10 +106,11 @@ def get_working_hours_for_asset_and_day(asset_id, day_of_week):
         asset=asset_id, day_of_week=day_of_week, is_active=True
     ).first()
     if not working_hours:
+        config = get_config()
         return {
             "day_of_week": day_of_week,
-            "start_time": Config.objects.first().get_start_time(),
-            "end_time": Config.objects.first().get_end_time(),
+            "start_time": config.get_start_time(),
+            "end_time": config.get_end_time(),
         }
 
     # If a WorkingHours instance is found, convert it to a dictionary for consistent return type
@@ -131,25 +133,170 @@ def calculate_bookable_asset_slots(date, bookable_asset):
     if not get_is_working_day(bookable_asset.asset.id, weekday_num):
         print("Is not worknig day")
         return []
-    start_time = datetime.datetime.combine(
-        date, get_asset_start_time(bookable_asset.asset, date)
+
+    return calculate_slots_for_working_hours(
+        date,
+        get_asset_start_time(bookable_asset.asset, date),
+        get_asset_end_time(bookable_asset.asset, date),
+        get_asset_buffer_time(bookable_asset.asset, date),
+        get_asset_slot_duration(bookable_asset.asset, date),
     )
-    end_time = datetime.datetime.combine(
-        date, get_asset_end_time(bookable_asset.asset, date)
+
+
+def calculate_slots_for_working_hours(
+    date, start_time, end_time, buffer_duration_minutes, slot_duration_minutes
+):
+    """Calculate the slots for the given date from already resolved working hours.
+
+    :param date: The date to calculate the slots for.
+    :param start_time: The time the asset starts accepting bookings.
+    :param end_time: The time the asset stops accepting bookings.
+    :param buffer_duration_minutes: The buffer after the start time in minutes.
+    :param slot_duration_minutes: The duration of each slot in minutes.
+    :return: A list of available slots.
+    """
+    return minutes_to_slots(
+        date,
+        slot_engine.slot_starts(
+            slot_engine.time_to_minutes(start_time),
+            slot_engine.time_to_minutes(end_time),
+            buffer_duration_minutes,
+            slot_duration_minutes,
+        ),
     )
 
-    # Convert the buffer duration in minutes to a timedelta object
-    buffer_duration_minutes = get_asset_buffer_time(bookable_asset.asset, date)
-    buffer_duration = datetime.timedelta(minutes=buffer_duration_minutes)
-    buffer_time_init = datetime.datetime.combine(date, start_time.time())
-    buffer_time = buffer_time_init + buffer_duration
-    print(buffer_time)
 
-    # Convert slot duration to a timedelta object
-    slot_duration_minutes = get_asset_slot_duration(bookable_asset.asset, date)
-    slot_duration = datetime.timedelta(minutes=slot_duration_minutes)
+def minutes_to_slots(date, minutes):
+    """Convert slot starts in minutes since midnight to datetimes on the given date."""
+    midnight = datetime.datetime.combine(date, datetime.time())
+    return [midnight + datetime.timedelta(minutes=start) for start in minutes]
+
+
+def slots_to_minutes(slots):
+    """Convert slot start datetimes to minutes since midnight."""
+    return [slot_engine.time_to_minutes(slot.time()) for slot in slots]
+
+
+def split_booking_by_date(booking):
+    """Return the part of a booking on every date it covers.
+
+    A booking that ends before it starts crosses midnight, it covers the rest of its
+    own date and the start of the next one.
+
+    :param booking: A booking or an occurrence of a booking series.
+    :return: A list of (date, start, end) tuples, start and end in minutes since midnight.
+    """
+    start = slot_engine.time_to_minutes(booking.get_start_time())
+    end = slot_engine.time_to_minutes(booking.get_end_time())
+    if end >= start:
+        return [(booking.date, start, end)]
+    return [
+        (booking.date, start, slot_engine.MINUTES_PER_DAY),
+        (booking.date + datetime.timedelta(days=1), 0, end),
+    ]
+
+
+def bookings_to_busy_intervals(bookings, date=None):
+    """Convert bookings to (start, end) intervals in minutes since midnight per bookable asset.
+
+    :param bookings: The bookings to convert.
+    :param date: Only convert the parts of the bookings on this date, see split_booking_by_date.
+        Without a date only the part of every booking on its own date is converted.
+    """
+    busy_by_bookable_asset = defaultdict(list)
+    for booking in bookings:
+        for part_date, start, end in split_booking_by_date(booking):
+            if part_date == (date or booking.date):
+                busy_by_bookable_asset[booking.bookable_asset_id].append((start, end))
+    return busy_by_bookable_asset
+
+
+def get_no_bookings_dates_for_range(asset_id, start_date, end_date) -> set:
+    """Return the dates between start_date and end_date that are no bookings days.
+
+    :param asset_id: The asset id to check.
+    :param start_date: The first date of the range.
+    :param end_date: The last date of the range (inclusive).
+    :return: A set of datetime.date objects.
+    """
+    no_bookings_dates = set()
+    no_bookings = NoBookings.objects.filter(
+        asset=asset_id, start_date__lte=end_date, end_date__gte=start_date
+    ).values_list("start_date", "end_date")
+    for no_booking_start, no_booking_end in no_bookings:
+        day = max(no_booking_start, start_date)
+        last_day = min(no_booking_end, end_date)
+        while day <= last_day:
+            no_bookings_dates.add(day)
+            day += datetime.timedelta(days=1)
+    return no_bookings_dates
+
+
+def get_working_hours_for_asset(asset_id) -> dict:
+    """Get the active working hours of the given asset for every day of the week.
+
+    :param asset_id: The asset id to get the working hours for.
+    :return: A dictionary keyed by day of the week in the same format as
+        get_working_hours_for_asset_and_day. Days that are not working days are omitted.
+    """
+    working_hours = AssetBookableHours.objects.filter(
+        asset=asset_id, is_active=True
+    ).values("day_of_week", "start_time", "end_time")
+    return {hours["day_of_week"]: hours for hours in working_hours}
+
+
+def get_bookings_for_date_range(start_date, end_date, bookable_assets):
+    """Returns all active bookings for the given bookable assets between two dates.
+
+    Bookings that cross midnight into the range from the day before are included.
+
+    :param start_date: The first date of the range.
+    :param end_date: The last date of the range (inclusive).
+    :param bookable_assets: A bookable asset, an iterable of bookable assets or their ids
+        or a queryset of bookable assets.
+
+    :return: QuerySet, all bookings that are not rejected or canceled in the range
+    """
+    if isinstance(bookable_assets, BookableAsset):
+        bookable_assets = [bookable_assets]
+    return Bookings.objects.filter(
+        start_at__lt=make_aware_in_site_time_zone(
+            end_date + datetime.timedelta(days=1), datetime.time()
+        ),
+        end_at__gt=make_aware_in_site_time_zone(start_date, datetime.time()),
+        bookable_asset__in=bookable_assets,
+    ).exclude(status__in=["rejected", "canceled"])
 
-    return calculate_slots(start_time, end_time, buffer_time, slot_duration)
+
+def get_series_occurrences_for_date_range(
+    start_date, end_date, bookable_assets, exclude_series_id=None
+):
+    """Returns the occurrences of all active booking series for the given bookable assets
+    between two dates, only the dates in the range are expanded.
+
+    :param start_date: The first date of the range.
+    :param end_date: The last date of the range (inclusive).
+    :param bookable_assets: A bookable asset, an iterable of bookable assets or their ids
+        or a queryset of bookable assets.
+    :param exclude_series_id: A series that is left out, the one being edited.
+
+    :return: A list of unsaved bookings, see BookingSeries.get_occurrences
+    """
+    if isinstance(bookable_assets, BookableAsset):
+        bookable_assets = [bookable_assets]
+    series = (
+        BookingSeries.objects.filter(
+            bookable_asset__in=bookable_assets, first_date__lte=end_date
+        )
+        .filter(Q(last_date__gte=start_date) | Q(last_date=None))
+        .exclude(status__in=["rejected", "canceled"])
+        .exclude(id=exclude_series_id)
+    )
+    return [
+        occurrence
+        for booking_series in series
+        for occurrence in booking_series.get_occurrences(start_date, end_date)
+    ]
 
 
 def get_asset_start_time(asset: Asset, date: datetime.date) -> Optional[datetime.time]:
@@ -167,13 +314,8 @@ def get_asset_end_time(asset: Asset, date: datetime.date) -> Optional[datetime.t
 
 
 def get_config():
-    """Returns the configuration object from the database or the cache."""
-    config = cache.get("config")
-    if not config:
-        config = Config.objects.first()
-        # Cache the configuration for 1 hour (3600 seconds)
-        cache.set("config", config, 3600)
-    return config
+    """Returns the configuration object, see Config.get_instance."""
+    return Config.get_instance()
 
 
 def get_times_from_config(date):
@@ -208,66 +350,95 @@ def get_times_from_config(date):
     return start_time, end_time, slot_duration, buff_time
 
 
-def get_bookings_for_date_and_time(date, start_time, end_time, bookable_asset):
-    """Returns all appointments that overlap with the specified date and time range.
+def get_bookings_for_date_and_time(date, start_time, end_time, bookable_assets):
+    """Returns all active bookings that overlap with the specified date and time range.
 
-    :param date: The date to filter appointments on.
-    :param start_time: The starting time to filter appointments on.
-    :param end_time: The ending time to filter appointments on.
-    :param staff_member: The staff member to filter appointments on.
+    Bookings that end when the range starts or start when it ends do not overlap. An
+    end_time before start_time is on the next day, like for a booking.
 
-    :return: QuerySet, all appointments that overlap with the specified date and time range
-    """
-    exclusive_booking_accross_organization = False
-    exclusive_booking_accross_asset = False
-
-    # A single bookable asset can not have a booking that overlaps
-
-    if exclusive_booking_accross_organization:
-        return Bookings.objects.filter(
-            date=date,
-            start_time__lte=end_time,
-            end_time__gte=start_time,
-            bookable_asset=bookable_asset,
-            bookable_asset__asset__organization=bookable_asset.asset.organization,
-        ).exclude(status__in=(["rejected", "canceled"]))
-
-    if exclusive_booking_accross_asset:
-        return Bookings.objects.filter(
-            date=date,
-            start_time__lte=end_time,
-            end_time__gte=start_time,
-            bookable_asset__asset=bookable_asset.asset,
-        ).exclude(status__in=["rejected", "canceled"])
+    :param date: The date to filter bookings on.
+    :param start_time: The starting time to filter bookings on.
+    :param end_time: The ending time to filter bookings on.
+    :param bookable_assets: A bookable asset, an iterable of bookable assets or their ids
+        or a queryset of bookable assets, see AssetSchedule.get_conflicting_bookable_assets.
 
+    :return: QuerySet, all bookings that overlap with the specified date and time range
+    """
+    if isinstance(bookable_assets, BookableAsset):
+        bookable_assets = [bookable_assets]
+    start_at, end_at = get_booking_range(date, start_time, end_time)
     return Bookings.objects.filter(
-        date=date,
-        start_time__lte=end_time,
-        end_time__gte=start_time,
-        bookable_asset=bookable_asset,
+        start_at__lt=end_at,
+        end_at__gt=start_at,
+        bookable_asset__in=bookable_assets,
     ).exclude(status__in=["rejected", "canceled"])
 
 
+def get_series_occurrences_for_date_and_time(
+    date, start_time, end_time, bookable_assets, exclude_series_id=None
+):
+    """Returns the occurrences of active booking series that overlap with the specified
+    date and time range, like get_bookings_for_date_and_time.
+
+    The range and the occurrences may cross midnight, so the occurrences of the day
+    before and the day after the range are looked at as well.
+
+    :param date: The date of the range.
+    :param start_time: The start time of the range.
+    :param end_time: The end time of the range, before start_time it is on the next day.
+    :param bookable_assets: A bookable asset, an iterable of bookable assets or their ids
+        or a queryset of bookable assets.
+    :param exclude_series_id: A series that is left out, the one being edited.
+
+    :return: A list of unsaved bookings, see BookingSeries.get_occurrences
+    """
+    start_at, end_at = get_booking_range(date, start_time, end_time)
+    overlapping = []
+    for occurrence in get_series_occurrences_for_date_range(
+        date - datetime.timedelta(days=1),
+        date + datetime.timedelta(days=1),
+        bookable_assets,
+        exclude_series_id=exclude_series_id,
+    ):
+        occurrence_start_at, occurrence_end_at = get_booking_range(
+            occurrence.date, occurrence.start_time, occurrence.end_time
+        )
+        if occurrence_start_at < end_at and start_at < occurrence_end_at:
+            overlapping.append(occurrence)
+    return overlapping
+
+
 def exclude_booked_slots(bookings, slots, slot_duration=None):
+    """Remove the slots that overlap with any of the given bookings.
 
-    available_slots = []
-    for slot in slots:
-        slot_end = slot + slot_duration
-        is_available = True
-        for booking in bookings:
-            booking_start_time = booking.get_start_time()
-            booking_end_time = booking.get_end_time()
-
-            # Print out variables for debugging
-            print(f"Slot: {slot.time()}")
-            print(f"Slot End: {slot_end.time()}")
-            print(f"Booking Start Time: {booking_start_time}")
-            print(f"Booking End Time: {booking_end_time}")
-
-            if booking_start_time < slot_end.time() and slot.time() < booking_end_time:
-                print("false")
-                is_available = False
-                break
-        if is_available:
-            available_slots.append(slot)
-    return available_slots
+    :param bookings: The bookings that occupy time on the day of the slots.
+    :param slots: The slot start datetimes in ascending order, as returned by calculate_slots.
+    :param slot_duration: The duration of each slot as a timedelta.
+    :return: A list of the slots that do not overlap with a booking.
+    """
+    busy = [
+        interval
+        for intervals in bookings_to_busy_intervals(bookings).values()
+        for interval in intervals
+    ]
+    booked_counts = slot_engine.count_busy_per_slot(
+        slots_to_minutes(slots), slot_duration.total_seconds() / 60, {None: busy}
+    )
+    return [slot for slot, booked in zip(slots, booked_counts) if not booked]
+
+
+def count_booked_bookable_assets_per_slot(bookings, slots, slot_duration, date=None):
+    """Count for every slot how many distinct bookable assets have a booking overlapping it.
+
+    :param bookings: The bookings of all the bookable assets in the pool on the day of the slots.
+    :param slots: The slot start datetimes in ascending order, as returned by calculate_slots.
+    :param slot_duration: The duration of each slot as a timedelta.
+    :param date: The date of the slots, bookings from the day before that cross midnight
+        hold its first slots. Defaults to the own date of every booking.
+    :return: A list with the number of booked bookable assets for every slot.
+    """
+    return slot_engine.count_busy_per_slot(
+        slots_to_minutes(slots),
+        slot_duration.total_seconds() / 60,
+        bookings_to_busy_intervals(bookings, date),
+    )
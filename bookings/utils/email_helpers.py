@@ -1,4 +1,5 @@
-from datetime import datetime
+from collections import defaultdict
+from datetime import datetime, timedelta
 from django.contrib.auth import get_user_model
 from django.urls import reverse
 from accounts.models import Config, CustomUser, Membership
@@ -30,7 +31,7 @@ def prepare_email_context(booking, subject, is_admin=False):
         "message": "\n\n",
         "booking": booking,
     }
-    website_url = Config.objects.get(pk=1).website_url
+    website_url = Config.get_instance().website_url
     if is_admin:
         base_context.update(
             {
@@ -57,16 +58,20 @@ def update_context_with_calendar_details(context, event_details):
 
 
 def prepare_calendar_event_details(booking, message):
+    end = datetime.combine(booking.date, booking.end_time)
+    if booking.end_time < booking.start_time:
+        # The booking crosses midnight, see get_booking_range
+        end += timedelta(days=1)
     return {
         "start": datetime.combine(booking.date, booking.start_time),
-        "end": datetime.combine(booking.date, booking.end_time),
+        "end": end,
         "title": f"Booking for {booking.bookable_asset.name}",
         "description": message,
         "location": booking.bookable_asset.asset.organization.name,
         "allDay": False,
         "busy": True,
         "guests": [booking.user.email]
-        + list(booking.participants.values_list("email", flat=True)),
+        + [participant.email for participant in booking.participants.all()],
         "rRule": None,
     }
 
@@ -80,24 +85,75 @@ def get_admin_emails(booking):
     return admin_emails
 
 
+def get_admin_emails_by_organization(organization_ids):
+    """Return the emails of the admins of many organizations with a single query.
+
+    :param organization_ids: The ids of the organizations.
+    :return: A defaultdict of organization id to a list of emails.
+    """
+    admin_emails = defaultdict(list)
+    for organization_id, email in Membership.objects.filter(
+        organization_id__in=organization_ids, role=Membership.ADMIN
+    ).values_list("organization_id", "user__email"):
+        admin_emails[organization_id].append(email)
+    return admin_emails
+
+
 def get_recipient_list(booking):
     user_recipient_list = [booking.user.email]
-    participant_emails = list(booking.participants.values_list("email", flat=True))
+    # Uses the participants when they were prefetched
+    participant_emails = [
+        participant.email for participant in booking.participants.all()
+    ]
     non_admin_recipients = user_recipient_list + participant_emails
     return non_admin_recipients
 
 
-def generate_booking_notifications(booking, recipient_list, subject, plain_message):
-    # Create the BookingNotification instance
-    booking_notification = BookingNotification.objects.create(
-        booking=booking, subject=subject, message=plain_message, sent=False
-    )
+def create_booking_notifications(notifications):
+    """Store many BookingNotifications with their recipients in three queries.
 
-    # Fetch users based on recipient emails
-    recipients = CustomUser.objects.filter(email__in=recipient_list)
+    The recipients of every notification are looked up with one query, the
+    notifications and the rows of their recipients are each inserted with one
+    bulk_create.
+
+    :param notifications: An iterable of (booking, recipient_list, subject,
+        plain_message) tuples, see generate_booking_notifications.
+    :return: The created BookingNotifications.
+    """
+    notifications = list(notifications)
+    if not notifications:
+        return []
+    emails = {
+        email for _, recipient_list, _, _ in notifications for email in recipient_list
+    }
+    user_ids_by_email = defaultdict(list)
+    for user_id, email in CustomUser.objects.filter(email__in=emails).values_list(
+        "id", "email"
+    ):
+        user_ids_by_email[email].append(user_id)
+
+    booking_notifications = BookingNotification.objects.bulk_create(
+        BookingNotification(
+            booking=booking, subject=subject, message=plain_message, sent=False
+        )
+        for booking, _, subject, plain_message in notifications
+    )
+    Recipient = BookingNotification.recipients.through
+    Recipient.objects.bulk_create(
+        Recipient(bookingnotification_id=booking_notification.id, customuser_id=user_id)
+        for booking_notification, (_, recipient_list, _, _) in zip(
+            booking_notifications, notifications
+        )
+        # A recipient listed twice is added once, as recipients.add did
+        for user_id in {
+            user_id for email in recipient_list for user_id in user_ids_by_email[email]
+        }
+    )
+    return booking_notifications
 
-    # Add recipients to the booking notification
-    booking_notification.recipients.add(*recipients)
 
-    # Save the booking notification instance
-    booking_notification.save()
+def generate_booking_notifications(booking, recipient_list, subject, plain_message):
+    """Store the notification of a booking, see create_booking_notifications."""
+    return create_booking_notifications(
+        [(booking, recipient_list, subject, plain_message)]
+    )[0]
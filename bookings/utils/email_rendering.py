@@ -0,0 +1,69 @@
+"""Rendering of the booking emails.
+
+Every email has an HTML template and a plain text template next to it with the same
+name, email_templates/booking_notification.html and .txt for example. The plain part
+is rendered from its own template instead of stripping the tags of the HTML, which
+parses the whole page and kept the styles in the text. The templates are compiled
+once per process by the cached template loader.
+"""
+
+from django.template.loader import get_template
+
+from bookings.utils.email_helpers import (
+    prepare_calendar_event_details,
+    prepare_email_context,
+    update_context_with_calendar_details,
+)
+
+BOOKING_NOTIFICATION_TEMPLATE = "email_templates/booking_notification"
+PARTICIPANT_NOTIFICATION_TEMPLATE = "email_templates/participant_notification"
+BOOKING_STATUS_SUMMARY_TEMPLATE = "email_templates/booking_status_summary"
+
+
+def render_email(template_name, context):
+    """Render the HTML and the plain text part of an email.
+
+    :param template_name: The name of the templates without their extension.
+    :param context: The context of both templates.
+    :return: The HTML message and the plain message.
+    """
+    html_message = get_template(f"{template_name}.html").render(context)
+    plain_message = get_template(f"{template_name}.txt").render(context)
+    return html_message, plain_message
+
+
+def get_booking_email_context(booking, subject, message="\n\n"):
+    """Return the context the emails of a booking share.
+
+    The calendar links of an accepted booking are computed here once, instead of for
+    the admins and for the other recipients each.
+
+    :param booking: The booking, with its user, bookable asset, asset and organization.
+    :param subject: The subject of the emails.
+    :param message: The message the emails start with.
+    :return: A dictionary, see render_booking_notification.
+    """
+    context = {"subject": subject, "message": message, "booking": booking}
+    if booking.status == "accepted":
+        event_details = prepare_calendar_event_details(booking, message)
+        context = update_context_with_calendar_details(context, event_details)
+    return context
+
+
+def render_booking_notification(shared_context, is_admin=False):
+    """Render the notification of a booking for the admins or for its user and participants.
+
+    :param shared_context: The context returned by get_booking_email_context.
+    :param is_admin: Whether the email is for the admins, who get the approve and
+        reject links instead of the cancel link.
+    :return: The subject, the HTML message and the plain message.
+    """
+    context = {
+        **shared_context,
+        **prepare_email_context(
+            shared_context["booking"], shared_context["subject"], is_admin=is_admin
+        ),
+        "message": shared_context["message"],
+    }
+    html_message, plain_message = render_email(BOOKING_NOTIFICATION_TEMPLATE, context)
+    return context["subject"], html_message, plain_message
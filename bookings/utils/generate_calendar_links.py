@@ -1,7 +1,6 @@
 import pytz
 from datetime import datetime, timedelta
 from urllib.parse import urlencode
-import uuid
 
 
 def format_event_dates(event, format_key):
@@ -125,47 +124,3 @@ def generate_yahoo_calendar_url(event):
     }
 
     return f"https://calendar.yahoo.com/?{urlencode(params)}"
-
-
-def generate_ics_file(event):
-    transformed_event = transform_event(event)
-    uid = uuid.uuid4()
-    dtstamp = datetime.now(pytz.UTC).strftime("%Y%m%dT%H%M%SZ")
-    formatted_times = format_event_dates(transformed_event, "dateTimeUTC")
-    start_date, end_date = formatted_times["start"], formatted_times["end"]
-
-    ics_content = f"""BEGIN:VCALENDAR
-VERSION:2.0
-PRODID:-//YourProduct//YourApp//EN
-BEGIN:VEVENT
-UID:{uid}
-DTSTAMP:{dtstamp}
-DTSTART:{start_date}
-DTEND:{end_date}
-SUMMARY:{transformed_event.get("title")}
-DESCRIPTION:{transformed_event.get("description")}
-LOCATION:{transformed_event.get("location")}
-STATUS:CONFIRMED
-TRANSP:OPAQUE
-END:VEVENT
-END:VCALENDAR"""
-
-    return ics_content
-
-
-# Example usage to generate a .ics file
-event = {
-    "start": datetime(2024, 7, 1, 10, 0, 0, tzinfo=pytz.UTC),
-    "end": datetime(2024, 7, 1, 12, 0, 0, tzinfo=pytz.UTC),
-    "title": "Meeting",
-    "description": "Discuss project updates",
-    "location": "Conference Room",
-    "allDay": False,
-    "busy": True,
-    "guests": ["guest1@example.com", "guest2@example.com"],
-    "rRule": "FREQ=DAILY;COUNT=5",
-}
-
-ics_file_content = generate_ics_file(event)
-with open("event.ics", "w") as file:
-    file.write(ics_file_content)
@@ -0,0 +1,140 @@
+"""Calendar invites for bookings, built in memory.
+
+The invites are returned as bytes and attached to the email as they are, nothing is
+written to disk so concurrent web and Celery workers cannot overwrite each other's
+invites. The event of a booking is cached per booking and update_datetime, an edit
+of the booking changes the key so a stale invite is never sent.
+"""
+
+from datetime import datetime, timezone
+
+from django.core.cache import cache
+
+from bookings.models import get_booking_range
+
+ICS_PRODUCT_ID = "-//TAD//TAD Book//EN"
+ICS_CACHE_TIMEOUT = 60 * 60 * 24
+ICS_CACHE_KEY = "booking_ics:{booking_id}:{updated}"
+# Content lines longer than this are folded, see RFC 5545 section 3.1
+ICS_LINE_LENGTH = 75
+
+
+def escape_ics_text(value):
+    """Escape a TEXT value, see RFC 5545 section 3.3.11."""
+    return (
+        str(value or "")
+        .replace("\\", "\\\\")
+        .replace(";", "\\;")
+        .replace(",", "\\,")
+        .replace("\r\n", "\\n")
+        .replace("\n", "\\n")
+    )
+
+
+def format_ics_datetime(value):
+    return value.astimezone(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+
+
+def fold_ics_line(line):
+    """Split a content line into lines of at most ICS_LINE_LENGTH octets."""
+    encoded = line.encode()
+    if len(encoded) <= ICS_LINE_LENGTH:
+        return line
+    parts = []
+    while encoded:
+        # Continuation lines start with a space, which counts towards their length
+        limit = ICS_LINE_LENGTH if not parts else ICS_LINE_LENGTH - 1
+        cut = min(limit, len(encoded))
+        # Never split a multi byte character
+        while cut < len(encoded) and encoded[cut] & 0xC0 == 0x80:
+            cut -= 1
+        parts.append(encoded[:cut].decode())
+        encoded = encoded[cut:]
+    return "\r\n ".join(parts)
+
+
+def build_ics_event(uid, start, end, summary, description="", location="", stamp=None):
+    """Return the VEVENT of one event as text with CRLF line endings.
+
+    :param uid: The UID of the event, an invite with the same UID updates the event.
+    :param start: The aware start datetime.
+    :param end: The aware end datetime.
+    :param summary: The title of the event.
+    :param description: The description of the event.
+    :param location: The location of the event.
+    :param stamp: When the event was last changed, defaults to now.
+    :return: The VEVENT, ending with a line break.
+    """
+    lines = [
+        "BEGIN:VEVENT",
+        f"UID:{uid}",
+        f"DTSTAMP:{format_ics_datetime(stamp or datetime.now(timezone.utc))}",
+        f"DTSTART:{format_ics_datetime(start)}",
+        f"DTEND:{format_ics_datetime(end)}",
+        f"SUMMARY:{escape_ics_text(summary)}",
+        f"DESCRIPTION:{escape_ics_text(description)}",
+        f"LOCATION:{escape_ics_text(location)}",
+        "STATUS:CONFIRMED",
+        "TRANSP:OPAQUE",
+        "END:VEVENT",
+    ]
+    return "".join(f"{fold_ics_line(line)}\r\n" for line in lines)
+
+
+def build_ics_calendar(events):
+    """Wrap VEVENTs in a VCALENDAR.
+
+    :param events: The VEVENTs as returned by build_ics_event.
+    :return: The calendar as UTF-8 bytes.
+    """
+    return (
+        "BEGIN:VCALENDAR\r\n"
+        "VERSION:2.0\r\n"
+        f"PRODID:{ICS_PRODUCT_ID}\r\n"
+        "METHOD:PUBLISH\r\n" + "".join(events) + "END:VCALENDAR\r\n"
+    ).encode()
+
+
+def get_booking_ics_event(booking):
+    """Return the VEVENT of a booking, from the cache when the booking did not change.
+
+    The UID is derived from the booking, so the invite sent after an edit replaces
+    the event in the calendar of the recipient instead of adding a second one.
+
+    :param booking: The booking, with its bookable asset, asset and organization.
+    :return: The VEVENT as text.
+    """
+    updated = booking.update_datetime.timestamp() if booking.update_datetime else 0
+    key = ICS_CACHE_KEY.format(booking_id=booking.id, updated=updated)
+    event = cache.get(key)
+    if event is None:
+        start_at, end_at = booking.start_at, booking.end_at
+        if start_at is None or end_at is None:
+            start_at, end_at = get_booking_range(
+                booking.date, booking.start_time, booking.end_time
+            )
+        event = build_ics_event(
+            f"booking-{booking.id}@tad-book",
+            start_at,
+            end_at,
+            f"Booking for {booking.bookable_asset.name}",
+            booking.notes,
+            booking.bookable_asset.asset.organization.name,
+            booking.update_datetime,
+        )
+        cache.set(key, event, ICS_CACHE_TIMEOUT)
+    return event
+
+
+def get_bookings_ics(bookings):
+    """Return one calendar with an event for every booking.
+
+    :param bookings: The bookings, with their bookable asset, asset and organization.
+    :return: The calendar as UTF-8 bytes, ready to be attached to an email.
+    """
+    return build_ics_calendar(get_booking_ics_event(booking) for booking in bookings)
+
+
+def get_booking_ics(booking):
+    """Return the calendar invite of a single booking as UTF-8 bytes."""
+    return get_bookings_ics([booking])
@@ -0,0 +1,261 @@
+from datetime import timedelta
+from smtplib import SMTPException
+
+from django.db.models import F, Q
+from django.utils import timezone
+
+from accounts.models import CustomUser
+from bookings.models import NotificationOutbox
+from bookings.utils.email_helpers import (
+    create_booking_notifications,
+    generate_email_subject,
+    get_admin_emails,
+    get_recipient_list,
+)
+from bookings.utils.email_rendering import (
+    PARTICIPANT_NOTIFICATION_TEMPLATE,
+    get_booking_email_context,
+    render_booking_notification,
+    render_email,
+)
+from bookings.utils.ics import get_booking_ics
+from config.tasks import send_email_batch
+
+# A claimed row that is not processed within this time is given to another worker
+OUTBOX_CLAIM_TIMEOUT = timedelta(minutes=10)
+# Rows that failed this many times are left for an admin to look at
+OUTBOX_MAX_ATTEMPTS = 5
+
+
+class OutboxMessages:
+    """The messages of an outbox row, each under a key that stays the same on a retry.
+
+    Messages whose key is in the delivered_messages of the row were sent by an earlier
+    attempt and are left out, so a retry only sends the messages that failed.
+
+    :param entry: The NotificationOutbox row.
+    """
+
+    def __init__(self, entry):
+        self.delivered = set(entry.delivered_messages)
+        self.keys = []
+        self.messages = []
+        self.notifications = []
+
+    def is_delivered(self, key):
+        return key in self.delivered
+
+    def add(
+        self,
+        key,
+        booking,
+        subject,
+        plain_message,
+        html_message,
+        recipient_list,
+        attachment=None,
+        notification_subject=None,
+    ):
+        """Add a message, see send_email_with_attachment. Messages without recipients are skipped.
+
+        :param key: The key of the message within its row.
+        :param booking: The booking the BookingNotification is stored for.
+        :param notification_subject: The subject of the BookingNotification, defaults
+            to the subject of the email.
+        """
+        if self.is_delivered(key) or not recipient_list:
+            return
+        self.keys.append(key)
+        self.messages.append(
+            {
+                "subject": subject,
+                "plain_message": plain_message,
+                "html_message": html_message,
+                "recipient_list": list(recipient_list),
+                "attachment": attachment,
+            }
+        )
+        self.notifications.append(
+            (booking, recipient_list, notification_subject or subject, plain_message)
+        )
+
+    def send(self):
+        """Send the messages over one connection and store the delivered ones.
+
+        :return: The keys of the delivered messages and the number of failed messages.
+        """
+        if not self.messages:
+            return [], 0
+        failed_indexes = set(send_email_batch(self.messages)["failed_indexes"])
+        delivered = [
+            index for index in range(len(self.keys)) if index not in failed_indexes
+        ]
+        create_booking_notifications(self.notifications[index] for index in delivered)
+        return [self.keys[index] for index in delivered], len(failed_indexes)
+
+
+def send_booking_saved_notification(entry, messages):
+    """Send the emails about a booking that was created or updated.
+
+    The user and participants get the cancel link, the admins of the organization get
+    the approve and reject links. Accepted bookings come with the calendar links and
+    an ics attachment.
+
+    :param entry: The NotificationOutbox row of the booking.
+    :param messages: The OutboxMessages of the row, keyed "user" and "admin".
+    """
+    booking = entry.booking
+    subject = generate_email_subject(booking)
+    if entry.kind == NotificationOutbox.BOOKING_UPDATED:
+        subject = f"Booking Updated for {booking.bookable_asset.asset.name} - {booking.bookable_asset.name} {subject}"
+
+    shared_context = get_booking_email_context(booking, subject)
+    ics_file_content = (
+        get_booking_ics(booking) if booking.status == "accepted" else None
+    )
+    for is_admin in [False, True]:
+        key = "admin" if is_admin else "user"
+        if messages.is_delivered(key):
+            continue
+        email_subject, html_message, plain_message = render_booking_notification(
+            shared_context, is_admin=is_admin
+        )
+        recipient_list = (
+            get_admin_emails(booking) if is_admin else get_recipient_list(booking)
+        )
+        messages.add(
+            key,
+            booking,
+            email_subject,
+            plain_message,
+            html_message,
+            recipient_list,
+            ics_file_content,
+            notification_subject=subject,
+        )
+
+
+def send_participants_notification(entry, messages):
+    """Tell the participants that were added to or removed from a booking.
+
+    :param entry: The NotificationOutbox row with the ids of the participants.
+    :param messages: The OutboxMessages of the row, keyed by the participant id.
+    """
+    booking = entry.booking
+    added = entry.kind == NotificationOutbox.PARTICIPANTS_ADDED
+    subject = (
+        "You've been added to a booking"
+        if added
+        else "You've been removed from a booking"
+    )
+    message_body = "added to" if added else "removed from"
+
+    for participant in CustomUser.objects.filter(pk__in=entry.participant_ids):
+        key = str(participant.pk)
+        if messages.is_delivered(key):
+            continue
+        participant_name = (
+            participant.get_full_name() if participant.is_active else participant.email
+        )
+        message = (
+            f"Hello {participant_name},\n\nYou have been {message_body} a booking."
+        )
+        context = get_booking_email_context(booking, subject, message)
+        ics_file_content = None
+        if booking.status == "accepted" and added:
+            ics_file_content = get_booking_ics(booking)
+        if not added:
+            context["removed"] = True
+
+        html_message, plain_message = render_email(
+            PARTICIPANT_NOTIFICATION_TEMPLATE, context
+        )
+        messages.add(
+            key,
+            booking,
+            subject,
+            plain_message,
+            html_message,
+            [participant.email],
+            ics_file_content,
+        )
+
+
+OUTBOX_SENDERS = {
+    NotificationOutbox.BOOKING_CREATED: send_booking_saved_notification,
+    NotificationOutbox.BOOKING_UPDATED: send_booking_saved_notification,
+    NotificationOutbox.PARTICIPANTS_ADDED: send_participants_notification,
+    NotificationOutbox.PARTICIPANTS_REMOVED: send_participants_notification,
+}
+
+
+def claim_outbox_entry(entry_id):
+    """Mark an outbox row as taken by this worker.
+
+    The claim is a single conditional update, so of two workers handed the same row
+    (the dispatch after the commit and the sweep) only one sends it.
+
+    :param entry_id: The id of the NotificationOutbox row.
+    :return: True when the row was claimed, False when it is processed or taken.
+    """
+    now = timezone.now()
+    claimed = NotificationOutbox.objects.filter(
+        Q(claimed_datetime=None) | Q(claimed_datetime__lt=now - OUTBOX_CLAIM_TIMEOUT),
+        id=entry_id,
+        processed_datetime=None,
+    ).update(claimed_datetime=now, attempts=F("attempts") + 1)
+    return claimed == 1
+
+
+def process_outbox_entry(entry_id):
+    """Render and send the notification of an outbox row and mark it as processed.
+
+    A failure is stored on the row and the claim is released, so the sweep sends it
+    again until OUTBOX_MAX_ATTEMPTS is reached. The messages that were delivered are
+    recorded on the row first, a retry only sends the others.
+
+    :param entry_id: The id of the NotificationOutbox row.
+    :return: True when the notification was sent, False when the row was not claimed.
+    :raises Exception: Whatever rendering or sending the notification raised.
+    """
+    if not claim_outbox_entry(entry_id):
+        return False
+    entry = NotificationOutbox.objects.select_related(
+        "booking__user", "booking__bookable_asset__asset__organization"
+    ).get(id=entry_id)
+    # The messages of the row share one connection and are sent by this worker, so a
+    # failure is seen here and the row is retried
+    messages = OutboxMessages(entry)
+    try:
+        OUTBOX_SENDERS[entry.kind](entry, messages)
+        delivered, failed = messages.send()
+        if failed:
+            NotificationOutbox.objects.filter(id=entry_id).update(
+                delivered_messages=entry.delivered_messages + delivered
+            )
+            raise SMTPException(f"{failed} of the messages could not be sent")
+    except Exception as error:
+        NotificationOutbox.objects.filter(id=entry_id).update(
+            claimed_datetime=None, last_error=repr(error)
+        )
+        raise
+    NotificationOutbox.objects.filter(id=entry_id).update(
+        processed_datetime=timezone.now(), last_error=""
+    )
+    return True
+
+
+def get_pending_outbox_entry_ids(older_than):
+    """Return the ids of the rows that still have to be sent and may be retried.
+
+    :param older_than: Only rows created before this datetime are returned, newer rows
+        are about to be sent by the dispatch after their commit.
+    :return: A list of ids, oldest first.
+    """
+    return list(
+        NotificationOutbox.objects.filter(
+            processed_datetime=None,
+            create_datetime__lt=older_than,
+            attempts__lt=OUTBOX_MAX_ATTEMPTS,
+        ).values_list("id", flat=True)
+    )
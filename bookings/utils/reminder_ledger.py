@@ -0,0 +1,64 @@
+import uuid
+
+from bookings.models import ReminderLedger
+
+
+def claim_reminders(booking_ids, reminder_kind):
+    """Return the bookings whose reminder the caller should send.
+
+    The rows are inserted in one statement that skips the bookings already in the
+    ledger, every row carries a token of this call. The rows with the token are the
+    reminders this call won, whatever another run inserted at the same time. Both
+    steps search the unique index on booking and kind.
+
+    :param booking_ids: The ids of the bookings that are due a reminder.
+    :param reminder_kind: One of the ReminderLedger kinds.
+    :return: A list of the booking ids that were claimed, in the given order.
+    """
+    if not booking_ids:
+        return []
+    claim_token = uuid.uuid4()
+    ReminderLedger.objects.bulk_create(
+        [
+            ReminderLedger(
+                booking_id=booking_id,
+                reminder_kind=reminder_kind,
+                claim_token=claim_token,
+            )
+            for booking_id in booking_ids
+        ],
+        ignore_conflicts=True,
+    )
+    claimed = set(
+        ReminderLedger.objects.filter(
+            booking_id__in=booking_ids,
+            reminder_kind=reminder_kind,
+            claim_token=claim_token,
+        ).values_list("booking_id", flat=True)
+    )
+    return [booking_id for booking_id in booking_ids if booking_id in claimed]
+
+
+def release_reminders(booking_ids, reminder_kind):
+    """Give back the claims of reminders that could not be sent, the next run sends them.
+
+    :param booking_ids: The ids of the bookings whose reminder was not delivered.
+    :param reminder_kind: One of the ReminderLedger kinds.
+    """
+    ReminderLedger.objects.filter(
+        booking_id__in=booking_ids, reminder_kind=reminder_kind
+    ).delete()
+
+
+def forget_reminders(booking_id):
+    """Clear the reminders sent for a booking that was moved, it gets them again for its new start.
+
+    The reminder of a booking still pending is due a day after it was created, moving
+    the booking does not change it.
+
+    :param booking_id: The id of the booking.
+    """
+    ReminderLedger.objects.filter(
+        booking_id=booking_id,
+        reminder_kind__in=[ReminderLedger.TODAY, ReminderLedger.IN_30_MIN],
+    ).delete()
@@ -0,0 +1,73 @@
+"""When the per-booking reminders are due.
+
+The reminders of a booking are scheduled as ETA tasks when it is saved, see
+bookings.tasks.schedule_booking_reminders. The due time is derived from the status,
+start and creation of the booking only, so a task can tell on its own whether the
+booking changed after it was scheduled.
+"""
+
+from datetime import timedelta
+
+from django.utils import timezone
+
+from bookings.models import ReminderLedger
+
+# How long before the start of an accepted booking its reminder is sent
+REMINDER_LEAD_TIME = timedelta(minutes=30)
+# How long a booking is pending before the admins are reminded of it
+PENDING_REMINDER_DELAY = timedelta(days=1)
+# A reminder task that runs this early does nothing, the booking was moved
+REMINDER_EARLY_TOLERANCE = timedelta(minutes=1)
+# Only reminders due within this time are handed to the broker, the reconciliation
+# sweep schedules the later ones as they come closer. It runs more often than this
+# and it is shorter than the visibility timeout of the Redis broker (one hour), which
+# delivers a task with a later eta again.
+REMINDER_SCHEDULE_HORIZON = timedelta(minutes=45)
+
+REMINDER_SUBJECTS = {
+    ReminderLedger.TODAY: "Booking Reminder Today",
+    ReminderLedger.IN_30_MIN: "Booking starting in 30 minutes",
+    ReminderLedger.STILL_PENDING: "Booking still pending after 24 hours",
+}
+# The reminders that only go to the admins of the organization
+ADMIN_REMINDER_KINDS = [ReminderLedger.STILL_PENDING]
+# The reminders scheduled per booking, the daily reminder is sent in one run
+SCHEDULED_REMINDER_KINDS = [ReminderLedger.IN_30_MIN, ReminderLedger.STILL_PENDING]
+
+
+def get_reminder_due(reminder_kind, status, start_at, create_datetime, now=None):
+    """Return when a reminder of a booking is due.
+
+    :param reminder_kind: One of SCHEDULED_REMINDER_KINDS.
+    :param status: The status of the booking.
+    :param start_at: The start of the booking.
+    :param create_datetime: When the booking was created.
+    :param now: The current time, defaults to now.
+    :return: An aware datetime, possibly in the past, or None when the booking does
+        not get the reminder.
+    """
+    now = now or timezone.now()
+    if start_at is None or start_at <= now:
+        return None
+    if reminder_kind == ReminderLedger.IN_30_MIN and status == "accepted":
+        return start_at - REMINDER_LEAD_TIME
+    if reminder_kind == ReminderLedger.STILL_PENDING and status == "pending":
+        due = create_datetime + PENDING_REMINDER_DELAY
+        return due if due < start_at else None
+    return None
+
+
+def get_booking_reminder_dues(booking, now=None):
+    """Return the due time of every reminder the booking gets, by reminder kind."""
+    dues = {}
+    for reminder_kind in SCHEDULED_REMINDER_KINDS:
+        due = get_reminder_due(
+            reminder_kind,
+            booking.status,
+            booking.start_at,
+            booking.create_datetime,
+            now,
+        )
+        if due is not None:
+            dues[reminder_kind] = due
+    return dues
@@ -0,0 +1,179 @@
+import datetime
+from collections import defaultdict
+
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+
+from accounts.models import Asset, BookableAsset, Organization
+from bookings.models import SlotClaim
+from bookings.utils.asset_schedule import get_asset_schedule
+from bookings.utils.slot_engine import (
+    MINUTES_PER_DAY,
+    covered_slot_starts,
+    minutes_to_time,
+    time_to_minutes,
+)
+
+# Bookings with these statuses give their slots back
+INACTIVE_BOOKING_STATUSES = ["rejected", "canceled"]
+# The PostgreSQL constraint that keeps accepted bookings apart, see migration 0008
+OVERLAP_CONSTRAINT = "bookings_accepted_no_overlap"
+
+
+class SlotAlreadyClaimed(Exception):
+    """Raised when a slot is already held by another booking."""
+
+
+def is_overlap_error(error):
+    """Return whether an IntegrityError comes from accepted bookings that overlap."""
+    return OVERLAP_CONSTRAINT in str(error)
+
+
+def get_claimed_slots(bookable_asset, date, start_time, end_time):
+    """Return the slots a booking from start_time to end_time holds.
+
+    The slots are on the grid of the bookable hours of the asset on each day, so a
+    booking that does not start on a slot holds every slot it overlaps. A booking that
+    ends before it starts crosses midnight and holds the slots of the next day up to
+    its end as well. Bookings of "Any" hold no slots, they are requests an admin
+    assigns to one of the siblings.
+
+    :param bookable_asset: The bookable asset of the booking.
+    :param date: The date of the booking.
+    :param start_time: The start time of the booking.
+    :param end_time: The end time of the booking.
+    :return: A list of (date, datetime.time) tuples in ascending order.
+    """
+    if bookable_asset.name == "Any":
+        return []
+    start = time_to_minutes(start_time)
+    end = time_to_minutes(end_time)
+    parts = [(date, start, end)]
+    if end < start:
+        parts = [
+            (date, start, MINUTES_PER_DAY),
+            (date + datetime.timedelta(days=1), 0, end),
+        ]
+
+    schedule = get_asset_schedule(bookable_asset.asset_id)
+    slots = []
+    for part_date, part_start, part_end in parts:
+        day = schedule.get_day(part_date)
+        anchor = day[0] % schedule.slot_duration if day else 0
+        slots.extend(
+            (part_date, minutes_to_time(slot_start))
+            for slot_start in covered_slot_starts(
+                part_start, part_end, anchor, schedule.slot_duration
+            )
+        )
+    return slots
+
+
+def _filter_slots(bookable_asset, slots):
+    """Return a filter for the claims of the given slots of a bookable asset."""
+    start_times_by_date = defaultdict(list)
+    for date, start_time in slots:
+        start_times_by_date[date].append(start_time)
+    slots_filter = Q()
+    for date, start_times in start_times_by_date.items():
+        slots_filter |= Q(date=date, start_time__in=start_times)
+    return Q(bookable_asset=bookable_asset) & slots_filter
+
+
+def claim_slots(bookable_asset, slots):
+    """Claim the slots for a booking that is about to be created.
+
+    This must run in the same transaction as the save of the booking, which takes over
+    the claims, see sync_slot_claims. Claiming is a single insert, a conflict is found
+    by the unique constraint so no bookings are read and nothing has to be retried.
+
+    :param bookable_asset: The bookable asset of the booking.
+    :param slots: The slots to claim, as returned by get_claimed_slots.
+    :raises SlotAlreadyClaimed: When one of the slots is held by another booking.
+    """
+    claims = [
+        SlotClaim(bookable_asset=bookable_asset, date=date, start_time=start_time)
+        for date, start_time in slots
+    ]
+    try:
+        with transaction.atomic():
+            SlotClaim.objects.bulk_create(claims)
+    except IntegrityError:
+        raise SlotAlreadyClaimed(f"{bookable_asset} is already booked on {slots[0][0]}")
+
+
+def lock_conflict_scope(schedule, bookable_asset):
+    """Make other bookings of the conflict scope of an asset wait for this transaction.
+
+    Claims are per bookable asset and on the grid of the current schedule, so two
+    bookings of sibling desks under an exclusive scope do not collide on them, and
+    neither do bookings made before the slot duration or the bookable hours changed.
+    Locking the bookable asset, the asset or the organization row makes the second of
+    two bookings wait until the first is committed before it looks for overlapping
+    bookings. SQLite has no row locks, there the claims taken before already hold the
+    lock on the whole database.
+
+    :param schedule: The AssetSchedule of the asset of the booking.
+    :param bookable_asset: The bookable asset of the booking.
+    """
+    if schedule.conflict_scope == Organization.CONFLICT_SCOPE_ORGANIZATION:
+        scope = Organization.objects.filter(id=schedule.organization_id)
+    elif schedule.conflict_scope == Organization.CONFLICT_SCOPE_ASSET:
+        scope = Asset.objects.filter(id=schedule.asset_id)
+    else:
+        scope = BookableAsset.objects.filter(id=bookable_asset.id)
+    list(scope.select_for_update().values_list("id", flat=True))
+
+
+def sync_slot_claims(booking, created=False):
+    """Make the claims of a booking match its status, bookable asset, date and times.
+
+    Claims taken with claim_slots are taken over, slots the booking no longer covers
+    are given back. Slots held by another booking are left with that booking, edits
+    by admins are checked by validate_booking instead.
+
+    :param booking: The booking that was saved.
+    :param created: Whether the booking was just created, it has no claims of its own yet.
+    """
+    if booking.status in INACTIVE_BOOKING_STATUSES:
+        if not created:
+            SlotClaim.objects.filter(booking=booking).delete()
+        return
+
+    slots = get_claimed_slots(
+        booking.bookable_asset, booking.date, booking.start_time, booking.end_time
+    )
+    if not slots:
+        if not created:
+            SlotClaim.objects.filter(booking=booking).delete()
+        return
+
+    held = _filter_slots(booking.bookable_asset, slots)
+    if not created:
+        SlotClaim.objects.filter(booking=booking).exclude(held).delete()
+    taken_over = SlotClaim.objects.filter(held, booking=None).update(booking=booking)
+    if created and taken_over == len(slots):
+        return
+    SlotClaim.objects.bulk_create(
+        [
+            SlotClaim(
+                bookable_asset=booking.bookable_asset,
+                date=date,
+                start_time=start_time,
+                booking=booking,
+            )
+            for date, start_time in slots
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def prune_past_slot_claims(today=None):
+    """Delete the claims of the days that are over, nothing can be booked on them.
+
+    :param today: The first date whose claims are kept, defaults to today.
+    :return: The number of claims that were deleted.
+    """
+    today = today or datetime.date.today()
+    deleted, _ = SlotClaim.objects.filter(date__lt=today).delete()
+    return deleted
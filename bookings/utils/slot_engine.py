@@ -0,0 +1,168 @@
+"""Slot computation on plain numbers, without dates, models or the database.
+
+Every time is a number of minutes, either since midnight for a single day or since
+any fixed point (like the epoch) when the slots of several days are computed at once.
+The functions only compare and add these numbers, so both work the same way. The
+Django side converts models to minutes and back, see bookings.utils.db_helpers.
+"""
+
+import datetime
+import math
+from bisect import bisect_left, bisect_right
+from typing import NamedTuple
+
+MINUTES_PER_DAY = 24 * 60
+
+
+class DaySchedule(NamedTuple):
+    """The working hours and slot settings of one bookable day, all in minutes."""
+
+    start: float
+    end: float
+    buffer: float
+    duration: float
+
+
+def time_to_minutes(time_value):
+    minutes = time_value.hour * 60 + time_value.minute
+    if time_value.second or time_value.microsecond:
+        minutes += (time_value.second + time_value.microsecond / 1000000) / 60
+    return minutes
+
+
+def minutes_to_time(minutes):
+    return datetime.time(*divmod(int(minutes), 60))
+
+
+def slot_starts(start, end, buffer, duration):
+    """Return the start of every slot between start and end.
+
+    The slots follow each other from start, a slot must end before or at end and
+    the slots starting within the buffer after start are left out.
+
+    :param start: The time the first slot may start.
+    :param end: The time the last slot must end.
+    :param buffer: The time after start in which no slot may start.
+    :param duration: The duration of each slot.
+    :return: A list with the start of every slot in ascending order.
+    """
+    first_start = start + buffer
+    starts = []
+    while start + duration <= end:
+        if start >= first_start:
+            starts.append(start)
+        start += duration
+    return starts
+
+
+def covered_slot_starts(start, end, anchor, duration):
+    """Return the starts of the slots on a grid that overlap the interval start to end.
+
+    :param start: The start of the interval.
+    :param end: The end of the interval.
+    :param anchor: Any slot start of the grid, the grid repeats every duration from it.
+    :param duration: The duration of each slot.
+    :return: A list with the start of every overlapping slot in ascending order, slots
+        starting before 0 are left out.
+    """
+    first_slot = math.floor((start - anchor) / duration)
+    last_slot = math.ceil((end - anchor) / duration)
+    return [
+        anchor + slot * duration
+        for slot in range(first_slot, last_slot)
+        if anchor + slot * duration >= 0
+    ]
+
+
+def count_busy_per_slot(starts, duration, busy_by_resource):
+    """Count for every slot how many resources have a busy interval overlapping it.
+
+    Every busy interval is turned into the range of slot indexes it covers, the ranges
+    of a resource are merged so it is only counted once per slot, and the counts are
+    collected with a single running sum over the slots.
+
+    :param starts: The slot starts in ascending order, as returned by slot_starts.
+    :param duration: The duration of each slot.
+    :param busy_by_resource: A dictionary mapping every resource to a list of
+        (start, end) busy intervals. An interval overlaps a slot when it starts before
+        the slot ends and ends after the slot starts.
+    :return: A list with the number of busy resources for every slot.
+    """
+    ends = [start + duration for start in starts]
+
+    changes = [0] * (len(starts) + 1)
+    for intervals in busy_by_resource.values():
+        ranges = []
+        for busy_start, busy_end in intervals:
+            first_slot = bisect_right(ends, busy_start)
+            last_slot = bisect_left(starts, busy_end)
+            if first_slot < last_slot:
+                ranges.append((first_slot, last_slot))
+        if not ranges:
+            continue
+
+        ranges.sort()
+        range_start, range_end = ranges[0]
+        for first_slot, last_slot in ranges[1:]:
+            if first_slot <= range_end:
+                range_end = max(range_end, last_slot)
+                continue
+            changes[range_start] += 1
+            changes[range_end] -= 1
+            range_start, range_end = first_slot, last_slot
+        changes[range_start] += 1
+        changes[range_end] -= 1
+
+    counts = []
+    busy = 0
+    for change in changes[:-1]:
+        busy += change
+        counts.append(busy)
+    return counts
+
+
+def free_slots(starts, duration, busy):
+    """Return the slots that do not overlap with any of the busy intervals.
+
+    :param starts: The slot starts in ascending order, as returned by slot_starts.
+    :param duration: The duration of each slot.
+    :param busy: A list of (start, end) busy intervals.
+    :return: A list of the free slot starts.
+    """
+    counts = count_busy_per_slot(starts, duration, {None: busy})
+    return [start for start, count in zip(starts, counts) if not count]
+
+
+def free_capacity(starts, duration, busy_by_resource, capacity):
+    """Return the slots where fewer than capacity resources are busy.
+
+    :param starts: The slot starts in ascending order, as returned by slot_starts.
+    :param duration: The duration of each slot.
+    :param busy_by_resource: See count_busy_per_slot.
+    :param capacity: The number of resources in the pool.
+    :return: A list of (slot start, free capacity) tuples for the slots with free capacity.
+    """
+    return [
+        (start, capacity - count)
+        for start, count in zip(
+            starts, count_busy_per_slot(starts, duration, busy_by_resource)
+        )
+        if capacity - count > 0
+    ]
+
+
+def free_slots_for_days(days, busy_by_day=None):
+    """Compute the free slots of many days, assets or bookable assets in one call.
+
+    :param days: A dictionary mapping any key to a DaySchedule.
+    :param busy_by_day: A dictionary mapping the same keys to a list of (start, end)
+        busy intervals, keys without busy intervals may be left out.
+    :return: A dictionary mapping every key of days to its list of free slot starts.
+    """
+    busy_by_day = busy_by_day or {}
+    result = {}
+    for key, day in days.items():
+        starts = slot_starts(day.start, day.end, day.buffer, day.duration)
+        busy = busy_by_day.get(key)
+        result[key] = free_slots(starts, day.duration, busy) if busy else starts
+    return result
@@ -1,13 +1,15 @@
 from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
 from django.utils.translation import gettext_lazy as _
 
-from bookings.utils.booking_utils import reject_bookings
+from bookings.utils.booking_transitions import reject_bookings
+from bookings.utils.asset_schedule import get_asset_schedule
 from bookings.utils.db_helpers import (
     check_no_bookings_day,
     get_bookings_for_date_and_time,
-    get_is_working_day,
-    get_weekday_num_from_date,
+    get_series_occurrences_for_date_and_time,
 )
+from bookings.utils.slot_claims import is_overlap_error
 
 
 def validate_booking(booking, form):
@@ -24,10 +26,8 @@ def validate_booking(booking, form):
         has_error = True
 
     # Check if the specified date is a working day
-    weekday_num = get_weekday_num_from_date(booking.date)
-    if not get_is_working_day(
-        asset_id=booking.bookable_asset.asset.id, day=weekday_num
-    ):
+    schedule = get_asset_schedule(booking.bookable_asset.asset_id)
+    if not schedule.is_working_day(booking.date):
         form.add_error(
             None,
             ValidationError(
@@ -36,17 +36,21 @@ def validate_booking(booking, form):
         )
         has_error = True
 
-    # Fetch all overlapping bookings
-    overlapping_bookings = get_bookings_for_date_and_time(
-        booking.date, booking.start_time, booking.end_time, booking.bookable_asset
+    # Fetch all overlapping bookings in the conflict scope of the organization at once
+    conflicting_bookable_assets = schedule.get_conflicting_bookable_assets(
+        booking.bookable_asset
+    )
+    overlapping_bookings = list(
+        get_bookings_for_date_and_time(
+            booking.date,
+            booking.start_time,
+            booking.end_time,
+            conflicting_bookable_assets,
+        ).exclude(id=booking.id)
     )
 
     # Check for overlapping accepted bookings
-    overlapping_accepted_bookings = overlapping_bookings.filter(
-        status="accepted"
-    ).exclude(id=booking.id)
-    print(overlapping_accepted_bookings)
-    if overlapping_accepted_bookings.exists():
+    if any(overlapping.status == "accepted" for overlapping in overlapping_bookings):
         form.add_error(
             None,
             ValidationError(
@@ -56,14 +60,21 @@ def validate_booking(booking, form):
             ),
         )
         has_error = True
-    else:
-        # Handle non-accepted overlapping bookings
-        overlapping_non_accepted_bookings = overlapping_bookings.exclude(
-            status="accepted"
-        ).exclude(id=booking.id)
 
-        if overlapping_non_accepted_bookings.exists():
-            reject_bookings(overlapping_non_accepted_bookings)
+    # Check for overlapping occurrences of booking series
+    if get_series_occurrences_for_date_and_time(
+        booking.date,
+        booking.start_time,
+        booking.end_time,
+        conflicting_bookable_assets,
+    ):
+        form.add_error(
+            None,
+            ValidationError(
+                _("A recurring booking overlaps with the specified time range.")
+            ),
+        )
+        has_error = True
 
     if booking.bookable_asset.name == "Any" and booking.status == "accepted":
         form.add_error(
@@ -76,4 +87,34 @@ def validate_booking(booking, form):
         )
         has_error = True
 
+    # Non-accepted overlapping bookings are only rejected once every check passed
+    if not has_error and overlapping_bookings:
+        reject_bookings(overlapping_bookings)
+
     return has_error
+
+
+def save_booking(booking, form):
+    """Save a booking that passed validate_booking.
+
+    A booking that overlaps one accepted at the same moment is refused by the database
+    on PostgreSQL, that is added to the form like the errors of validate_booking.
+
+    :return: Whether the booking was saved.
+    """
+    try:
+        with transaction.atomic():
+            booking.save()
+    except IntegrityError as error:
+        if not is_overlap_error(error):
+            raise
+        form.add_error(
+            None,
+            ValidationError(
+                _(
+                    "There are existing accepted bookings that overlap with the specified time range."
+                )
+            ),
+        )
+        return False
+    return True
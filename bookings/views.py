@@ -1,10 +1,11 @@
 from collections import defaultdict
 import uuid
+from django.http import HttpResponseBadRequest
 from django.shortcuts import get_object_or_404, redirect, render, HttpResponse
 from django.urls import reverse
 from django.utils import timezone
 from django.db.models import Q
-from datetime import date, datetime, timedelta
+from datetime import date, datetime, time, timedelta
 import calendar
 from django.utils.timezone import get_current_timezone_name
 from django.contrib.auth.decorators import login_required
@@ -20,6 +21,7 @@ from accounts.utils.date_time import (
     get_current_time,
     get_date_variables_from_string_date,
     get_formatted_time_now_cal,
+    make_aware_in_site_time_zone,
 )
 from accounts.utils.permissions import check_organization_permission
 from bookings.forms import (
@@ -29,14 +31,16 @@ from bookings.forms import (
     BookingFormOrganization,
 )
 from bookings.models import Bookings
-from bookings.services import get_available_slots_for_bookable_asset
-from bookings.utils.db_helpers import (
-    check_no_bookings_day,
-    get_weekday_num_from_date,
-    get_is_working_day,
-    is_in_bookable_time_frame,
+from bookings.services import (
+    book_slot,
+    find_next_available_slots,
+    get_bookable_assets_for_user,
 )
-from bookings.utils.validation_utils import validate_booking
+from bookings.utils.availability_cache import get_cached_available_slots
+from bookings.utils.asset_schedule import get_asset_schedule
+from bookings.utils.db_helpers import check_no_bookings_day
+from bookings.utils.slot_claims import SlotAlreadyClaimed
+from bookings.utils.validation_utils import save_booking, validate_booking
 
 # Create your views here.
 
@@ -284,6 +288,11 @@ def get_available_slots(selected_date, asset_id, bookable_asset_id):
     date_obj, today_date, formatted_date = get_date_variables_from_string_date(
         selected_date
     )
+    # The schedule and the cache key come from the asset the bookable asset belongs to
+    bookable_asset = get_object_or_404(
+        BookableAsset.objects.select_related("asset"), id=bookable_asset_id
+    )
+    asset_id = bookable_asset.asset_id
 
     if check_no_bookings_day(asset_id=asset_id, date=date_obj):
         return HttpResponse(
@@ -292,8 +301,8 @@ def get_available_slots(selected_date, asset_id, bookable_asset_id):
             )
         )
 
-    weekday_num = get_weekday_num_from_date(date_obj)
-    if not get_is_working_day(asset_id=asset_id, day=weekday_num):
+    schedule = get_asset_schedule(asset_id)
+    if not schedule.is_working_day(date_obj):
         return HttpResponse(
             generate_time_slots_html_response(
                 selected_date,
@@ -302,7 +311,7 @@ def get_available_slots(selected_date, asset_id, bookable_asset_id):
             )
         )
 
-    if not is_in_bookable_time_frame(asset_id=asset_id, target_date=date_obj):
+    if not schedule.is_in_bookable_time_frame(date_obj):
         return HttpResponse(
             generate_time_slots_html_response(
                 selected_date,
@@ -311,19 +320,23 @@ def get_available_slots(selected_date, asset_id, bookable_asset_id):
             )
         )
 
-    available_slots = get_available_slots_for_bookable_asset(
-        bookable_asset_id, date_obj
-    )
+    available_slots = get_cached_available_slots(bookable_asset, date_obj)
     print(available_slots)
 
     if date_obj == date.today():
         current_time = timezone.localtime().time()
         print(current_time)
         available_slots = [
-            slot for slot in available_slots if slot.time() > current_time
+            (slot, free_capacity)
+            for slot, free_capacity in available_slots
+            if slot.time() > current_time
         ]
 
-    available_slots = [slot.strftime("%H:%M") for slot in available_slots]
+    # free_capacity is only set for "Any" and shows how many bookable assets are left
+    available_slots = [
+        (slot.strftime("%H:%M"), free_capacity)
+        for slot, free_capacity in available_slots
+    ]
 
     if not available_slots:
         return HttpResponse(
@@ -335,6 +348,56 @@ def get_available_slots(selected_date, asset_id, bookable_asset_id):
     return available_slots
 
 
+@login_required
+def next_available_slots(request):
+    organization_id = request.GET.get("organization")
+    asset_id = request.GET.get("asset")
+    bookable_asset_ids = request.GET.getlist("bookable_asset")
+    try:
+        count = min(int(request.GET.get("count", 5)), 50)
+    except ValueError:
+        count = 5
+    try:
+        organization_id = int(organization_id) if organization_id else None
+        asset_id = int(asset_id) if asset_id else None
+        bookable_asset_ids = [
+            int(bookable_asset_id) for bookable_asset_id in bookable_asset_ids
+        ]
+    except ValueError:
+        return HttpResponseBadRequest(
+            "The organization, asset and bookable assets must be ids."
+        )
+
+    # Only search the organizations the user is a member of
+    assets = Asset.objects.filter(organization__members=request.user)
+    if bookable_asset_ids:
+        bookable_assets = list(
+            BookableAsset.objects.select_related("asset").filter(
+                id__in=bookable_asset_ids, asset__in=assets
+            )
+        )
+    else:
+        if asset_id:
+            assets = assets.filter(id=asset_id)
+        elif organization_id:
+            assets = assets.filter(organization=organization_id)
+        bookable_assets = get_bookable_assets_for_user(request.user, assets)
+
+    next_slots = [
+        {
+            "slot": slot,
+            "bookable_asset": bookable_asset,
+            "free_capacity": free_capacity,
+        }
+        for slot, bookable_asset, free_capacity in find_next_available_slots(
+            bookable_assets, count=count
+        )
+    ]
+
+    context = {"next_slots": next_slots}
+    return render(request, "bookings/partials/next_available_slots.html", context)
+
+
 def generate_time_slots_html_response(selected_date, formatted_date, error_message):
     return f"""
         <div id="time_slots" class="p-4 bg-gray-100 rounded-lg flex-grow">
@@ -375,18 +438,26 @@ def request_booking(request, time_slot):
         return HttpResponse("Invalid time format")
 
     # Calculate the end time
-    slot_duration = timedelta(minutes=bookable_asset.asset.get_slot_duration())
+    slot_duration = timedelta(
+        minutes=get_asset_schedule(bookable_asset.asset_id).slot_duration
+    )
     end_time = (datetime.combine(date_obj, start_time) + slot_duration).time()
 
-    # Create the booking
-    booking = Bookings.objects.create(
-        user=user,
-        date=date_obj,
-        start_time=start_time,
-        end_time=end_time,
-        bookable_asset=bookable_asset,
-        notes=notes,
-    )
+    # Create the booking, unless someone else booked the slot in the meantime
+    try:
+        booking = book_slot(
+            user, bookable_asset, date_obj, start_time, end_time, notes=notes
+        )
+    except SlotAlreadyClaimed:
+        return HttpResponse(
+            f"""
+            <div class="bg-red-600 border px-4 py-3 rounded relative mb-4" role="alert">
+                <span class="block sm:inline">
+                    {formatted_date} at {time_slot} has just been booked by someone else, please choose another time slot.
+                </span>
+            </div>
+        """
+        )
 
     if booking.status == "accepted":
         print("Send confirmation email")
@@ -600,8 +671,7 @@ def manage_booking_admin_edit(request, booking_id):
             has_error = validate_booking(booking, form)
 
             # Only save the booking if no errors were found
-            if not has_error:
-                form.save()
+            if not has_error and save_booking(booking, form):
                 context = {"booking": booking}
                 return render(request, "bookings/partials/booking_admin.html", context)
     else:
@@ -633,8 +703,7 @@ def manage_booking_admin_edit_form(request, booking_id):
             # Perform validation checks
             has_error = validate_booking(booking, form)
 
-            if not has_error:
-                form.save()
+            if not has_error and save_booking(booking, form):
                 context = {"booking": booking}
 
                 return redirect(
@@ -755,7 +824,7 @@ def manage_booking_organization_edit_form(request, booking_id):
 
                 instance = form.save(False)
                 print(f"########### {instance.status} #######")
-                instance.save()
+            if not has_error and save_booking(instance, form):
                 context = {"booking": booking}
                 return redirect(
                     "bookings:manage_bookings_organization_calendar_view",
@@ -796,8 +865,7 @@ def manage_booking_organization_edit(request, booking_id):
             has_error = validate_booking(booking, form)
 
             # Only save the booking if no errors were found
-            if not has_error:
-                form.save()
+            if not has_error and save_booking(booking, form):
                 context = {"booking": booking}
                 return render(
                     request, "bookings/partials/booking_organization.html", context
@@ -1005,8 +1073,7 @@ def manage_booking_asset_edit(request, booking_id):
             has_error = validate_booking(booking, form)
 
             # Only save the booking if no errors were found
-            if not has_error:
-                form.save()
+            if not has_error and save_booking(booking, form):
                 context = {"booking": booking}
                 return render(request, "bookings/partials/booking_asset.html", context)
     else:
@@ -1197,8 +1264,7 @@ def custom_booking(request, asset_slug):
             has_error = validate_booking(booking, form)
 
             # Only save the booking if no errors were found
-            if not has_error:
-                booking.save()
+            if not has_error and save_booking(booking, form):
                 return redirect(
                     "bookings:manage_bookings_asset_upcoming_list_view",
                     asset_slug=asset.slug,
@@ -1399,8 +1465,7 @@ def upcomming_bookings_count(request, organization_id):
     organization = get_object_or_404(Organization, id=organization_id)
     bookings = Bookings.objects.filter(
         bookable_asset__asset__organization=organization,
-        date__gte=date.today(),
-        start_time__gte=get_current_time(),
+        start_at__gte=timezone.now(),
         status="accepted",
     )
     count = bookings.count()
@@ -1411,8 +1476,10 @@ def today_upcomming_bookings_count(request, organization_id):
     organization = get_object_or_404(Organization, id=organization_id)
     bookings = Bookings.objects.filter(
         bookable_asset__asset__organization=organization,
-        date__gte=date.today(),
-        start_time__gte=get_current_time(),
+        start_at__gte=timezone.now(),
+        start_at__lt=make_aware_in_site_time_zone(
+            date.today() + timedelta(days=1), time()
+        ),
         status="accepted",
     )
     count = bookings.count()
@@ -1421,11 +1488,11 @@ def today_upcomming_bookings_count(request, organization_id):
 
 def current_bookings_count(request, organization_id):
     organization = get_object_or_404(Organization, id=organization_id)
+    now = timezone.now()
     bookings = Bookings.objects.filter(
         bookable_asset__asset__organization=organization,
-        date__gte=date.today(),
-        start_time__lte=get_current_time(),
-        end_time__gte=get_current_time(),
+        start_at__lte=now,
+        end_at__gte=now,
         status="accepted",
     )
     count = bookings.count()
@@ -1436,8 +1503,7 @@ def upcomming_pending_bookings_count(request, organization_id):
     organization = get_object_or_404(Organization, id=organization_id)
     bookings = Bookings.objects.filter(
         bookable_asset__asset__organization=organization,
-        date__gte=date.today(),
-        start_time__gte=get_current_time(),
+        start_at__gte=timezone.now(),
         status="pending",
     )
     count = bookings.count()
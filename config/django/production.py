@@ -13,6 +13,14 @@ DATABASES = {
     }
 }
 
+# Shared between the gunicorn and celery workers so cache invalidation reaches all of them
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": os.environ.get("CACHE_LOCATION", "redis://redis:6379/1"),
+    }
+}
+
 CSRF_TRUSTED_ORIGINS = [
     "http://18.190.26.177",
     # Add other origins as needed
@@ -0,0 +1,94 @@
+import time
+
+from config.tasks import send_email_batch
+
+# Messages handed to a single send_email_batch task
+EMAIL_BATCH_SIZE = 50
+# Seconds a message waits for the rest of its batch before the batch is sent anyway
+EMAIL_BATCH_WINDOW = 5.0
+
+
+class EmailBatch:
+    """Collect the messages of a run and send them in batches over one connection.
+
+    A batch is handed to send_email_batch when it holds EMAIL_BATCH_SIZE messages,
+    when its first message waited EMAIL_BATCH_WINDOW seconds, and when the with block
+    ends. The messages added before the block raised are still sent, they belong to
+    work that is done and is not repeated.
+
+    Usage::
+
+        with EmailBatch() as emails:
+            for booking in bookings:
+                emails.add(subject, plain_message, html_message, [booking.user.email])
+
+    :param chunk_size: The number of messages per batch.
+    :param window: The seconds the first message of a batch may wait.
+    :param send: The function the batches are given to, defaults to queuing
+        send_email_batch. Pass send_email_batch to send them in this process, the
+        keys of the messages that were not delivered are then in failed_keys.
+    """
+
+    def __init__(
+        self, chunk_size=EMAIL_BATCH_SIZE, window=EMAIL_BATCH_WINDOW, send=None
+    ):
+        self.chunk_size = chunk_size
+        self.window = window
+        self.send = send or send_email_batch.delay
+        self.messages = []
+        self.keys = []
+        self.first_added = None
+        self.results = []
+        self.failed_keys = set()
+
+    def add(
+        self,
+        subject,
+        plain_message,
+        html_message,
+        recipient_list,
+        attachment=None,
+        key=None,
+    ):
+        """Add a message, see send_email_with_attachment. Messages without recipients are skipped.
+
+        :param key: What the caller knows the message by, see failed_keys.
+        """
+        if not recipient_list:
+            return
+        if not self.messages:
+            self.first_added = time.monotonic()
+        self.keys.append(key)
+        self.messages.append(
+            {
+                "subject": subject,
+                "plain_message": plain_message,
+                "html_message": html_message,
+                "recipient_list": list(recipient_list),
+                "attachment": attachment,
+            }
+        )
+        if (
+            len(self.messages) >= self.chunk_size
+            or time.monotonic() - self.first_added >= self.window
+        ):
+            self.flush()
+
+    def flush(self):
+        """Send the messages collected so far as one batch."""
+        if not self.messages:
+            return
+        messages, self.messages = self.messages, []
+        keys, self.keys = self.keys, []
+        result = self.send(messages)
+        self.results.append(result)
+        # Only a batch sent in this process reports what failed
+        if isinstance(result, dict):
+            self.failed_keys.update(keys[index] for index in result["failed_indexes"])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+        return False
@@ -5,14 +5,6 @@ CELERY_BROKER_URL = os.environ.get("CELERY_BROKER", "redis://redis:6379/0")
 CELERY_RESULT_BACKEND = os.environ.get("CELERY_BACKEND", "redis://redis:6379/0")
 
 CELERY_BEAT_SCHEDULE = {
-    "booking_still_pending": {
-        "task": "bookings.tasks.send_reminder_email_booking_still_pending",
-        "schedule": crontab(
-            # minute="*/2"
-            hour="10-19",
-            minute="*/60",
-        ),  # Cerery beat uses std time and should be taken into account
-    },
     "booking_today": {
         "task": "bookings.tasks.send_reminder_email_booking_today",
         "schedule": crontab(
@@ -21,10 +13,22 @@ CELERY_BEAT_SCHEDULE = {
             hour=9,
         ),  # Cerery beat uses std time and should be taken into account
     },
-    "booking_in_30_min": {
-        "task": "bookings.tasks.send_reminder_email_booking_in_30_min",
-        "schedule": crontab(
-            minute="*/5"
-        ),  # Cerery beat uses std time and should be taken into account
+    # The reminders are scheduled per booking, this only sends the ones that were missed
+    "booking_reminders_reconciliation": {
+        "task": "bookings.tasks.reconcile_booking_reminders",
+        "schedule": crontab(minute="*/30"),
+    },
+    "slot_claims_pruning": {
+        "task": "bookings.tasks.prune_slot_claims",
+        "schedule": crontab(minute=15, hour=2),
+    },
+    # The hit ratio of the availability cache shows up in the log every hour
+    "availability_cache_stats": {
+        "task": "bookings.tasks.log_availability_cache_stats",
+        "schedule": crontab(minute=0),
+    },
+    "notification_outbox": {
+        "task": "bookings.tasks.dispatch_notification_outbox",
+        "schedule": crontab(minute="*"),
     },
 }
@@ -1,24 +1,115 @@
-import tempfile
-from django.core.mail import send_mail, EmailMultiAlternatives
+import time
+from smtplib import SMTPException
+
+from django.core.mail import EmailMultiAlternatives, get_connection
 from celery import shared_task
+from loguru import logger
 
+FROM_EMAIL = "support@tad.co.za"
+# How often a message is tried in one run, a failed try reconnects right away
+EMAIL_SEND_ATTEMPTS = 2
+# How often a queued batch is run again for the messages that failed
+EMAIL_BATCH_RETRIES = 3
+# Seconds before a batch is run again, doubled with every retry
+EMAIL_RETRY_DELAY = 30
 
-@shared_task
-def send_email_with_attachment(
-    subject, plain_message, html_message, recipient_list, attachment=None
-):
 
-    from_email = "support@tad.co.za"
+def build_email(subject, plain_message, html_message, recipient_list, attachment=None):
+    """Return the EmailMultiAlternatives of a message, see send_email_with_attachment."""
     if not isinstance(recipient_list, list):
         recipient_list = [recipient_list]
-    # Send the email
-    email = EmailMultiAlternatives(subject, plain_message, from_email, recipient_list)
+    email = EmailMultiAlternatives(subject, plain_message, FROM_EMAIL, recipient_list)
     email.attach_alternative(html_message, "text/html")
 
     if attachment:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".ics") as ics_file:
-            ics_file.write(attachment.encode())
-            ics_file.seek(0)
-            email.attach("booking_event.ics", ics_file.read(), "text/calendar")
+        # The invite is attached from memory, see bookings.utils.ics
+        email.attach("booking_event.ics", attachment, "text/calendar")
+    return email
+
+
+@shared_task
+def send_email_with_attachment(
+    subject, plain_message, html_message, recipient_list, attachment=None
+):
+    build_email(subject, plain_message, html_message, recipient_list, attachment).send(
+        fail_silently=False
+    )
+
+
+def send_with_retries(connection, email):
+    """Send one message over an open connection, reconnecting when a try fails.
+
+    The tries follow each other without a wait, send_email_batch runs again later for
+    the messages that still failed.
+
+    :param connection: The email backend shared by the batch.
+    :param email: The EmailMultiAlternatives to send.
+    :return: None when the message was sent, the last error when every try failed.
+    """
+    last_error = None
+    for attempt in range(1, EMAIL_SEND_ATTEMPTS + 1):
+        try:
+            # Reopens the connection after a failed try, does nothing when it is open
+            connection.open()
+            connection.send_messages([email])
+            return None
+        except (SMTPException, OSError) as error:
+            logger.warning(
+                f"Sending {email.subject!r} to {email.to} failed "
+                f"(try {attempt} of {EMAIL_SEND_ATTEMPTS}): {error!r}"
+            )
+            last_error = error
+            connection.close()
+    return last_error
+
+
+@shared_task(bind=True)
+def send_email_batch(self, messages):
+    """Send many messages over a single SMTP connection.
+
+    Every message is sent and retried on its own, so one refused message neither
+    stops the batch nor sends the others twice. A queued batch runs again with only
+    the failed messages after EMAIL_RETRY_DELAY seconds, doubled with every retry, so
+    no worker waits in between. A batch that is called directly returns the failed
+    messages in failed_indexes, the caller tries them again.
+
+    :param messages: A list of dictionaries with the arguments of
+        send_email_with_attachment.
+    :return: The throughput of the batch as a dictionary with the number of
+        messages, sent and failed, the seconds it took and the messages per second,
+        and the indexes of the failed messages in failed_indexes.
+    """
+    emails = [build_email(**message) for message in messages]
+    start = time.perf_counter()
+    failed_indexes = []
+    connection = get_connection()
+    try:
+        for index, email in enumerate(emails):
+            error = send_with_retries(connection, email)
+            if error is not None:
+                failed_indexes.append(index)
+                logger.error(f"Giving up on {email.subject!r} to {email.to}: {error!r}")
+    finally:
+        connection.close()
 
-    email.send(fail_silently=False)
+    seconds = time.perf_counter() - start
+    failed = len(failed_indexes)
+    metrics = {
+        "messages": len(emails),
+        "sent": len(emails) - failed,
+        "failed": failed,
+        "seconds": round(seconds, 4),
+        "messages_per_second": round(len(emails) / seconds, 1) if seconds else None,
+        "failed_indexes": failed_indexes,
+    }
+    logger.info(f"Email batch sent: {metrics}")
+    if (
+        failed_indexes
+        and not self.request.called_directly
+        and self.request.retries < EMAIL_BATCH_RETRIES
+    ):
+        raise self.retry(
+            args=[[messages[index] for index in failed_indexes]],
+            countdown=EMAIL_RETRY_DELAY * 2**self.request.retries,
+        )
+    return metrics
@@ -0,0 +1,192 @@
+import socketserver
+import threading
+
+import pytest
+from django.core import mail
+
+from config import tasks
+from config.mail import EmailBatch
+from config.tasks import send_email_batch
+
+
+class SMTPStandInHandler(socketserver.StreamRequestHandler):
+    """Speak just enough SMTP for smtplib, see SMTPStandIn."""
+
+    def reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.connections += 1
+        recipients = []
+        self.reply("220 localhost SMTP stand-in")
+        while line := self.rfile.readline():
+            command = line.decode().strip()
+            verb = command.split(" ", 1)[0].upper()
+            if verb in ["EHLO", "HELO"]:
+                self.reply("250 localhost")
+            elif verb == "MAIL":
+                recipients = []
+                self.reply("250 OK")
+            elif verb == "RCPT":
+                address = command.split(":", 1)[1].strip().strip("<>")
+                with server.lock:
+                    refused = server.refuse.get(address, 0)
+                    if refused:
+                        server.refuse[address] = refused - 1
+                if refused:
+                    self.reply("451 Try again later")
+                else:
+                    recipients.append(address)
+                    self.reply("250 OK")
+            elif verb == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                data = []
+                while (data_line := self.rfile.readline()) not in [b".\r\n", b""]:
+                    data.append(data_line)
+                with server.lock:
+                    server.messages.append((recipients, b"".join(data)))
+                self.reply("250 OK")
+            elif verb == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("250 OK")
+
+
+class SMTPStandIn(socketserver.ThreadingTCPServer):
+    """A local SMTP server that keeps the messages and counts the connections.
+
+    :param refuse: How many times each address is refused before it is accepted.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, refuse=None):
+        super().__init__(("127.0.0.1", 0), SMTPStandInHandler)
+        self.lock = threading.Lock()
+        self.refuse = dict(refuse or {})
+        self.connections = 0
+        self.messages = []
+
+
+@pytest.fixture
+def smtp_server(settings, monkeypatch):
+    server = SMTPStandIn()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    settings.EMAIL_BACKEND = "django.core.mail.backends.smtp.EmailBackend"
+    settings.EMAIL_HOST = "127.0.0.1"
+    settings.EMAIL_PORT = server.server_address[1]
+    settings.EMAIL_USE_TLS = False
+    settings.EMAIL_HOST_USER = None
+    settings.EMAIL_HOST_PASSWORD = None
+    monkeypatch.setattr(tasks, "EMAIL_RETRY_DELAY", 0)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def make_messages(count):
+    return [
+        {
+            "subject": f"Booking {number}",
+            "plain_message": "Hello",
+            "html_message": "<p>Hello</p>",
+            "recipient_list": [f"user-{number}@example.com"],
+            "attachment": b"BEGIN:VCALENDAR\r\nEND:VCALENDAR\r\n" if number else None,
+        }
+        for number in range(count)
+    ]
+
+
+def test_a_batch_is_sent_over_one_connection(smtp_server):
+    metrics = send_email_batch(make_messages(20))
+
+    assert smtp_server.connections == 1
+    assert len(smtp_server.messages) == 20
+    assert metrics["messages"] == metrics["sent"] == 20
+    assert metrics["failed"] == 0
+    assert metrics["messages_per_second"] > 0
+    assert b"text/calendar" in smtp_server.messages[1][1]
+
+
+def test_failed_messages_are_retried_on_their_own(smtp_server):
+    smtp_server.refuse = {"user-1@example.com": 1, "user-2@example.com": 99}
+
+    metrics = send_email_batch(make_messages(4))
+
+    delivered = sorted(
+        recipient for recipients, _ in smtp_server.messages for recipient in recipients
+    )
+    assert delivered == [
+        "user-0@example.com",
+        "user-1@example.com",
+        "user-3@example.com",
+    ]
+    assert metrics["sent"] == 3
+    assert metrics["failed"] == 1
+    assert metrics["failed_indexes"] == [2]
+    # A failed try reconnects, the messages after it share the new connection
+    assert smtp_server.connections == 1 + 1 + tasks.EMAIL_SEND_ATTEMPTS
+
+
+def test_a_queued_batch_runs_again_for_the_failed_messages(smtp_server):
+    smtp_server.refuse = {"user-2@example.com": tasks.EMAIL_SEND_ATTEMPTS}
+
+    # Run like a worker would, the retry is run right away in eager mode
+    result = send_email_batch.apply([make_messages(4)], throw=False)
+
+    delivered = sorted(
+        recipient for recipients, _ in smtp_server.messages for recipient in recipients
+    )
+    assert delivered == [f"user-{number}@example.com" for number in range(4)]
+    # The retry only holds the message that failed
+    assert result.result["messages"] == result.result["sent"] == 1
+
+
+def test_email_batch_sends_in_chunks():
+    batches = []
+    with EmailBatch(chunk_size=2, send=batches.append) as emails:
+        for message in make_messages(5):
+            emails.add(**message)
+        emails.add("No recipients", "Hello", "<p>Hello</p>", [])
+
+    assert [len(batch) for batch in batches] == [2, 2, 1]
+    assert batches[2][0]["subject"] == "Booking 4"
+
+
+def test_email_batch_sends_after_the_window():
+    batches = []
+    emails = EmailBatch(window=0, send=batches.append)
+    for message in make_messages(2):
+        emails.add(**message)
+
+    assert [len(batch) for batch in batches] == [1, 1]
+
+
+def test_email_batch_reports_the_keys_that_failed():
+    def refuse_the_second(messages):
+        return {"failed_indexes": [1] if len(messages) > 1 else []}
+
+    with EmailBatch(chunk_size=2, send=refuse_the_second) as emails:
+        for number, message in enumerate(make_messages(3)):
+            emails.add(**message, key=f"message-{number}")
+
+    assert emails.failed_keys == {"message-1"}
+
+
+def test_email_batch_queues_the_task():
+    mail.outbox = []
+    with EmailBatch() as emails:
+        for message in make_messages(3):
+            emails.add(**message)
+
+    assert [message.to for message in mail.outbox] == [
+        ["user-0@example.com"],
+        ["user-1@example.com"],
+        ["user-2@example.com"],
+    ]
+    assert emails.results[0].result["sent"] == 3
@@ -0,0 +1,172 @@
+import json
+import tempfile
+import time
+from pathlib import Path
+
+import pytest
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from accounts.models import Config
+from bookings.utils import asset_schedule
+from config.celery import app
+
+BENCHMARK_BASELINE = Path(__file__).resolve().parent / "benchmark_baseline.json"
+BENCHMARK_RESULTS = pytest.StashKey[dict]()
+
+# Run the tasks in the test process instead of sending them to the broker
+app.conf.task_always_eager = True
+app.conf.task_eager_propagates = True
+
+
+@pytest.fixture(scope="session")
+def django_db_modify_db_settings(django_db_modify_db_settings_parallel_suffix):
+    """Keep the SQLite test database in a file instead of in memory, an in memory
+    database shared between threads fails concurrent writes instead of waiting."""
+    database = settings.DATABASES["default"]
+    if database["ENGINE"] == "django.db.backends.sqlite3":
+        database.setdefault("TEST", {})["NAME"] = str(
+            Path(tempfile.gettempdir()) / "tad_book_test.sqlite3"
+        )
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("benchmark")
+    group.addoption(
+        "--benchmark-save",
+        action="store_true",
+        help="Save the benchmark results as the new baseline instead of comparing against it.",
+    )
+    group.addoption(
+        "--benchmark-timings",
+        action="store_true",
+        help="Also compare the timings against the baseline, only the query counts "
+        "are compared by default as the timings depend on the machine.",
+    )
+    group.addoption(
+        "--benchmark-threshold",
+        type=float,
+        default=2.0,
+        help="Fail a benchmark that is this many times slower than its baseline (default 2.0).",
+    )
+
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    """Start every test with an empty cache, the database is rolled back after every test
+    so anything kept in the cache or the process would point at rows that are gone."""
+    cache.clear()
+    asset_schedule._asset_schedules.clear()
+    Config._cached_instance = None
+    yield
+    cache.clear()
+    asset_schedule._asset_schedules.clear()
+    Config._cached_instance = None
+
+
+class BenchmarkRecorder:
+    """Time scenarios, count their queries and compare them against the baseline.
+
+    Every run starts with empty caches and is rolled back, so a scenario that writes to
+    the database sees the same data on every run and the query count does not depend
+    on the runs before it.
+    """
+
+    # Timings shorter than this are too noisy to fail on
+    MIN_REGRESSION_SECONDS = 0.005
+
+    def __init__(self, baseline, threshold, save, check_timings=False):
+        self.baseline = baseline
+        self.threshold = threshold
+        self.save = save
+        self.check_timings = check_timings
+        self.results = {}
+
+    def _run(self, func):
+        cache.clear()
+        asset_schedule._asset_schedules.clear()
+        Config._cached_instance = None
+        with transaction.atomic():
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                func()
+                seconds = time.perf_counter() - start
+            transaction.set_rollback(True)
+        return seconds, len(queries)
+
+    def __call__(self, name, func, rounds=5):
+        """Run func rounds times and record the fastest wall time and the query count.
+
+        :param name: The name of the scenario in the baseline.
+        :param func: The scenario, it is called without arguments.
+        :param rounds: The number of times the scenario is run, once when only the
+            query count is compared.
+        :return: The result of the scenario as a dictionary with seconds and queries.
+        """
+        if not (self.save or self.check_timings):
+            rounds = 1
+        runs = [self._run(func) for _ in range(rounds)]
+        result = {
+            "seconds": round(min(seconds for seconds, _ in runs), 6),
+            "queries": max(queries for _, queries in runs),
+        }
+        self.results[name] = result
+
+        baseline = self.baseline.get(name)
+        if self.save or baseline is None:
+            return result
+
+        assert result["queries"] <= baseline["queries"], (
+            f"{name} runs {result['queries']} queries, "
+            f"the baseline is {baseline['queries']}"
+        )
+        if not self.check_timings:
+            return result
+        allowed_seconds = max(
+            baseline["seconds"] * self.threshold,
+            baseline["seconds"] + self.MIN_REGRESSION_SECONDS,
+        )
+        assert result["seconds"] <= allowed_seconds, (
+            f"{name} took {result['seconds']:.4f}s, the baseline is "
+            f"{baseline['seconds']:.4f}s and at most {allowed_seconds:.4f}s is allowed"
+        )
+        return result
+
+
+@pytest.fixture(scope="session")
+def benchmark_recorder(request):
+    baseline = {}
+    if BENCHMARK_BASELINE.exists():
+        baseline = json.loads(BENCHMARK_BASELINE.read_text())
+    recorder = BenchmarkRecorder(
+        baseline,
+        request.config.getoption("--benchmark-threshold"),
+        request.config.getoption("--benchmark-save"),
+        request.config.getoption("--benchmark-timings"),
+    )
+    request.config.stash[BENCHMARK_RESULTS] = recorder.results
+    yield recorder
+
+    if recorder.save and recorder.results:
+        baseline.update(recorder.results)
+        BENCHMARK_BASELINE.write_text(
+            json.dumps(baseline, indent=4, sort_keys=True) + "\n"
+        )
+
+
+@pytest.fixture
+def benchmark(benchmark_recorder):
+    return benchmark_recorder
+
+
+def pytest_terminal_summary(terminalreporter, config):
+    results = config.stash.get(BENCHMARK_RESULTS, None)
+    if not results:
+        return
+    terminalreporter.section("benchmarks")
+    for name, result in sorted(results.items()):
+        terminalreporter.write_line(
+            f"{name}: {result['seconds'] * 1000:.2f}ms, {result['queries']} queries"
+        )